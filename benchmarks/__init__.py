@@ -0,0 +1,10 @@
+"""Benchmarks of the services, run against a scratch PostgreSQL database.
+
+Run from the root of the repository, e.g.::
+
+    PYTHONPATH=src python -m benchmarks.api --database-uri postgresql+psycopg://... \\
+        --output results.json
+
+The database given is dropped and recreated. Results are written as JSON;
+``python -m benchmarks.compare old.json new.json`` reports regressions.
+"""
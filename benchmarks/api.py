@@ -0,0 +1,292 @@
+"""Load test of the public API.
+
+Seeds a scratch database, serves the app and drives /recommend, /rank and
+/detail with concurrent clients for a while each, then triggers
+/db/update a few times. Reports throughput and latency percentiles per
+endpoint.
+"""
+
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections.abc import Callable
+from typing import Dict, List, Tuple
+
+import click
+import requests
+
+from fo_services.services.sample_data import SampleScale
+
+from .report import environment, latency_summary, write_results
+from .seed import API_PASSWORD, API_USER, reset_database, seed
+from .training_stub import ModelExport, TrainingApiStub
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+# a request to send: method, path and JSON body
+Request = Tuple[str, str, dict | None]
+
+
+def recommend(scale: SampleScale, rng: random.Random) -> Request:
+    return ("GET", f"/api/v1/recommend/{rng.randrange(scale.users)}?n=10", None)
+
+
+def rank(scale: SampleScale, rng: random.Random) -> Request:
+    ids = [{"id": str(rng.randrange(scale.items))} for _ in range(50)]
+    return ("POST", "/api/v1/rank", {"user": str(rng.randrange(scale.users)), "ids": ids})
+
+
+def detail(scale: SampleScale, rng: random.Random) -> Request:
+    return (
+        "POST",
+        "/api/v1/detail",
+        {"id": str(rng.randrange(scale.items)), "user": str(rng.randrange(scale.users))},
+    )
+
+
+ENDPOINTS: Dict[str, Callable[[SampleScale, random.Random], Request]] = {
+    "recommend": recommend,
+    "rank": rank,
+    "detail": detail,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_up(url: str, process: subprocess.Popen, timeout: float = 60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise click.ClickException("the app server exited")
+        try:
+            requests.get(f"{url}/api/v1/swagger.json", timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    raise click.ClickException("the app server did not start")
+
+
+def run_load(
+    url: str,
+    make_request: Callable[[random.Random], Request],
+    concurrency: int,
+    duration: float,
+    warmup: int,
+    seed: int,
+) -> Dict:
+    """Send requests from `concurrency` clients for `duration` seconds, after
+    `warmup` requests per client that are not measured, but counted when
+    they fail."""
+    latencies: List[List[float]] = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    warmup_errors = [0] * concurrency
+    start_barrier = threading.Barrier(concurrency + 1)
+
+    def send(session: requests.Session, request: Request) -> bool:
+        method, path, body = request
+        try:
+            return session.request(method, url + path, json=body).status_code < 400
+        except requests.RequestException:
+            return False
+
+    def client(index: int):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        session.auth = (API_USER, API_PASSWORD)
+        for _ in range(warmup):
+            warmup_errors[index] += 0 if send(session, make_request(rng)) else 1
+        start_barrier.wait()
+        deadline = time.perf_counter() + duration
+        while True:
+            request = make_request(rng)
+            sent = time.perf_counter()
+            if sent >= deadline:
+                break
+            ok = send(session, request)
+            latencies[index].append(time.perf_counter() - sent)
+            errors[index] += 0 if ok else 1
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    if sum(warmup_errors):
+        click.echo(f"{sum(warmup_errors)} warmup requests failed", err=True)
+    all_latencies = [s for per_client in latencies for s in per_client]
+    return {
+        "concurrency": concurrency,
+        "requests": len(all_latencies),
+        "errors": sum(errors),
+        "warmup_errors": sum(warmup_errors),
+        "seconds": elapsed,
+        "throughput": len(all_latencies) / elapsed if elapsed else 0.0,
+        "latency_ms": latency_summary(all_latencies),
+    }
+
+
+def run_updates(url: str, updates: int) -> Dict:
+    """Trigger `updates` model updates one after another."""
+    latencies = []
+    errors = 0
+    for _ in range(updates):
+        sent = time.perf_counter()
+        response = requests.post(
+            f"{url}/maintenance/v1/db/update", auth=(API_USER, API_PASSWORD)
+        )
+        latencies.append(time.perf_counter() - sent)
+        errors += response.status_code >= 400
+    elapsed = sum(latencies)
+    return {
+        "concurrency": 1,
+        "requests": updates,
+        "errors": errors,
+        "seconds": elapsed,
+        "throughput": updates / elapsed if elapsed else 0.0,
+        "latency_ms": latency_summary(latencies),
+    }
+
+
+@click.command()
+@click.option(
+    "--database-uri",
+    envvar="FO_BENCHMARK_DATABASE_URI",
+    required=True,
+    help="Scratch PostgreSQL database, whose contents are dropped.",
+    show_envvar=True,
+)
+@click.option(
+    "--url",
+    default=None,
+    help="Benchmark a running app instead of starting one. It must use the same"
+    " database; updates load from its own training API.",
+)
+@click.option("--users", default=SampleScale.users, show_default=True)
+@click.option("--items", default=SampleScale.items, show_default=True)
+@click.option("--clusters", default=SampleScale.clusters, show_default=True)
+@click.option("--recos-per-user", default=SampleScale.recos_per_user, show_default=True)
+@click.option(
+    "--interactions-per-user", default=SampleScale.interactions_per_user, show_default=True
+)
+@click.option("--seed", "random_seed", default=0, show_default=True)
+@click.option("--concurrency", default=8, show_default=True, help="Clients per endpoint.")
+@click.option("--duration", default=10.0, show_default=True, help="Seconds of load per endpoint.")
+@click.option("--warmup", default=20, show_default=True, help="Requests per client before measuring.")
+@click.option("--updates", default=3, show_default=True, help="Model updates to run; 0 skips.")
+@click.option(
+    "--endpoint",
+    "endpoints",
+    multiple=True,
+    type=click.Choice(list(ENDPOINTS)),
+    help="Endpoints to load; all by default.",
+)
+@click.option("--output", "-o", default="-", help="File to write the JSON results to.")
+def main(
+    database_uri,
+    url,
+    users,
+    items,
+    clusters,
+    recos_per_user,
+    interactions_per_user,
+    random_seed,
+    concurrency,
+    duration,
+    warmup,
+    updates,
+    endpoints,
+    output,
+):
+    """Load test /recommend, /rank, /detail and /db/update."""
+    scale = SampleScale(
+        users=users,
+        items=items,
+        clusters=clusters,
+        interactions_per_user=interactions_per_user,
+        recos_per_user=recos_per_user,
+        seed=random_seed,
+    )
+    results = {
+        "benchmark": "api",
+        **environment(),
+        "scale": scale.as_dict(),
+        "settings": {"concurrency": concurrency, "duration": duration, "warmup": warmup},
+    }
+
+    click.echo(f"seeding {scale}", err=True)
+    reset_database(database_uri)
+    results["seed_seconds"] = seed(scale)
+
+    with (
+        TrainingApiStub(ModelExport(scale)) as training_api,
+        tempfile.TemporaryDirectory() as instance,
+    ):
+        server = None
+        if url is None:
+            port = _free_port()
+            url = f"http://127.0.0.1:{port}"
+            config = {
+                "SQLALCHEMY_DATABASE_URI": database_uri,
+                "TRAINING_API_URL": training_api.url,
+                "LOG_LEVEL": "WARNING",
+                "METRICS_DIR": os.path.join(instance, "metrics"),
+                "MODEL_FILE": os.path.join(instance, "model.bin"),
+                "INTERACTION_MATRIX_FILE": os.path.join(instance, "interactions.npz"),
+            }
+            server = subprocess.Popen(
+                [
+                    sys.executable,
+                    "-m",
+                    "benchmarks.serve",
+                    "127.0.0.1",
+                    str(port),
+                    json.dumps(config),
+                ],
+                env={
+                    **os.environ,
+                    "PYTHONPATH": os.pathsep.join(
+                        filter(None, [SRC, os.path.dirname(SRC), os.environ.get("PYTHONPATH")])
+                    ),
+                },
+            )
+        try:
+            if server is not None:
+                _wait_until_up(url, server)
+            results["endpoints"] = {}
+            for name in endpoints or ENDPOINTS:
+                click.echo(f"loading {name}", err=True)
+                results["endpoints"][name] = run_load(
+                    url,
+                    lambda rng, make=ENDPOINTS[name]: make(scale, rng),
+                    concurrency,
+                    duration,
+                    warmup,
+                    random_seed,
+                )
+            if updates:
+                click.echo("updating the model", err=True)
+                results["endpoints"]["update"] = run_updates(url, updates)
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+    write_results(output, results)
+
+
+if __name__ == "__main__":
+    main()
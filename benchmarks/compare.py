@@ -0,0 +1,44 @@
+"""Compares two benchmark results and fails on regressions.
+
+An endpoint regressed when its p95 latency grew, or its throughput shrank,
+by more than the tolerance.
+"""
+
+import json
+import sys
+
+import click
+
+
+def regressions(baseline: dict, current: dict, tolerance: float) -> list[str]:
+    found = []
+    for name, before in baseline.get("endpoints", {}).items():
+        after = current.get("endpoints", {}).get(name)
+        if after is None:
+            continue
+        p95_before, p95_after = before["latency_ms"]["p95"], after["latency_ms"]["p95"]
+        if p95_before and p95_after > p95_before * (1 + tolerance):
+            found.append(f"{name}: p95 {p95_before:.1f} ms -> {p95_after:.1f} ms")
+        if after["throughput"] < before["throughput"] * (1 - tolerance):
+            found.append(
+                f"{name}: throughput {before['throughput']:.1f}/s -> {after['throughput']:.1f}/s"
+            )
+        if after["errors"] > before["errors"]:
+            found.append(f"{name}: errors {before['errors']} -> {after['errors']}")
+    return found
+
+
+@click.command()
+@click.argument("baseline", type=click.File())
+@click.argument("current", type=click.File())
+@click.option("--tolerance", default=0.2, show_default=True, help="Allowed relative change.")
+def main(baseline, current, tolerance):
+    """Compare the CURRENT results with those of BASELINE."""
+    found = regressions(json.load(baseline), json.load(current), tolerance)
+    for line in found:
+        click.echo(line)
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""Scratch databases of a given scale for the benchmarks."""
+
+import time
+
+from sqlalchemy import text
+from werkzeug.security import generate_password_hash
+
+import fo_services.db as db
+from fo_services.migrations import upgrade
+from fo_services.models import User
+from fo_services.services.sample_data import SampleData, SampleScale
+
+API_USER = "benchmark"
+API_PASSWORD = "benchmark"
+
+
+def reset_database(database_uri: str):
+    """Drop everything in the database and create the current schema."""
+    # a transaction left open by an earlier seed would block the drop
+    db.db_session.remove()
+    db.configure_engine({"SQLALCHEMY_DATABASE_URI": database_uri})
+    db.Base.metadata.drop_all(db.get_engine())
+    upgrade()
+
+
+def seed(scale: SampleScale) -> dict:
+    """Fill a freshly reset database; returns the seconds each step took."""
+    timings = {}
+    data = SampleData(scale)
+
+    start = time.perf_counter()
+    db.db_session.add(
+        User(
+            name=API_USER,
+            password=generate_password_hash(API_PASSWORD),
+            is_ldap_user=False,
+        )
+    )
+    db.db_session.commit()
+    db.bulk_load_users(*data.users())
+    timings["users"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db.bulk_load_interactions(data.interactions(), months=data.months())
+    timings["interactions"] = time.perf_counter() - start
+
+    # the same model the training API stub serves
+    start = time.perf_counter()
+    db.load_model_arrays(data.clusters(), data.recommendations())
+    timings["model"] = time.perf_counter() - start
+
+    with db.get_engine().connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text("VACUUM ANALYZE"))
+    return timings
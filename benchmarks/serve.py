@@ -0,0 +1,26 @@
+"""Serves the app for the benchmarks, in a process of its own.
+
+Werkzeug's threaded server stands in for uwsgi; numbers are comparable
+between runs, not with a deployment. Point `benchmarks.api --url` at a
+running deployment for those.
+"""
+
+import json
+import logging
+import sys
+
+from werkzeug.serving import run_simple
+
+from fo_services import create_app
+
+
+def main():
+    host, port, config = sys.argv[1], int(sys.argv[2]), json.loads(sys.argv[3])
+    app = create_app(config)
+    # one access log line per request would be measured, too
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    run_simple(host, port, app, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""A stand-in for the exports of the training API.
+
+Serves generated cluster assignments and recommendations as NDJSON on the
+paths `TrainingApiClient` reads, so updates can be run without a trained
+model. Rows are generated by `SampleData` while they are sent: every
+request returns the same export.
+"""
+
+import json
+import threading
+from collections.abc import Iterator
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fo_services.services.sample_data import SampleData, SampleScale
+
+# rows per written chunk
+BLOCK = 10_000
+
+
+@dataclass(frozen=True)
+class ModelExport:
+    """The clusters and recommendations `flask sample-data generate` loads."""
+
+    scale: SampleScale
+
+    def cluster_rows(self) -> Iterator[dict]:
+        items, clusters, ranks = SampleData(self.scale).clusters()
+        for item, cluster, rank in zip(items.tolist(), clusters.tolist(), ranks.tolist()):
+            yield {"id": item, "cluster": cluster, "rank": rank}
+
+    def recommendation_rows(self) -> Iterator[dict]:
+        for users, items, ranks in SampleData(self.scale).recommendations():
+            # the blocks are large; a chunk of Python objects at a time
+            for start in range(0, len(users), BLOCK):
+                chunk = slice(start, start + BLOCK)
+                for user, item, rank in zip(
+                    users[chunk].tolist(), items[chunk].tolist(), ranks[chunk].tolist()
+                ):
+                    yield {"user": user, "item": item, "rank": rank}
+
+
+def _ndjson(rows: Iterator[dict]) -> Iterator[bytes]:
+    lines = []
+    for row in rows:
+        lines.append(json.dumps(row, separators=(",", ":")))
+        if len(lines) == BLOCK:
+            yield ("\n".join(lines) + "\n").encode()
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode()
+
+
+class TrainingApiStub(object):
+    """Serves `export` on a local port until stopped.
+
+    With `prerender`, the exports are encoded once up front, so requests
+    measure the transfer rather than the generation of the rows.
+    """
+
+    def __init__(
+        self,
+        export: ModelExport,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        prerender: bool = False,
+    ):
+        self.export = export
+        exports = {
+            "/api/v1/export/wisski/cluster": export.cluster_rows,
+            "/api/v1/export/wisski/recommendations": export.recommendation_rows,
+        }
+        rendered = (
+            {path: b"".join(_ndjson(rows())) for path, rows in exports.items()}
+            if prerender
+            else {}
+        )
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in exports:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.end_headers()
+                # HTTP/1.0: the end of the export is the end of the connection
+                if self.path in rendered:
+                    self.wfile.write(rendered[self.path])
+                    return
+                for chunk in _ndjson(exports[self.path]()):
+                    self.wfile.write(chunk)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "TrainingApiStub":
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "TrainingApiStub":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,228 @@
+"""Benchmark of model updates.
+
+For every export size, seeds a scratch database, serves generated exports
+from the training API stub and runs `UpdaterService.reload_data`, which
+streams them through `update_model_infos`, in a process of its own. Reports
+the seconds of every step and the peak memory of that process, and fails
+when they exceed the budgets of `update_budgets.toml`.
+
+The exports are downloaded and parsed while they are staged, so `fetch`
+and `parse` are measured in a separate pass over the same exports;
+`stage_*` includes them.
+"""
+
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from typing import Dict, List
+
+import click
+import requests
+from sqlalchemy import text
+
+from fo_services.services.sample_data import SampleScale
+
+from .report import environment, write_results
+from .seed import reset_database, seed
+from .training_stub import ModelExport, TrainingApiStub
+
+BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "update_budgets.toml")
+EXPORTS = {
+    "clusters": "/api/v1/export/wisski/cluster",
+    "recommendations": "/api/v1/export/wisski/recommendations",
+}
+
+
+def fetch_and_parse(url: str) -> Dict:
+    """Seconds to download and to parse the exports, and their rows."""
+    fetch = parse = 0.0
+    rows = {}
+    for name, path in EXPORTS.items():
+        start = time.perf_counter()
+        body = requests.get(url + path).content
+        fetch += time.perf_counter() - start
+
+        start = time.perf_counter()
+        rows[name] = sum(1 for line in body.splitlines() if line.strip() and json.loads(line))
+        parse += time.perf_counter() - start
+    return {"fetch": fetch, "parse": parse, "rows": rows}
+
+
+def run_update(config: Dict, delta: bool) -> Dict:
+    """Update the model like `flask update-model`; run in a fresh process,
+    so the peak memory is that of the update."""
+    from fo_services import create_app
+    from fo_services.client.api_clients import TrainingApiClient
+    from fo_services.db import db_session
+    from fo_services.services.updater import UpdaterService
+
+    app = create_app(config)
+    with app.app_context():
+        updater = UpdaterService(TrainingApiClient(config["TRAINING_API_URL"]))
+        start = time.perf_counter()
+        result = updater.reload_data(delta=delta)
+        phases = dict(result["phases"])
+        # writing the model file for the workers
+        phases["publish"] = time.perf_counter() - start - result["elapsed"]
+
+        start = time.perf_counter()
+        clusters, recommendations = db_session.execute(
+            text(
+                "SELECT (SELECT count(*) FROM item_cluster WHERE version = :v),"
+                " (SELECT count(*) FROM user_recommendation_model WHERE version = :v)"
+            ),
+            {"v": result["model_version"]},
+        ).one()
+        phases["verify"] = time.perf_counter() - start
+        db_session.remove()
+
+    return {
+        "result": result,
+        "phases": phases,
+        "stored": {"clusters": clusters, "recommendations": recommendations},
+        # kilobytes on Linux
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def over_budget(results: Dict, budgets: Dict) -> List[str]:
+    """Phases, totals and peak memory above their budget, and row counts
+    that do not match the export."""
+    found = []
+    for size, measured in results["sizes"].items():
+        if measured["stored"] != measured["rows"]:
+            found.append(f"{size} rows: stored {measured['stored']}, exported {measured['rows']}")
+        for name, limit in budgets.get(size, {}).items():
+            if name == "peak_memory_mb":
+                value, unit = measured["peak_memory_mb"], " MiB"
+            elif name == "total":
+                value, unit = measured["seconds"], "s"
+            elif name in measured["phases"]:
+                value, unit = measured["phases"][name], "s"
+            else:
+                continue
+            if value > limit:
+                found.append(f"{size} rows: {name} {value:.1f}{unit} > {limit}{unit}")
+    return found
+
+
+@click.command()
+@click.option(
+    "--database-uri",
+    envvar="FO_BENCHMARK_DATABASE_URI",
+    required=True,
+    help="Scratch PostgreSQL database, whose contents are dropped.",
+    show_envvar=True,
+)
+@click.option(
+    "--rows",
+    "sizes",
+    multiple=True,
+    type=int,
+    default=(10_000, 100_000, 1_000_000),
+    show_default=True,
+    help="Rows per export; users get --recos-per-user recommendations each.",
+)
+@click.option("--clusters", default=SampleScale.clusters, show_default=True)
+@click.option("--recos-per-user", default=SampleScale.recos_per_user, show_default=True)
+@click.option(
+    "--interactions-per-user", default=SampleScale.interactions_per_user, show_default=True
+)
+@click.option("--seed", "random_seed", default=0, show_default=True)
+@click.option(
+    "--delta",
+    is_flag=True,
+    help="Apply the export as a delta to a model of another seed.",
+)
+@click.option(
+    "--budgets",
+    type=click.File("rb"),
+    default=BUDGETS,
+    show_default=True,
+    help="Seconds and MiB allowed per export size.",
+)
+@click.option("--output", "-o", default="-", help="File to write the JSON results to.")
+def main(
+    database_uri,
+    sizes,
+    clusters,
+    recos_per_user,
+    interactions_per_user,
+    random_seed,
+    delta,
+    budgets,
+    output,
+):
+    """Time model updates from exports of every size."""
+    results = {
+        "benchmark": "update",
+        **environment(),
+        "settings": {
+            "clusters": clusters,
+            "recos_per_user": recos_per_user,
+            "interactions_per_user": interactions_per_user,
+            "seed": random_seed,
+            "delta": delta,
+        },
+        "sizes": {},
+    }
+    spawn = get_context("spawn")
+
+    for rows in sizes:
+        scale = SampleScale(
+            users=max(rows // recos_per_user, 1),
+            items=rows,
+            clusters=clusters,
+            interactions_per_user=interactions_per_user,
+            recos_per_user=recos_per_user,
+            seed=random_seed,
+        )
+        click.echo(f"seeding {scale}", err=True)
+        reset_database(database_uri)
+        seed(scale)
+
+        # a delta against the seeded model changes most rows
+        served = SampleScale(**{**scale.as_dict(), "seed": random_seed + 1}) if delta else scale
+        with (
+            TrainingApiStub(ModelExport(served), prerender=True) as training_api,
+            tempfile.TemporaryDirectory() as instance,
+        ):
+            measured = fetch_and_parse(training_api.url)
+            config = {
+                "SQLALCHEMY_DATABASE_URI": database_uri,
+                "TRAINING_API_URL": training_api.url,
+                "LOG_LEVEL": "WARNING",
+                "METRICS_DIR": os.path.join(instance, "metrics"),
+                "MODEL_FILE": os.path.join(instance, "model.bin"),
+                "INTERACTION_MATRIX_FILE": os.path.join(instance, "interactions.npz"),
+            }
+            click.echo(f"updating from {rows} rows", err=True)
+            with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as worker:
+                update = worker.submit(run_update, config, delta).result()
+
+        phases = {"fetch": measured["fetch"], "parse": measured["parse"], **update["phases"]}
+        results["sizes"][str(rows)] = {
+            "scale": scale.as_dict(),
+            "rows": measured["rows"],
+            "stored": update["stored"],
+            "seconds": sum(update["phases"].values()),
+            "phases": phases,
+            "peak_memory_mb": update["peak_memory_mb"],
+            "result": update["result"],
+        }
+
+    write_results(output, results)
+    found = over_budget(results, tomllib.load(budgets))
+    for line in found:
+        click.echo(line, err=True)
+    sys.exit(1 if found else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 # inspired by https://github.com/matrix-org/matrix-synapse-ldap3/blob/main/ldap_auth_provider.py
 import logging
+import queue
 import ssl
+import threading
+import time
+from contextlib import contextmanager
 from dataclasses import dataclass
 from typing import List, Union, Tuple, Dict, Any, Iterable
 
@@ -11,6 +15,17 @@ from ldap3 import ALL
 logger = logging.getLogger(__name__)
 
 
+# results of a search that are answers rather than errors: success, and a
+# search base that doesn't exist
+_SEARCH_RESULTS = (0, 32)
+# errors after which a search is retried on a fresh connection
+_RETRIED_ERRORS = (
+    ldap3.core.exceptions.LDAPCommunicationError,
+    ldap3.core.exceptions.LDAPOperationResult,
+    OSError,
+)
+
+
 class LDAPExtension(object):
     def __init__(self):
         self.client = None
@@ -38,6 +53,12 @@ class LDAPConfig:
     bind_dn: str
     bind_password: str
     filter: str
+    # pre-bound service connections used for searching
+    pool_size: int = 4
+    # seconds to wait for a free service connection
+    pool_timeout: float = 5.0
+    # seconds after which a service connection is replaced
+    pool_recycle: float = 600.0
 
 
 class LDAPAuthClient:
@@ -49,15 +70,36 @@ class LDAPAuthClient:
         self.ldap_bind_password = config.bind_password
         self.ldap_filter = config.filter
         self.ldap_base = config.base
-        self.connection: ldap3.Connection | None = None
+        self.pool_size = config.pool_size
+        self.pool_timeout = config.pool_timeout
+        self.pool_recycle = config.pool_recycle
+
+        self._server: ldap3.ServerPool | None = None
+        # idle service connections with the time they were bound
+        self._pool: queue.LifoQueue[Tuple[ldap3.Connection, float]] = queue.LifoQueue()
+        self._pool_lock = threading.Lock()
+        self._pool_open = 0
+        self._metrics = {
+            "created": 0,
+            "reused": 0,
+            "discarded": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "exhausted": 0,
+            "user_binds": 0,
+            "retries": 0,
+        }
 
     def get_server(self):
-        return ldap3.ServerPool(
-            [
-                ldap3.Server(uri, get_info=ALL, tls=self.ldap_tls)
-                for uri in self.ldap_uris
-            ]
-        )
+        # the pool keeps track of unreachable servers, so it must be long-lived
+        if self._server is None:
+            self._server = ldap3.ServerPool(
+                [
+                    ldap3.Server(uri, get_info=ALL, tls=self.ldap_tls)
+                    for uri in self.ldap_uris
+                ]
+            )
+        return self._server
 
     @staticmethod
     def parse_config(config) -> LDAPConfig:
@@ -76,10 +118,22 @@ class LDAPAuthClient:
             bind_password=config["bind_password"],
             base=config["base"],
             filter=filter,
+            pool_size=config.get("pool_size", 4),
+            pool_timeout=config.get("pool_timeout", 5.0),
+            pool_recycle=config.get("pool_recycle", 600.0),
         )
 
         return ldap_config
 
+    def metrics(self) -> Dict[str, Any]:
+        with self._pool_lock:
+            return {
+                **self._metrics,
+                "open": self._pool_open,
+                "idle": self._pool.qsize(),
+                "max_size": self.pool_size,
+            }
+
     def auth(self, username: str, password: str):
         if not password:
             return None
@@ -118,15 +172,6 @@ class LDAPAuthClient:
             if self.ldap_bind_dn is None or self.ldap_bind_password is None:
                 raise ValueError("Missing bind DN or bind password")
 
-            result, conn = self.simple_bind(
-                server=server,
-                bind_dn=self.ldap_bind_dn,
-                password=self.ldap_bind_password,
-            )
-
-            if not result or not conn:
-                return (False, None, None)
-
             # filters are of the form "(key=value)"
             query = "".join([f"({filter[0]}={filter[1]})" for filter in filters])
             if self.ldap_filter:
@@ -135,19 +180,21 @@ class LDAPAuthClient:
             query = f"(&{query})"
 
             logger.debug("LDAP search filter: %s", query)
-            conn.search(
-                search_base=self.ldap_base, search_filter=query, attributes=["uid"]
-            )
-
-            responses = [r for r in conn.response if r["type"] == "searchResEntry"]
+            try:
+                responses = self._search(server, query)
+            except ldap3.core.exceptions.LDAPBindError as e:
+                logger.warning("%s", e)
+                return (False, None, None)
 
             if len(responses) == 1:
                 user_dn = responses[0]["dn"]
                 logger.debug("LDAP search found dn: %s", user_dn)
-                conn.unbind()
                 result, conn = self.simple_bind(
                     server=server, bind_dn=user_dn, password=password
                 )
+                if conn is not None:
+                    # the user bind only proves the password; don't keep it open
+                    conn.unbind()
 
                 return (result, conn, responses[0])
             else:
@@ -160,53 +207,199 @@ class LDAPAuthClient:
                         filters,
                     )
 
-                conn.unbind()
-
                 return (False, None, None)
 
         except ldap3.core.exceptions.LDAPException as e:
             logger.critical("Error during LDAP authentication: %s", e)
             raise
 
+    def _search(
+        self, server: ldap3.ServerPool | ldap3.Server, query: str
+    ) -> List[Dict[str, Any]]:
+        # a pooled connection may have been dropped by the server while idle,
+        # which only shows when it is used: retry once on a fresh connection
+        try:
+            return self._search_once(server, query, fresh=False)
+        except _RETRIED_ERRORS as e:
+            logger.warning("LDAP search failed, retrying on a fresh connection: %s", e)
+            with self._pool_lock:
+                self._metrics["retries"] += 1
+        return self._search_once(server, query, fresh=True)
+
+    def _search_once(
+        self, server: ldap3.ServerPool | ldap3.Server, query: str, fresh: bool
+    ) -> List[Dict[str, Any]]:
+        with self.service_connection(server, fresh=fresh) as conn:
+            conn.search(
+                search_base=self.ldap_base,
+                search_filter=query,
+                attributes=["uid"],
+            )
+            if conn.result and conn.result["result"] not in _SEARCH_RESULTS:
+                raise ldap3.core.exceptions.LDAPOperationResult(
+                    result=conn.result["result"],
+                    description=conn.result["description"],
+                )
+            return [r for r in conn.response if r["type"] == "searchResEntry"]
+
+    @contextmanager
+    def service_connection(
+        self, server: ldap3.ServerPool | ldap3.Server, fresh: bool = False
+    ):
+        """Borrow a connection bound as the service account from the pool.
+
+        With `fresh`, the idle connections are dropped first, for a newly
+        bound one.
+        """
+        if fresh:
+            self.close()
+        conn, bound_at = self._acquire(server)
+        healthy = False
+        try:
+            yield conn
+            healthy = True
+        finally:
+            if healthy and conn.bound and not conn.closed:
+                self._pool.put((conn, bound_at))
+            else:
+                self._discard(conn)
+
+    def _acquire(self, server) -> Tuple[ldap3.Connection, float]:
+        deadline = time.monotonic() + self.pool_timeout
+        waited = False
+        while True:
+            try:
+                conn, bound_at = self._pool.get_nowait()
+            except queue.Empty:
+                conn = None
+
+            if conn is None:
+                with self._pool_lock:
+                    can_open = self._pool_open < self.pool_size
+                    if can_open:
+                        self._pool_open += 1
+                if can_open:
+                    return self._open_service_connection(server)
+
+                # everything is checked out; wait for a connection to come back
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._pool_lock:
+                        self._metrics["exhausted"] += 1
+                    raise ldap3.core.exceptions.LDAPException(
+                        f"No LDAP connection available within {self.pool_timeout}s"
+                    )
+                start = time.monotonic()
+                try:
+                    conn, bound_at = self._pool.get(timeout=remaining)
+                except queue.Empty:
+                    continue
+                finally:
+                    with self._pool_lock:
+                        self._metrics["waits"] += 0 if waited else 1
+                        self._metrics["wait_seconds"] += time.monotonic() - start
+                    waited = True
+
+            if self._is_usable(conn, bound_at):
+                with self._pool_lock:
+                    self._metrics["reused"] += 1
+                return conn, bound_at
+            self._discard(conn)
+
+    def _open_service_connection(self, server) -> Tuple[ldap3.Connection, float]:
+        try:
+            result, conn = self.simple_bind(
+                server=server,
+                bind_dn=self.ldap_bind_dn,
+                password=self.ldap_bind_password,
+            )
+        except Exception:
+            with self._pool_lock:
+                self._pool_open -= 1
+            raise
+
+        if not result or not conn:
+            with self._pool_lock:
+                self._pool_open -= 1
+            raise ldap3.core.exceptions.LDAPBindError(
+                f"LDAP service bind failed for {self.ldap_bind_dn}"
+            )
+
+        with self._pool_lock:
+            self._metrics["created"] += 1
+        return conn, time.monotonic()
+
+    def _is_usable(self, conn: ldap3.Connection, bound_at: float) -> bool:
+        if time.monotonic() - bound_at > self.pool_recycle:
+            return False
+        return conn.bound and not conn.closed
+
+    def _discard(self, conn: ldap3.Connection):
+        with self._pool_lock:
+            self._pool_open -= 1
+            self._metrics["discarded"] += 1
+        try:
+            conn.unbind()
+        except ldap3.core.exceptions.LDAPException:
+            pass
+
+    def close(self):
+        """Unbind all idle service connections."""
+        while True:
+            try:
+                conn, _ = self._pool.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(conn)
+
+    def _new_connection(
+        self, server: ldap3.ServerPool | ldap3.Server, bind_dn: str, password
+    ) -> ldap3.Connection:
+        return ldap3.Connection(
+            server,
+            user=bind_dn,
+            password=password,
+            authentication=ldap3.SIMPLE,
+            read_only=True,
+        )
+
     def simple_bind(
         self, server: ldap3.ServerPool | ldap3.Server, bind_dn: str, password
     ):
+        """Bind a new connection; the caller owns the returned connection."""
         try:
-            if self.connection is None:
-                self.connection = ldap3.Connection(
-                    server,
-                    user=bind_dn,
-                    password=password,
-                    authentication=ldap3.SIMPLE,
-                    read_only=True,
-                )
+            connection = self._new_connection(server, bind_dn, password)
             logger.debug(
-                "Established connection in simple bind mode: %s", self.connection
+                "Established connection in simple bind mode: %s", connection
             )
 
             if self.ldap_starttls:
-                self.connection.open()
-                self.connection.start_tls()
+                connection.open()
+                connection.start_tls()
                 logger.debug(
                     "Upgraded LDAP connection in simple bind mode through"
                     "StartTLS: %s",
-                    self.connection,
+                    connection,
                 )
 
-            if self.connection.bind():
+            if bind_dn != self.ldap_bind_dn:
+                with self._pool_lock:
+                    self._metrics["user_binds"] += 1
+
+            if connection.bind():
                 logger.debug("LDAP bind successful in simple mode")
-                return True, self.connection
+                return True, connection
 
             logger.info(
                 "LDAP bind failed for %s: %s",
                 bind_dn,
                 (
-                    self.connection.result["description"]
-                    if self.connection.result
-                    else self.connection.last_error
+                    connection.result["description"]
+                    if connection.result
+                    else connection.last_error
                 ),
             )
-            self.connection.unbind()
+            connection.unbind()
             return False, None
 
         except ldap3.core.exceptions.LDAPException as e:
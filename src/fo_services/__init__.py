@@ -2,7 +2,7 @@ import logging
 import os
 import tomllib
 
-from flask import Flask, flash, render_template
+from flask import Flask, flash, g, render_template
 
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -19,7 +19,6 @@ KG = KGHandler()
 def create_app(test_config=None):
     global KG
     app = Flask(__name__)
-    app.logger.setLevel(logging.DEBUG)
     app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
     app.config.from_mapping(
         SECRET_KEY="dev",
@@ -40,15 +39,56 @@ def create_app(test_config=None):
     except Exception:
         pass
 
+    from . import structured_logging
+
+    structured_logging.init_app(app)
+
     @app.route("/", methods=["GET"])
     def index():
         flash("This is a successful message", "success")
         flash("This is an error message", "error")
         return render_template("index.html")
 
-    from .db import db_session, init_db
+    from .db import (
+        begin_query_tracking,
+        configure_engine,
+        db_session,
+        dispose_engine,
+        end_query_tracking,
+        set_known_user_probe,
+    )
+
+    configure_engine(app.config)
+
+    # migrations are applied by `flask schema upgrade` before the workers start
+    try:
+        from .migrations import pending_migrations
+
+        pending = pending_migrations()
+        if pending:
+            logger.warning(
+                f"{len(pending)} pending schema migrations, run `flask schema upgrade`"
+            )
+    except Exception:
+        logger.exception("could not check the schema version")
+    finally:
+        # uwsgi forks the workers after loading the app; they must not share
+        # the connections of the master
+        dispose_engine()
+
+    @app.before_request
+    def begin_request_queries():
+        g.query_tracking = begin_query_tracking()
 
-    init_db()
+    @app.teardown_request
+    def end_request_queries(exception=None):
+        token = g.pop("query_tracking", None)
+        if token is not None:
+            g.query_stats = end_query_tracking(token)
+
+    from . import metrics
+
+    metrics.init_app(app)
 
     @app.teardown_appcontext
     def shutdown_session(exception=None):
@@ -58,7 +98,13 @@ def create_app(test_config=None):
         ldap_config = tomllib.load(f)
 
     LDAP.init_app(app, ldap_config)
+    KG.model_file = app.config.get(
+        "MODEL_FILE", os.path.join(app.instance_path, "model.bin")
+    )
     KG.load_sampled_data()
+    # recommendations reference rec_user, so all users of the model exist;
+    # they are looked up in the shared arrays rather than copied per worker
+    set_known_user_probe(KG.has_user)
 
     from .api_app_v1 import bp as api
     from .api_maintenance_v1 import bp as maintenance
@@ -73,7 +119,15 @@ def create_app(test_config=None):
     app.register_blueprint(api)
     app.register_blueprint(maintenance)
 
+    from .cli.interactions import interactions
+    from .cli.model_version import model_version
+    from .cli.sample_data import sample_data
+    from .cli.schema import schema
     from .cli.update_model import update_model
     app.cli.add_command(update_model)
+    app.cli.add_command(model_version)
+    app.cli.add_command(interactions)
+    app.cli.add_command(schema)
+    app.cli.add_command(sample_data)
 
     return app
@@ -1,15 +1,19 @@
 import json
-from datetime import datetime
 import logging
 
-from flask import Blueprint, request
+from flask import Blueprint, current_app, request
 from flask_httpauth import HTTPBasicAuth
-from .page_auth import check_login
+from .page_auth import verify_credentials
 from . import KG
+from .kgstuff.pagination import CursorCodec, InvalidCursor, StaleCursor
+from .kgstuff.ranking import UNKNOWN_ITEM
+from .metrics import timed_representation
 
 from flask_restx import Api, Resource, fields, reqparse
+from flask_restx.representations import output_json
 
-from .db import log_user_detail_interaction
+from .services.interaction_logger import interaction_logger, query_logger
+from .structured_logging import StructuredMessage
 
 bp = Blueprint("api", __name__, url_prefix="/api/v1")
 
@@ -18,22 +22,19 @@ flog = logging.getLogger(__name__)
 auth = HTTPBasicAuth()
 
 
-@auth.verify_password
-def verify_password(the_user, password):
-    flog.info(f"trying to login {the_user}")
-    success, known_user = check_login(the_user, password)
-    if success:
-        return known_user.name
-    return None
-
+@bp.record_once
+def configure_interaction_logger(state):
+    config = state.app.config
+    interaction_logger.max_queue = config.get("INTERACTION_QUEUE_SIZE", 10000)
+    interaction_logger.batch_size = config.get("INTERACTION_BATCH_SIZE", 500)
+    interaction_logger.flush_interval = config.get("INTERACTION_FLUSH_INTERVAL", 1.0)
+    interaction_logger.block_timeout = config.get("INTERACTION_BLOCK_TIMEOUT", 0.0)
 
-class StructuredMessage:
-    def __init__(self, **kwargs):
-        self.kwargs = kwargs
 
-    def __str__(self):
-        self.kwargs.update({"time": str(datetime.now())})
-        return "%s" % (json.dumps(self.kwargs))
+@auth.verify_password
+def verify_password(the_user, password):
+    flog.debug("trying to login %s", the_user)
+    return verify_credentials(the_user, password)
 
 
 _ = StructuredMessage  # optional, to improve readability
@@ -46,6 +47,7 @@ api = Api(
     authorizations={"basicAuth": {"type": "basic"}},
     security="basic",
 )
+api.representations["application/json"] = timed_representation("serialize", output_json)
 
 queries = api.namespace(
     "Queries",
@@ -91,8 +93,9 @@ queryObject = api.model(
 
 queries_doc = (
     "Extend a query by additional keywords."
-    " <br><br><strong>Testing</strong><br>For testing purposes, this endpoint"
-    " will simply echo the provided query."
+    "<br><br>Keywords are taken from catalogue entities matching the query,"
+    " including completions of its last word, and from terms used together"
+    " with the query's words in earlier searches."
 )
 
 
@@ -116,7 +119,11 @@ class Query(Resource):
         parser.add_argument("query", type=str, help="The search query made by the user")
         args = parser.parse_args()
 
-        extended = args["query"]
+        query = args["query"] or ""
+        keywords = KG.expand_query(query)
+        # learnt from by the query index built after the next model update
+        query_logger.log(query)
+        extended = " ".join([query, *keywords]) if query else args["query"]
 
         flog.info(
             _(
@@ -189,7 +196,10 @@ rankingObject = api.model(
         "meta": fields.String(
             required=True,
             description=("Metadata describing the re-ranking; an escaped JSON-string"),
-            example=('[{"reason": "profile"}, {"removed":' ' ["25"]}]'),
+            example=(
+                '[{"reason": "profile"}, {"removed": []}, {"recommended":'
+                ' ["25"]}, {"related": []}]'
+            ),
             strict=False,
             validate=False,
         ),
@@ -197,13 +207,21 @@ rankingObject = api.model(
 )
 
 ranking_doc = (
-    "Re-rank and potentially extend the supplied set of WissKI entities."
-    "<br><br><strong>Testing</strong><br>For testing purposes, this"
-    " endpoint will replace the first item in `ids` (index 0) with the entity"
-    " `374` (Wolfgang Petry)."
+    "Re-rank the supplied set of WissKI entities for the given user."
+    "<br><br>Entities recommended to the user by the model, and entities from"
+    " clusters the user is interested in, are moved to the front; otherwise"
+    " the order of the search is kept. Nothing is removed or added. `meta`"
+    " lists the reason and the ids that were boosted."
 )
 
 
+def _parse_id(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return UNKNOWN_ITEM
+
+
 @ranking.route("", doc={"description": ranking_doc})
 class RankingResults(Resource):
     @auth.login_required
@@ -230,14 +248,21 @@ class RankingResults(Resource):
         )
         args = parser.parse_args()
 
-        if len(args["ids"]) == 0 or args["ids"] is None:
-            response = [{"id": "374"}]
-            meta = json.dumps([{"reason": "empty"}])
-        else:
-            response = args["ids"]
-            repl = response[0]
-            response[0] = {"id": "374"}
-            meta = json.dumps([{"reason": "profile"}, {"removed": repl["id"]}])
+        ids = args["ids"] or []
+        user = _parse_id(args["user"])
+        ranking = KG.rank(
+            None if user == UNKNOWN_ITEM else user,
+            (_parse_id(i.get("id")) for i in ids),
+        )
+        response = [ids[i] for i in ranking["order"]]
+        meta = json.dumps(
+            [
+                {"reason": ranking["reason"]},
+                {"removed": []},
+                {"recommended": [ids[i].get("id") for i in ranking["recommended"]]},
+                {"related": [ids[i].get("id") for i in ranking["affine"]]},
+            ]
+        )
 
         flog.info(
             _(
@@ -302,8 +327,9 @@ detailObject = api.model(
 
 detail_doc: str = (
     "Provide additional information for detail views of WissKI entities."
-    "<br><br><strong>Testing</strong><br>For testing purposes, this endpoint"
-    "will provide a fixed JSON-array of objects."
+    "<br><br>`meta` suggests related entities: the best ranked entities of"
+    " the same cluster and entities viewed by the same users. The view is"
+    " recorded in the interaction history of the user."
 )
 
 
@@ -332,18 +358,14 @@ class DetailResults(Resource):
         )
         args = parser.parse_args()
 
+        related = KG.related_items(args["id"]) if isinstance(args["id"], int) else []
         meta = json.dumps(
             [
                 {"type": "suggestion"},
-                {
-                    "ids": [
-                        "1",
-                        "2",
-                    ]
-                },
+                {"ids": [str(i) for i in related]},
             ]
         )
-        log_user_detail_interaction(args["user"], args["id"])
+        interaction_logger.log(args["user"], args["id"])
 
         return DetailResponse(meta=meta)
 
@@ -356,8 +378,9 @@ recommendations = api.namespace(
 
 
 class RecommendationResponse(object):
-    def __init__(self, items) -> None:
+    def __init__(self, items, next=None) -> None:
         self.items = items
+        self.next = next
 
 
 recommendationResponse = api.model(
@@ -368,11 +391,28 @@ recommendationResponse = api.model(
             required=True,
             description="a comma separated list of wisski entitiy ids",
             example=["1", "3", "9"],
-        )
+        ),
+        "next": fields.String(
+            required=False,
+            description=(
+                "Cursor of the next page, to be passed as `cursor`; empty on"
+                " the last page"
+            ),
+            example="WzQyLFsxLDBdLDEwXQ.abc",
+        ),
     },
 )
 
-recommendations_doc = "Retrieve a list of recommendations for a given user."
+recommendations_doc = (
+    "Retrieve a list of recommendations for a given user."
+    "<br><br>Pass the `next` cursor of a response as `cursor` to get the"
+    " following page of the same model generation. A cursor stops working"
+    " once a new model is served (410); start again without a cursor then."
+)
+
+
+def _cursor_codec() -> CursorCodec:
+    return CursorCodec(current_app.config["SECRET_KEY"])
 
 
 @recommendations.route("/", doc={"description": recommendations_doc})
@@ -386,17 +426,32 @@ recommendations_doc = "Retrieve a list of recommendations for a given user."
 @recommendations.param(
     "n", "The number of items you want to have recommended.", _in="query", default=10
 )
+@recommendations.param(
+    "cursor",
+    "The `next` cursor of the previous page; takes precedence over `offset`",
+    _in="query",
+)
 class Recommendation(Resource):
     @auth.login_required
     @recommendations.marshal_with(recommendationResponse)
+    @recommendations.response(400, "Invalid cursor")
     @recommendations.response(
         401, "Unauthorized", headers={"www-authenticate": "auth prompt"}
     )
+    @recommendations.response(410, "Cursor of a model that is no longer served")
     def get(self, user_id: int = -1):
         n = request.args.get("n", 10, type=int)
         offset = request.args.get("offset", 0, type=int)
+        token = request.args.get("cursor")
 
-        items = KG.recommend_me_something(user_id, n, offset)
+        codec = _cursor_codec()
+        try:
+            cursor = codec.decode(token) if token else None
+            items, next_cursor = KG.recommend_page(user_id, n, offset, cursor)
+        except StaleCursor:
+            api.abort(410, "The model changed, restart without cursor")
+        except InvalidCursor:
+            api.abort(400, "Invalid cursor")
 
         flog.info(
             _(
@@ -407,4 +462,101 @@ class Recommendation(Resource):
             )
         )
 
-        return RecommendationResponse(items=items)
+        return RecommendationResponse(
+            items=items,
+            next=codec.encode(next_cursor) if next_cursor is not None else None,
+        )
+
+
+# every user of a batch is answered from the same snapshot; this only
+# bounds the size of a single request
+MAX_BATCH_USERS = 1000
+
+batchUserPayload = api.model(
+    "Batch recommendation user",
+    {
+        "user": fields.Integer(
+            required=True, description="The WissKI user-ID", example=42
+        ),
+        "n": fields.Integer(
+            required=False,
+            description="The number of items to recommend to this user",
+            example=10,
+        ),
+        "offset": fields.Integer(
+            required=False,
+            description="Starting point for this user, to avoid duplicated recommendations",
+            example=0,
+        ),
+    },
+)
+
+batchPayload = api.model(
+    "Batch recommendation payload",
+    {
+        "users": fields.List(
+            fields.Nested(batchUserPayload),
+            required=True,
+            description=f"Users to recommend items to, at most {MAX_BATCH_USERS}",
+        ),
+        "n": fields.Integer(
+            required=False,
+            description="Default number of items for users without their own `n`",
+            example=10,
+        ),
+        "offset": fields.Integer(
+            required=False,
+            description="Default offset for users without their own `offset`",
+            example=0,
+        ),
+    },
+)
+
+batchRecommendationResponse = api.model(
+    "Batch recommendations",
+    {
+        "items": fields.Raw(
+            required=True,
+            description="Lists of wisski entity ids, keyed by user-ID",
+            example={"42": ["1", "3", "9"], "43": ["3", "7"]},
+        )
+    },
+)
+
+batch_recommendations_doc = (
+    "Retrieve lists of recommendations for many users with a single request."
+)
+
+
+@recommendations.route("/batch", doc={"description": batch_recommendations_doc})
+class BatchRecommendation(Resource):
+    @auth.login_required
+    @recommendations.expect(batchPayload, validate=True)
+    @recommendations.marshal_with(batchRecommendationResponse)
+    @recommendations.response(400, "Too many users")
+    @recommendations.response(
+        401, "Unauthorized", headers={"www-authenticate": "auth prompt"}
+    )
+    def post(self):
+        payload = api.payload
+        users = payload["users"]
+        if len(users) > MAX_BATCH_USERS:
+            api.abort(400, f"At most {MAX_BATCH_USERS} users per request")
+
+        n = payload.get("n", 10)
+        offset = payload.get("offset", 0)
+        items = KG.recommend_many(
+            (u["user"], u.get("n", n), u.get("offset", offset)) for u in users
+        )
+
+        flog.info(
+            _(
+                module="recommendation_batch",
+                http_user=auth.current_user(),
+                users=len(items),
+            )
+        )
+
+        return RecommendationResponse(
+            items={str(user): [str(i) for i in recos] for user, recos in items.items()}
+        )
@@ -1,21 +1,38 @@
-import json
 import logging
 import os
+import zlib
+from collections.abc import Callable, Iterator
 from datetime import datetime
 
-from flask import Blueprint, current_app, send_from_directory
+from flask import Blueprint, Response, current_app, request, stream_with_context
 from flask_httpauth import HTTPBasicAuth
 from flask_restx import Api, Resource, fields
+from flask_restx.representations import output_json
 
 from fo_services.client.api_clients import TrainingApiClient
 
-from . import KG
-from .page_auth import check_login
+from .db import (
+    database_metrics,
+    export_interaction_data,
+    export_user_data,
+    export_watermark,
+)
+from .metrics import CONTENT_TYPE, metrics, timed_representation
+from .page_auth import verify_credentials
+from .services.interaction_matrix import interaction_matrix, to_microseconds
 from .services.updater import UpdaterService
 
 bp = Blueprint("maintenance", __name__, url_prefix="/maintenance/v1")
 
 
+@bp.record_once
+def configure_interaction_matrix(state):
+    interaction_matrix.path = state.app.config.get(
+        "INTERACTION_MATRIX_FILE",
+        os.path.join(state.app.instance_path, "interactions.npz"),
+    )
+
+
 flog = logging.getLogger(__name__)
 
 auth = HTTPBasicAuth()
@@ -23,23 +40,9 @@ auth = HTTPBasicAuth()
 
 @auth.verify_password
 def verify_password(the_user, password):
-    flog.info(f"trying to login {the_user}")
-    success, known_user = check_login(the_user, password)
-    if success:
-        return known_user.name
-    return None
-
+    flog.debug("trying to login %s", the_user)
+    return verify_credentials(the_user, password)
 
-class StructuredMessage:
-    def __init__(self, **kwargs):
-        self.kwargs = kwargs
-
-    def __str__(self):
-        self.kwargs.update({"time": str(datetime.now())})
-        return "%s" % (json.dumps(self.kwargs))
-
-
-_ = StructuredMessage  # optional, to improve readability
 
 api = Api(
     bp,
@@ -51,6 +54,7 @@ api = Api(
     authorizations={"basicAuth": {"type": "basic"}},
     security="basic",
 )
+api.representations["application/json"] = timed_representation("serialize", output_json)
 
 db = api.namespace(
     "DB Update Triggers",
@@ -62,6 +66,16 @@ db = api.namespace(
 resultObject = api.model(
     "update",
     {
+        "model_version": fields.Integer(
+            required=True,
+            description="Model version that was loaded and activated, or that the delta was applied to",
+            example=42,
+        ),
+        "delta": fields.Boolean(
+            required=True,
+            description="Whether only changes against the active model were applied",
+            example=False,
+        ),
         "cluster_assignments_to_write": fields.Integer(
             required=True,
             description="Number of cluster assignments to persist",
@@ -72,6 +86,16 @@ resultObject = api.model(
             description="Number of cluster assignments that were persisted",
             example=42,
         ),
+        "cluster_assignments_rejected": fields.Integer(
+            required=True,
+            description="Number of cluster assignments dropped as duplicates",
+            example=0,
+        ),
+        "cluster_assignments_deleted": fields.Integer(
+            required=True,
+            description="Number of cluster assignments removed by a delta update",
+            example=0,
+        ),
         "reco_assignments_to_write": fields.Integer(
             required=True,
             description="Number of reco assignments to persist",
@@ -82,17 +106,43 @@ resultObject = api.model(
             description="Number of reco assignments that were persisted",
             example=42,
         ),
+        "reco_assignments_rejected": fields.Integer(
+            required=True,
+            description="Number of reco assignments dropped as duplicates or for unknown users/items",
+            example=0,
+        ),
+        "reco_assignments_deleted": fields.Integer(
+            required=True,
+            description="Number of reco assignments removed by a delta update",
+            example=0,
+        ),
+        "neighbours_written": fields.Integer(
+            required=True,
+            description="Number of related-item entries computed for detail views",
+            example=420,
+        ),
         "elapsed": fields.Float(
             required=True,
             description="Elapsed time during database update, in seconds",
             example=4.2,
         ),
+        "phases": fields.Raw(
+            required=True,
+            description="Seconds spent in each step of the update",
+            example={"stage_clusters": 0.4, "insert_clusters": 0.1},
+        ),
     },
 )
 update_doc = "Trigger reloading catalog information from KG model."
 
 
 @db.route("/update", doc={"description": update_doc})
+@db.param(
+    "delta",
+    "Only apply changes against the active model instead of loading a new version",
+    _in="query",
+    default=False,
+)
 class Updater(Resource):
     def __init__(self, api=None, *args, **kwargs):
         super().__init__(api, args, kwargs)
@@ -104,34 +154,162 @@ class Updater(Resource):
     @db.marshal_with(resultObject)
     @db.response(401, "Unauthorized", headers={"www-authenticate": "auth prompt"})
     def post(self):
-        return self.updater_service.reload_data()
+        delta = request.args.get("delta", "false").lower() in ("1", "true", "yes")
+        return self.updater_service.reload_data(delta=delta)
+
+
+def _gzipped(chunks: Iterator[bytes]) -> Iterator[bytes]:
+    # wbits=31 writes a gzip header and trailer
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _since() -> datetime | None:
+    since = request.args.get("since")
+    if since is None:
+        return None
+    try:
+        value = datetime.fromisoformat(since)
+    except ValueError:
+        value = None
+    # watermarks are local times of the database, without an offset; one
+    # with an offset can't be compared to them
+    if value is None or value.tzinfo is not None:
+        api.abort(400, f"Invalid since: {since!r}, expected an X-Export-Watermark")
+    return value
+
+
+def _export_response(
+    chunks: Iterator[bytes], until: datetime, filename: str, mimetype: str
+) -> Response:
+    headers = {
+        "Content-Disposition": f"attachment; filename={filename}",
+        # the `since` of the next incremental export
+        "X-Export-Watermark": until.isoformat(),
+        "Vary": "Accept-Encoding",
+    }
+    if "gzip" in request.accept_encodings:
+        chunks = _gzipped(chunks)
+        headers["Content-Encoding"] = "gzip"
+    return Response(stream_with_context(chunks), mimetype=mimetype, headers=headers)
 
 
-export_user_doc = "Trigger exporting user information from DB."
+def _export_tsv(export: Callable, filename: str) -> Response:
+    """Stream the rows of `export` up to the current watermark as a TSV file."""
+    since = _since()
+    until = export_watermark()
+    return _export_response(
+        export(until, since), until, filename, "text/tab-separated-values"
+    )
 
 
-@db.route("/export_users", doc={"description": export_user_doc})
+export_params = {
+    "since": "Only export rows newer than this watermark (ISO 8601, without"
+    " a UTC offset), as returned in X-Export-Watermark by a previous export",
+}
+
+export_user_doc = "Export known users from DB, streamed as TSV."
+
+
+@db.route("/export_users", doc={"description": export_user_doc, "params": export_params})
 class ExporterUser(Resource):
     @auth.login_required
+    @db.response(400, "Invalid watermark")
     @db.response(401, "Unauthorized", headers={"www-authenticate": "auth prompt"})
-    @db.produces(["text/tsv"])
+    @db.produces(["text/tab-separated-values"])
     def post(self):
-        path = KG.export_user_data()
-        return send_from_directory(
-            os.path.dirname(path), os.path.basename(path), as_attachment=True
-        )
+        return _export_tsv(export_user_data, "known_users.tsv")
 
 
-export_interaction_doc = "Trigger exporting interaction information from DB."
+export_interaction_doc = "Export user interactions from DB, streamed as TSV."
 
 
-@db.route("/export_interactions", doc={"description": export_user_doc})
+@db.route(
+    "/export_interactions",
+    doc={"description": export_interaction_doc, "params": export_params},
+)
 class ExporterInteractions(Resource):
     @auth.login_required
+    @db.response(400, "Invalid watermark")
+    @db.response(401, "Unauthorized", headers={"www-authenticate": "auth prompt"})
+    @db.produces(["text/tab-separated-values"])
+    def post(self):
+        return _export_tsv(export_interaction_data, "user_interactions.tsv")
+
+
+export_matrix_doc = (
+    "Export user interactions from DB as a sparse user-item matrix in NumPy's"
+    " .npz format: `user_ids` and `item_ids` map row and column indices to"
+    " WissKI ids, `indptr`, `indices` and `timestamps` (microseconds since the"
+    " epoch) are the CSR arrays of the interactions. Indices of an id stay the"
+    " same between exports, unless the matrix is rebuilt."
+)
+
+
+@db.route(
+    "/export_interaction_matrix",
+    doc={
+        "description": export_matrix_doc,
+        "params": {
+            **export_params,
+            "rebuild": "Build the matrix from scratch instead of adding new interactions",
+        },
+    },
+)
+class ExporterInteractionMatrix(Resource):
+    @auth.login_required
+    @db.response(400, "Invalid watermark")
     @db.response(401, "Unauthorized", headers={"www-authenticate": "auth prompt"})
-    @db.produces(["text/tsv"])
+    @db.produces(["application/octet-stream"])
     def post(self):
-        path = KG.export_interaction_data()
-        return send_from_directory(
-            os.path.dirname(path), os.path.basename(path), as_attachment=True
+        since = _since()
+        if request.args.get("rebuild", "false").lower() in ("1", "true", "yes"):
+            interaction_matrix.reset()
+        until = export_watermark()
+        matrix = interaction_matrix.get(until)
+        data = matrix.to_npz(
+            to_microseconds(since) if since is not None else None
+        )
+        return _export_response(
+            iter([data]), until, "interactions.npz", "application/octet-stream"
         )
+
+
+pool_doc = (
+    "Connection pool and query metrics of the worker answering the request:"
+    " checkout waits and saturation of the pool, and queries per request."
+)
+
+
+@db.route("/pool", doc={"description": pool_doc})
+class DatabasePool(Resource):
+    @auth.login_required
+    @db.response(401, "Unauthorized", headers={"www-authenticate": "auth prompt"})
+    def get(self):
+        return database_metrics()
+
+
+monitoring = api.namespace(
+    "Monitoring",
+    path="/monitoring",
+    description="Metrics of the API, for Prometheus to scrape.",
+)
+
+metrics_doc = (
+    "Request counts, error counts and latency histograms per endpoint, with"
+    " the time spent on auth, database queries and serialization, summed over"
+    " all workers, in the Prometheus text format."
+)
+
+
+@monitoring.route("/metrics", doc={"description": metrics_doc})
+class Metrics(Resource):
+    @auth.login_required
+    @monitoring.response(401, "Unauthorized", headers={"www-authenticate": "auth prompt"})
+    @monitoring.produces(["text/plain"])
+    def get(self):
+        return Response(metrics.render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,97 @@
+import datetime
+
+import click
+import wasabi
+from flask import current_app
+
+from ..db import (
+    INTERACTION_PARTITIONS_AHEAD,
+    ensure_interaction_partitions,
+    interaction_partitions,
+    prune_interactions,
+    prune_search_queries,
+    rollup_interactions,
+)
+
+
+@click.group("interactions")
+def interactions():
+    """Maintain the interaction history."""
+
+
+def _partition(msg: wasabi.Printer, ahead: int):
+    created = ensure_interaction_partitions(ahead)
+    msg.info(f"Partitions created: {', '.join(f'{m:%Y-%m}' for m in created) or '-'}")
+
+
+def _rollup(msg: wasabi.Printer):
+    users, items = rollup_interactions()
+    msg.info(f"Daily user rows written: {users}")
+    msg.info(f"Daily item rows written: {items}")
+
+
+def _prune(msg: wasabi.Printer, days: int | None):
+    if days is None:
+        days = current_app.config.get("INTERACTION_RETENTION_DAYS")
+    if days is None:
+        msg.info("No retention configured, keeping all interactions")
+        return
+    before = datetime.date.today() - datetime.timedelta(days=days)
+    dropped, deleted = prune_interactions(before)
+    msg.info(f"Partitions dropped: {', '.join(f'{m:%Y-%m}' for m in dropped) or '-'}")
+    msg.info(f"Interactions deleted: {deleted}")
+
+
+def _prune_queries(msg: wasabi.Printer):
+    msg.info(f"Search queries deleted: {prune_search_queries()}")
+
+
+@interactions.command("list-partitions")
+def list_partitions():
+    msg = wasabi.Printer()
+    msg.table(
+        [(f"{m:%Y-%m}",) for m in interaction_partitions()],
+        header=("Month",),
+        divider=True,
+    )
+
+
+@interactions.command("partition")
+@click.option(
+    "--ahead",
+    default=INTERACTION_PARTITIONS_AHEAD,
+    show_default=True,
+    help="Months after the current one to create partitions for.",
+)
+def partition(ahead: int):
+    """Create upcoming monthly partitions of the interaction history."""
+    _partition(wasabi.Printer(), ahead)
+
+
+@interactions.command("rollup")
+def rollup():
+    """Aggregate complete days into daily counts per user and item."""
+    _rollup(wasabi.Printer())
+
+
+@interactions.command("prune")
+@click.option(
+    "--days",
+    type=int,
+    default=None,
+    help="Keep this many days of interactions [default: INTERACTION_RETENTION_DAYS].",
+)
+def prune(days: int | None):
+    """Delete interactions past the retention period, once rolled up."""
+    _prune(wasabi.Printer(), days)
+
+
+@interactions.command("maintain")
+def maintain():
+    """Partition, roll up and prune, and prune the search query log; meant to run daily."""
+    msg = wasabi.Printer()
+    _partition(msg, INTERACTION_PARTITIONS_AHEAD)
+    _rollup(msg)
+    _prune(msg, None)
+    _prune_queries(msg)
+    msg.good("Done maintaining the interaction history.")
@@ -0,0 +1,33 @@
+import click
+import wasabi
+
+from ..db import activate_model_version, get_model_versions
+
+
+@click.group("model-version")
+def model_version():
+    """Inspect and switch model generations."""
+
+
+@model_version.command("list")
+def list_versions():
+    msg = wasabi.Printer()
+    rows = [
+        (v.id, v.created_at, v.activated_at or "", "*" if v.is_active else "")
+        for v in get_model_versions()
+    ]
+    msg.table(rows, header=("Version", "Created", "Activated", "Active"), divider=True)
+
+
+@model_version.command("activate")
+@click.argument("version", type=int)
+def activate(version: int):
+    """Serve VERSION from now on, e.g. to roll back a bad update."""
+    msg = wasabi.Printer()
+    if not activate_model_version(version):
+        msg.fail(f"Model version {version} does not exist", exits=1)
+    # let the workers pick up the generation
+    from .. import KG
+
+    KG.publish_model()
+    msg.good(f"Model version {version} is active.")
@@ -0,0 +1,103 @@
+import time
+
+import click
+import wasabi
+from sqlalchemy import func, select
+
+from ..db import (
+    bulk_load_interactions,
+    bulk_load_users,
+    db_session,
+    load_model_arrays,
+    truncate_recommendation_data,
+)
+from ..models import RecommUser
+from ..services.sample_data import SampleData, SampleScale
+
+
+@click.group("sample-data")
+def sample_data():
+    """Fill the database with synthetic data."""
+
+
+@sample_data.command("generate")
+@click.option("--users", default=SampleScale.users, show_default=True)
+@click.option("--items", default=SampleScale.items, show_default=True)
+@click.option("--clusters", default=SampleScale.clusters, show_default=True)
+@click.option(
+    "--interactions-per-user",
+    default=SampleScale.interactions_per_user,
+    show_default=True,
+    help="Mean number of interactions of a user.",
+)
+@click.option("--recos-per-user", default=SampleScale.recos_per_user, show_default=True)
+@click.option(
+    "--popularity",
+    default=SampleScale.popularity,
+    show_default=True,
+    help="Exponent of the power law of item popularity.",
+)
+@click.option("--days", default=SampleScale.days, show_default=True, help="Days of interactions.")
+@click.option("--seed", default=SampleScale.seed, show_default=True)
+@click.option(
+    "--neighbours/--no-neighbours",
+    default=True,
+    show_default=True,
+    help="Build the item neighbours; their co-viewing pairs grow quadratically"
+    " with the interactions per user.",
+)
+@click.option(
+    "--replace",
+    is_flag=True,
+    help="Delete all users, interactions and models first.",
+)
+def generate(
+    users: int,
+    items: int,
+    clusters: int,
+    interactions_per_user: float,
+    recos_per_user: int,
+    popularity: float,
+    days: int,
+    seed: int,
+    neighbours: bool,
+    replace: bool,
+):
+    """Generate users, interactions and an active model, loaded with COPY."""
+    msg = wasabi.Printer()
+    scale = SampleScale(
+        users=users,
+        items=items,
+        clusters=clusters,
+        interactions_per_user=interactions_per_user,
+        recos_per_user=recos_per_user,
+        popularity=popularity,
+        days=days,
+        seed=seed,
+    )
+    if replace:
+        truncate_recommendation_data()
+    elif db_session.scalar(select(func.count()).select_from(RecommUser)):
+        msg.fail("The database has users already; use --replace to delete them", exits=1)
+
+    data = SampleData(scale)
+
+    start = time.perf_counter()
+    n = bulk_load_users(*data.users())
+    msg.info(f"Users written: {n} ({time.perf_counter() - start:.1f}s)")
+
+    start = time.perf_counter()
+    n = bulk_load_interactions(data.interactions(), months=data.months())
+    msg.info(f"Interactions written: {n} ({time.perf_counter() - start:.1f}s)")
+
+    result = load_model_arrays(data.clusters(), data.recommendations(), neighbours=neighbours)
+    msg.info(f"Model version: {result['model_version']} ({result['elapsed']:.1f}s)")
+    msg.info(f"Cluster assignments written: {result['cluster_assignments_written']}")
+    msg.info(f"Reco assignments written: {result['reco_assignments_written']}")
+    msg.info(f"Item neighbours written: {result['neighbours_written']}")
+
+    # let the workers pick up the generation
+    from .. import KG
+
+    KG.publish_model()
+    msg.good("Done generating sample data.")
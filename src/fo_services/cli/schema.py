@@ -0,0 +1,27 @@
+import click
+import wasabi
+
+from ..migrations import MIGRATIONS, applied_migrations, upgrade
+
+
+@click.group("schema")
+def schema():
+    """Migrate the database schema."""
+
+
+@schema.command("status")
+def status():
+    msg = wasabi.Printer()
+    applied = applied_migrations()
+    rows = [(m.version, m.name, applied.get(m.version, "pending")) for m in MIGRATIONS]
+    msg.table(rows, header=("Version", "Migration", "Applied"), divider=True)
+
+
+@schema.command("upgrade")
+def upgrade_schema():
+    """Apply pending migrations; run before starting the workers."""
+    msg = wasabi.Printer()
+    applied = upgrade()
+    for m in applied:
+        msg.info(f"Applied migration {m.version}: {m.name}")
+    msg.good(f"Schema is up to date, {len(applied)} migrations applied.")
@@ -6,21 +6,35 @@ import wasabi
 
 
 @click.command("update-model")
-def update_model():
+@click.option(
+    "--delta",
+    is_flag=True,
+    help="Only apply changes against the active model instead of loading a new version.",
+)
+def update_model(delta: bool):
     msg = wasabi.Printer()
     client = TrainingApiClient(current_app.config["TRAINING_API_URL"])
     updater = UpdaterService(client)
-    result = updater.reload_data()
+    result = updater.reload_data(delta=delta)
     msg.info(f"Time elapsed: {result['elapsed']}")
+    for phase, seconds in result["phases"].items():
+        msg.text(f"  {phase}: {seconds:.2f}s")
+    msg.info(f"Model version: {result['model_version']}")
     msg.info(f"Cluster assignments written: {result['cluster_assignments_written']}")
     msg.info(f"Reco assignments written: {result['reco_assignments_written']}")
-    if result["cluster_assignments_written"] != result["cluster_assignments_to_write"]:
+    msg.info(f"Item neighbours written: {result['neighbours_written']}")
+    if result["delta"]:
+        msg.info(f"Cluster assignments deleted: {result['cluster_assignments_deleted']}")
+        msg.info(f"Reco assignments deleted: {result['reco_assignments_deleted']}")
+    if result["cluster_assignments_rejected"]:
         msg.warn(
-            "Not all cluster assignments were written (should be {result['cluster_assignments_to_write']})"
+            f"Not all cluster assignments were accepted ({result['cluster_assignments_rejected']}"
+            f" of {result['cluster_assignments_to_write']} rejected)"
         )
-    if result["reco_assignments_written"] != result["reco_assignments_to_write"]:
+    if result["reco_assignments_rejected"]:
         msg.warn(
-            "Not all reco assignments were written (should be {result['reco_assignments_to_write']})"
+            f"Not all reco assignments were accepted ({result['reco_assignments_rejected']}"
+            f" of {result['reco_assignments_to_write']} rejected)"
         )
 
     msg.good(f"Done updating model. {msg.counts['warn']} warnings.")
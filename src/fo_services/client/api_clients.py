@@ -1,29 +1,107 @@
+import codecs
+import json
+from collections.abc import Iterable, Iterator
+from typing import Any
+
 import requests
 import logging
 
 logger = logging.getLogger(__name__)
 
+# size of the pieces an export is read and parsed in; bounds memory use
+# independently of the size of the export
+CHUNK_SIZE = 64 * 1024
+
+NDJSON_TYPES = ("application/x-ndjson", "application/jsonl", "application/json-seq")
+# records of application/json-seq (RFC 7464) start with a record separator
+JSON_SEQ_RS = b"\x1e"
+
 class ApiError(Exception):
     pass
 
+def _iter_json_array(chunks: Iterable[bytes]) -> Iterator[Any]:
+    """Yield the elements of a JSON array arriving in arbitrary byte chunks."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    opened = False
+
+    def skip(chars: str) -> None:
+        nonlocal pos
+        while pos < len(buf) and buf[pos] in chars:
+            pos += 1
+
+    for chunk in chunks:
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+
+        if not opened:
+            skip(" \t\r\n")
+            if pos == len(buf):
+                continue
+            if buf[pos] != "[":
+                raise ApiError("Expected a JSON array from training API")
+            opened = True
+            pos += 1
+
+        while True:
+            skip(" \t\r\n,")
+            if pos == len(buf):
+                break
+            if buf[pos] == "]":
+                return
+            try:
+                element, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # element continues in the next chunk
+                break
+            if end == len(buf) and not isinstance(element, (dict, list)):
+                # a scalar at the very end might still be incomplete
+                break
+            pos = end
+            yield element
+
+    raise ApiError("Unexpected end of JSON array from training API")
+
 class TrainingApiClient(object):
     def __init__(self, base_url: str):
         self.session = requests.Session()
         self.base_url = base_url
 
-    def get_cluster(self) -> list[dict[str, str]]:
-        r = self.session.get(f"{self.base_url}/api/v1/export/wisski/cluster")
-        if r.status_code != 200:
-            logger.error(f"[API] got response code {r.status_code} for GET /api/v1/wisski/cluster")
-            raise ApiError(f"Error communicating with training API, got status {r.status_code} for {r.request.url}")
+    def _stream(self, path: str) -> Iterator[dict[str, str]]:
+        r = self.session.get(
+            f"{self.base_url}{path}",
+            stream=True,
+            headers={"Accept": "application/x-ndjson, application/json;q=0.9"},
+        )
+        with r:
+            if r.status_code != 200:
+                logger.error(f"[API] got response code {r.status_code} for GET {path}")
+                raise ApiError(f"Error communicating with training API, got status {r.status_code} for {r.request.url}")
 
-        return r.json()
+            content_type = r.headers.get("Content-Type", "").split(";")[0].strip()
+            if content_type in NDJSON_TYPES:
+                json_seq = content_type == "application/json-seq"
+                for line in r.iter_lines(chunk_size=CHUNK_SIZE):
+                    if json_seq:
+                        line = line.lstrip(JSON_SEQ_RS)
+                    if line.strip():
+                        yield json.loads(line)
+            else:
+                yield from _iter_json_array(r.iter_content(chunk_size=CHUNK_SIZE))
 
+    def stream_cluster(self) -> Iterator[dict[str, str]]:
+        """Cluster assignments, parsed incrementally while they are downloaded."""
+        return self._stream("/api/v1/export/wisski/cluster")
 
-    def get_recommendations(self) -> list[dict[str, str]]:
-        r = self.session.get(f"{self.base_url}/api/v1/export/wisski/recommendations")
-        if r.status_code != 200:
-            logger.error(f"[API] got response code {r.status_code} for GET /api/v1/wisski/recommendation")
-            raise ApiError(f"Error communicating with training API, got status {r.status_code} for {r.request.url}")
+    def stream_recommendations(self) -> Iterator[dict[str, str]]:
+        """Recommendations, parsed incrementally while they are downloaded."""
+        return self._stream("/api/v1/export/wisski/recommendations")
 
-        return r.json()
+    def get_cluster(self) -> list[dict[str, str]]:
+        return list(self.stream_cluster())
+
+
+    def get_recommendations(self) -> list[dict[str, str]]:
+        return list(self.stream_recommendations())
@@ -0,0 +1,72 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class CredentialCache(object):
+    """Bounded, expiring cache of credentials that were verified successfully.
+
+    Entries are keyed on a keyed digest of username and password, so neither
+    is kept in memory in plain text. The key is random per process; each
+    worker holds its own cache. The digest also covers a `stamp` of the
+    stored user, e.g. its password hash, which callers read from the shared
+    database: once a user is changed by any worker, its old entries no longer
+    match anywhere and age out.
+    """
+
+    def __init__(self, ttl: float = 300.0, max_size: int = 1024):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._key = os.urandom(32)
+        # digest -> (username, expiry)
+        self._entries: OrderedDict[bytes, tuple[str, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _digest(self, username: str, password: str, stamp: str) -> bytes:
+        msg = f"{len(username)}:{username}:{len(stamp)}:{stamp}:{password}".encode("utf8")
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def check(self, username: str, password: str, stamp: str = "") -> bool:
+        if self.ttl <= 0:
+            return False
+        digest = self._digest(username, password, stamp)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                return False
+            if entry[1] < time.monotonic():
+                del self._entries[digest]
+                return False
+            self._entries.move_to_end(digest)
+            return True
+
+    def add(self, username: str, password: str, stamp: str = ""):
+        if self.ttl <= 0:
+            return
+        digest = self._digest(username, password, stamp)
+        with self._lock:
+            self._entries[digest] = (username, time.monotonic() + self.ttl)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: str | None = None):
+        """Forget cached credentials of `username`, or of everybody."""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+                return
+            stale = [d for d, (name, _) in self._entries.items() if name == username]
+            for digest in stale:
+                del self._entries[digest]
+        if stale:
+            logger.debug(f"invalidated cached credentials of {username}")
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -1,22 +1,274 @@
+import bisect
+import datetime
 import logging
+import struct
+import threading
 import time
-from collections.abc import Sequence
-from typing import List, Tuple, TypedDict
+from collections import OrderedDict
+from contextlib import closing, contextmanager
+from contextvars import ContextVar, Token
+from dataclasses import dataclass
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from typing import Any, Dict, List, Tuple, TypedDict
 
-import pandas as pd
-from psycopg.errors import ForeignKeyViolation
-from sqlalchemy import and_, create_engine, select
-from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import DeclarativeBase, scoped_session, sessionmaker
+import numpy as np
+from psycopg import sql as psql
+from sqlalchemy import (
+    Integer,
+    and_,
+    bindparam,
+    Engine,
+    create_engine,
+    event,
+    func,
+    select,
+    text,
+)
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.orm import DeclarativeBase, Session, scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 
 logger = logging.getLogger(__name__)
 
-# ~ engine = create_engine(current_app.config["SQLALCHEMY_DATABASE_URI"], echo=True)
-engine = create_engine(
-    "postgresql+psycopg://fo_services:fo_services@db/fo_services", echo=True
-)
+DEFAULT_DATABASE_URI = "postgresql+psycopg://fo_services:fo_services@db/fo_services"
+
+# settings of the engine, from the app config by configure_engine. The
+# pool is per process; with 4 uwsgi workers, the service holds up to
+# 4 * (pool_size + max_overflow) connections.
+_engine_settings: Dict[str, Any] = {
+    "url": DEFAULT_DATABASE_URI,
+    "pool_size": 2,
+    "max_overflow": 3,
+    "pool_timeout": 10.0,
+    "pool_recycle": 1800,
+    "pool_pre_ping": True,
+    "echo": False,
+}
+_engine: Engine | None = None
+_engine_lock = threading.Lock()
+
+
+class _PoolStats(object):
+    """Checkout waits of the pool, and the queries run by this process."""
+
+    # upper bounds of the buckets of queries per request
+    QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.wait_seconds = 0.0
+            self.max_wait_seconds = 0.0
+            self.timeouts = 0
+            self.max_checked_out = 0
+            self.queries = 0
+            self.query_seconds = 0.0
+            self.requests = 0
+            self.max_queries_per_request = 0
+            self.queries_per_request = [0] * (len(self.QUERY_BUCKETS) + 1)
+
+    def checkout(self, wait: float, checked_out: int):
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+            self.max_checked_out = max(self.max_checked_out, checked_out)
+
+    def timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def query(self, seconds: float):
+        with self._lock:
+            self.queries += 1
+            self.query_seconds += seconds
+
+    def request(self, queries: int):
+        with self._lock:
+            self.requests += 1
+            self.max_queries_per_request = max(self.max_queries_per_request, queries)
+            self.queries_per_request[bisect.bisect_left(self.QUERY_BUCKETS, queries)] += 1
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            histogram = {
+                f"le_{bound}": count
+                for bound, count in zip(self.QUERY_BUCKETS, self.queries_per_request)
+            }
+            histogram["more"] = self.queries_per_request[-1]
+            return {
+                "pool": {
+                    "checkouts": self.checkouts,
+                    "wait_seconds": self.wait_seconds,
+                    "max_wait_seconds": self.max_wait_seconds,
+                    "timeouts": self.timeouts,
+                    "max_checked_out": self.max_checked_out,
+                },
+                "queries": {
+                    "total": self.queries,
+                    "seconds": self.query_seconds,
+                    "requests": self.requests,
+                    "max_per_request": self.max_queries_per_request,
+                    "per_request": histogram,
+                },
+            }
+
+
+pool_stats = _PoolStats()
+
+
+class _InstrumentedPool(QueuePool):
+    """QueuePool recording how long checkouts wait for a connection."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            pool_stats.timeout()
+            raise
+        pool_stats.checkout(time.perf_counter() - start, self.checkedout())
+        return connection
+
+
+@dataclass
+class QueryStats:
+    queries: int = 0
+    seconds: float = 0.0
+
+
+# queries of the request being handled, see track_queries
+_request_queries: ContextVar[QueryStats | None] = ContextVar("request_queries", default=None)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info["query_start"] = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info.pop("query_start", time.perf_counter())
+    pool_stats.query(seconds)
+    stats = _request_queries.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+
+
+def configure_engine(config: Mapping):
+    """Take the engine settings from `config`; the engine is built on first use.
+
+    Keys are SQLALCHEMY_DATABASE_URI, SQLALCHEMY_POOL_SIZE,
+    SQLALCHEMY_MAX_OVERFLOW, SQLALCHEMY_POOL_TIMEOUT, SQLALCHEMY_POOL_RECYCLE,
+    SQLALCHEMY_POOL_PRE_PING and SQLALCHEMY_ECHO.
+    """
+    global _engine
+    settings = {
+        "url": config.get("SQLALCHEMY_DATABASE_URI", DEFAULT_DATABASE_URI),
+        "pool_size": int(config.get("SQLALCHEMY_POOL_SIZE", 2)),
+        "max_overflow": int(config.get("SQLALCHEMY_MAX_OVERFLOW", 3)),
+        "pool_timeout": float(config.get("SQLALCHEMY_POOL_TIMEOUT", 10.0)),
+        "pool_recycle": int(config.get("SQLALCHEMY_POOL_RECYCLE", 1800)),
+        "pool_pre_ping": _flag(config.get("SQLALCHEMY_POOL_PRE_PING", True)),
+        "echo": _flag(config.get("SQLALCHEMY_ECHO", False)),
+    }
+    with _engine_lock:
+        if settings == _engine_settings:
+            return
+        _engine_settings.update(settings)
+        previous, _engine = _engine, None
+    if previous is not None:
+        db_session.remove()
+        previous.dispose()
+    pool_stats.reset()
+
+
+def _flag(value) -> bool:
+    # environment variables are strings
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def get_engine() -> Engine:
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                settings = dict(_engine_settings)
+                engine = create_engine(
+                    settings.pop("url"), poolclass=_InstrumentedPool, **settings
+                )
+                event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+                event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+                _engine = engine
+    return _engine
+
+
+def dispose_engine():
+    """Close the pooled connections, e.g. before forking workers."""
+    db_session.remove()
+    if _engine is not None:
+        _engine.dispose()
+
+
+def begin_query_tracking() -> Token:
+    """Count the queries of this context, e.g. of a request, from now on."""
+    return _request_queries.set(QueryStats())
+
+
+def current_queries() -> QueryStats | None:
+    return _request_queries.get()
+
+
+def end_query_tracking(token: Token) -> QueryStats:
+    stats = _request_queries.get()
+    _request_queries.reset(token)
+    if stats is None:
+        raise ValueError("queries of this context are not being tracked")
+    pool_stats.request(stats.queries)
+    return stats
+
+
+@contextmanager
+def track_queries() -> Iterator[QueryStats]:
+    stats = QueryStats()
+    token = _request_queries.set(stats)
+    try:
+        yield stats
+    finally:
+        end_query_tracking(token)
+
+
+def database_metrics() -> Dict[str, Any]:
+    """Pool and query metrics of this process."""
+    pool = get_engine().pool
+    capacity = _engine_settings["pool_size"] + max(_engine_settings["max_overflow"], 0)
+    checked_out = pool.checkedout() if isinstance(pool, QueuePool) else 0
+    metrics = pool_stats.snapshot()
+    metrics["pool"].update(
+        size=_engine_settings["pool_size"],
+        max_overflow=_engine_settings["max_overflow"],
+        checked_out=checked_out,
+        saturation=checked_out / capacity if capacity else 0.0,
+    )
+    return metrics
+
+
+class _Session(Session):
+    def get_bind(self, mapper=None, clause=None, **kw):
+        # the engine is only built when first needed
+        if self.bind is None:
+            return get_engine()
+        return super().get_bind(mapper, clause, **kw)
+
+
 db_session = scoped_session(
-    sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    sessionmaker(class_=_Session, autocommit=False, autoflush=False)
 )
 
 
@@ -27,20 +279,23 @@ class Base(DeclarativeBase):
 Base.query = db_session.query_property()
 
 from .models import (
+    InteractionDailyUser,
     InteractionHistory,
     ItemClusterInfo,
+    ItemNeighbour,
+    ModelVersion,
     RecommUser,
+    SearchQuery,
     User,
     UserRecommendationModel,
 )
 
 
 def init_db():
-    # import all modules here that might define models so that
-    # they will be registered properly on the metadata.  Otherwise
-    # you will have to import them first before calling init_db()
-    # ~ Base.metadata.drop_all(bind=engine)
-    Base.metadata.create_all(bind=engine)
+    """Bring the schema up to date; see `fo_services.migrations`."""
+    from .migrations import upgrade
+
+    upgrade()
 
 
 def get_user(username):
@@ -53,164 +308,1225 @@ def get_user(username):
     return None
 
 
-def is_new_user(wisski_user_id: int) -> bool:
-    is_new = True
+# WissKI ids known to exist in rec_user, least recently remembered first.
+# Per process and never invalidated by other processes, which is fine as
+# long as users are not deleted.
+_known_users: OrderedDict[int, None] = OrderedDict()
+_known_users_lock = threading.Lock()
+MAX_KNOWN_USERS = 1_000_000
+# tells whether a user is known to exist without keeping a copy of the id,
+# e.g. a lookup in the served model; see set_known_user_probe
+_known_user_probe: Callable[[int], bool] | None = None
+
+
+def set_known_user_probe(probe: Callable[[int], bool] | None):
+    """Also take users for which `probe` is true as present in rec_user."""
+    global _known_user_probe
+    _known_user_probe = probe
+
+
+def remember_users(wisski_user_ids: Iterable[int]):
+    """Mark users as present in rec_user, e.g. because they were just added.
+
+    Beyond MAX_KNOWN_USERS, the least recently remembered users are forgotten.
+    """
+    with _known_users_lock:
+        for i in wisski_user_ids:
+            i = int(i)
+            _known_users[i] = None
+            _known_users.move_to_end(i)
+        for _ in range(len(_known_users) - MAX_KNOWN_USERS):
+            _known_users.popitem(last=False)
+
 
+def forget_users(wisski_user_ids: Iterable[int] | None = None):
+    with _known_users_lock:
+        if wisski_user_ids is None:
+            _known_users.clear()
+        else:
+            for i in wisski_user_ids:
+                _known_users.pop(int(i), None)
+
+
+def _insert_users(wisski_user_ids: Iterable[int]) -> Tuple[List[int], List[int]]:
+    # returns (ids not known before, ids actually inserted); doesn't commit
+    with _known_users_lock:
+        missing = sorted({int(i) for i in wisski_user_ids} - _known_users.keys())
+    probe = _known_user_probe
+    if probe is not None:
+        missing = [i for i in missing if not probe(i)]
+    if not missing:
+        return [], []
+    # a single array parameter, as the number of bind parameters is limited
+    ids = select(
+        func.unnest(bindparam("ids", missing, type_=ARRAY(Integer))), func.now()
+    )
+    added = db_session.scalars(
+        insert(RecommUser)
+        .from_select([RecommUser.wisski_id, RecommUser.first_seen], ids)
+        .on_conflict_do_nothing(index_elements=[RecommUser.wisski_id])
+        .returning(RecommUser.wisski_id)
+    ).all()
+    return missing, list(added)
+
+
+def ensure_users(wisski_user_ids: Iterable[int]) -> List[int]:
+    """Make sure all given users exist in rec_user; returns the newly added ones.
+
+    Users seen before by this process or served by the model don't cause
+    any database access.
+    """
     try:
-        db_session.query(RecommUser.wisski_id).filter(
-            RecommUser.wisski_id == wisski_user_id
-        ).one()
-        is_new = False
+        missing, added = _insert_users(wisski_user_ids)
+        if not missing:
+            return []
+        db_session.commit()
     except Exception:
-        pass
+        db_session.rollback()
+        raise
+    remember_users(missing)
+    if added:
+        logger.debug(f"added new users {added}")
+    return added
 
-    if not is_new:
-        try:
-            logger.debug(f"looking for recommendations for {wisski_user_id}")
-            db_session.query(UserRecommendationModel.user).filter(
-                UserRecommendationModel.user == wisski_user_id
-            ).all()
-            logger.debug(f"found recommendations for {wisski_user_id}")
-        except Exception:
-            is_new = True
-    else:
-        try:
-            db_session.add(RecommUser(wisski_id=wisski_user_id))
-            db_session.commit()
-            logger.debug(f"added new user {wisski_user_id}")
-        except Exception:
-            logger.exception("Error creating new user")
-            db_session.rollback()
 
-    return is_new
+def ensure_user(wisski_user_id: int) -> bool:
+    """Make sure the user exists in rec_user; True if it was added just now."""
+    return bool(ensure_users([wisski_user_id]))
 
 
-def get_itemlist_from_model(user_id: int, max_n: int) -> List[Tuple[int, int, int]]:
-    rows = (
-        db_session.query(UserRecommendationModel, ItemClusterInfo)
-        .filter(UserRecommendationModel.user == user_id)
-        .filter(UserRecommendationModel.item == ItemClusterInfo.id)
-        .order_by(UserRecommendationModel.rank.asc())
-        .limit(max_n)
-        .all()
+def _active_version():
+    return (
+        select(ModelVersion.id)
+        .where(ModelVersion.is_active.is_(True))
+        .scalar_subquery()
     )
-    return [(row[0].item, row[0].rank, row[1].cluster) for row in rows]
 
 
-def get_itemlist_from_cluster(top_n: int) -> List[Tuple[int, int, int]]:
+def get_itemlist_from_cluster(
+    top_n: int, version: int | None = None
+) -> List[Tuple[int, int, int]]:
+    version = _active_version() if version is None else version
     rows = (
         db_session.query(
             ItemClusterInfo.id, ItemClusterInfo.rank, ItemClusterInfo.cluster
         )
+        .filter(ItemClusterInfo.version == version)
         .filter(and_(ItemClusterInfo.cluster != -1, ItemClusterInfo.rank < top_n))
-        .order_by(ItemClusterInfo.rank)
+        # deterministic, as pages are sliced from this list
+        .order_by(ItemClusterInfo.rank, ItemClusterInfo.cluster, ItemClusterInfo.id)
         .all()
     )
 
     return [(row.id, row.rank, row.cluster) for row in rows]
 
 
-def log_user_detail_interaction(wisski_user: int, wisski_item: int):
+def get_model_version() -> int | None:
+    """Id of the active model generation, or None if no model was loaded yet."""
+    return db_session.query(ModelVersion.id).filter(ModelVersion.is_active.is_(True)).scalar()
+
+
+def get_model_revision() -> Tuple[int, int] | None:
+    """(version, revision) of the active generation; the revision counts delta updates applied to it."""
+    row = (
+        db_session.query(ModelVersion.id, ModelVersion.revision)
+        .filter(ModelVersion.is_active.is_(True))
+        .one_or_none()
+    )
+    return None if row is None else (row.id, row.revision)
+
+
+def get_model_versions() -> List[ModelVersion]:
+    return db_session.query(ModelVersion).order_by(ModelVersion.id.desc()).all()
+
+
+# rows converted at a time by _fetch_array
+FETCH_CHUNK_ROWS = 100_000
+
+
+def _fetch_array(stmt, n_columns: int) -> np.ndarray:
+    # bypasses ORM row processing, which dominates for large integer results;
+    # a server-side cursor hands out a chunk of rows at a time, so millions
+    # of rows are never held as Python tuples at once
+    compiled = stmt.compile(dialect=get_engine().dialect)
+    chunks = [np.empty((0, n_columns), dtype=np.int64)]
+    with closing(db_session.connection().connection.cursor(name="fetch_array")) as cursor:
+        cursor.execute(str(compiled), compiled.params)
+        while rows := cursor.fetchmany(FETCH_CHUNK_ROWS):
+            chunks.append(np.array(rows, dtype=np.int64).reshape(-1, n_columns))
+    return np.concatenate(chunks)
+
+
+def get_all_recommendations(version: int) -> np.ndarray:
+    """All (user, item, rank) rows of a model generation as an (n, 3) array, ordered by user and rank."""
+    return _fetch_array(
+        select(
+            UserRecommendationModel.user,
+            UserRecommendationModel.item,
+            UserRecommendationModel.rank,
+        )
+        .where(UserRecommendationModel.version == version)
+        .order_by(UserRecommendationModel.user, UserRecommendationModel.rank),
+        3,
+    )
+
+
+def get_item_clusters(version: int) -> np.ndarray:
+    """All (item, cluster) rows of a model generation as an (n, 2) array, ordered by item."""
+    return _fetch_array(
+        select(ItemClusterInfo.id, ItemClusterInfo.cluster)
+        .where(ItemClusterInfo.version == version)
+        .order_by(ItemClusterInfo.id),
+        2,
+    )
+
+
+def get_item_neighbours(version: int) -> np.ndarray:
+    """All (item, neighbour, rank) rows of a model generation as an (n, 3) array."""
+    return _fetch_array(
+        select(ItemNeighbour.item, ItemNeighbour.neighbour, ItemNeighbour.rank)
+        .where(ItemNeighbour.version == version)
+        .order_by(ItemNeighbour.item, ItemNeighbour.rank),
+        3,
+    )
+
+
+def _activate(version: int):
+    # two statements, as the partial unique index allows a single active row at any time
+    db_session.query(ModelVersion).filter(ModelVersion.is_active.is_(True)).update(
+        {ModelVersion.is_active: False}
+    )
+    db_session.query(ModelVersion).filter(ModelVersion.id == version).update(
+        {ModelVersion.is_active: True, ModelVersion.activated_at: func.now()}
+    )
+
+
+def activate_model_version(version: int) -> bool:
+    """Make `version` the served model generation, e.g. to roll back a bad update."""
+    if db_session.get(ModelVersion, version) is None:
+        return False
+    _activate(version)
+    db_session.commit()
+    logger.info(f"activated model version {version}")
+    return True
+
+
+def prune_model_versions(keep: int) -> List[int]:
+    """Delete all but the `keep` most recent generations; the active one is never deleted."""
+    keep_ids = select(ModelVersion.id).order_by(ModelVersion.id.desc()).limit(keep)
+    stale = [
+        v
+        for (v,) in db_session.query(ModelVersion.id)
+        .filter(ModelVersion.id.not_in(keep_ids))
+        .filter(ModelVersion.is_active.is_(False))
+        .all()
+    ]
+    if stale:
+        # rows of the model tables go along via ON DELETE CASCADE
+        db_session.query(ModelVersion).filter(ModelVersion.id.in_(stale)).delete()
+        db_session.commit()
+        logger.info(f"pruned model versions {stale}")
+    return stale
+
+
+def log_interactions(events: Sequence[Tuple[int, int]]) -> int:
+    """Write (user, item) interaction events in a single transaction.
+
+    The events are stamped with the time of the database, the clock of
+    `export_watermark`. Unknown users are added to rec_user on the way.
+    Returns the number of interactions written.
+    """
+    if not events:
+        return 0
     try:
-        db_session.add(RecommUser(wisski_id=wisski_user))
+        missing, _ = _insert_users(e[0] for e in events)
+        # executemany; batched into multi-row inserts by SQLAlchemy
+        db_session.execute(
+            insert(InteractionHistory).values(at=func.localtimestamp()),
+            [{"wisski_user": user, "wisski_item": item} for user, item in events],
+        )
         db_session.commit()
     except Exception:
         db_session.rollback()
+        # in case one of the users was removed behind our back
+        forget_users(e[0] for e in events)
+        raise
+    remember_users(missing)
+    return len(events)
 
+
+def log_user_detail_interaction(wisski_user: int, wisski_item: int):
     try:
-        db_session.add(
-            InteractionHistory(wisski_user=wisski_user, wisski_item=wisski_item)
-        )
-        db_session.commit()
+        log_interactions([(wisski_user, wisski_item)])
         return True
     except Exception:
         logger.exception("error in logging interaction history: ")
-        db_session.rollback()
 
     return False
 
 
-def export_user_data(known_users_file):
-    data = pd.read_sql_query(
-        select(RecommUser.wisski_id, RecommUser.first_seen), engine
+# logged search queries are kept this long, and the most recent of them
+# taken into account by query expansion
+SEARCH_QUERY_RETENTION = datetime.timedelta(days=90)
+MAX_SEARCH_QUERIES = 100_000
+
+
+def log_search_queries(queries: Sequence[str]) -> int:
+    """Write search queries in a single transaction. Returns the number written."""
+    if not queries:
+        return 0
+    try:
+        db_session.execute(insert(SearchQuery), [{"text": q} for q in queries])
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    return len(queries)
+
+
+def get_search_queries(limit: int = MAX_SEARCH_QUERIES) -> List[str]:
+    """The most recent logged search queries, newest first."""
+    return list(
+        db_session.scalars(
+            select(SearchQuery.text)
+            .where(SearchQuery.at > func.localtimestamp() - SEARCH_QUERY_RETENTION)
+            .order_by(SearchQuery.at.desc())
+            .limit(limit)
+        )
     )
-    data.to_csv(known_users_file, index=False, sep="\t")
 
 
-def export_interaction_data(interaction_history_file):
-    data = pd.read_sql_query(
-        select(
-            InteractionHistory.wisski_user,
-            InteractionHistory.wisski_item,
-            InteractionHistory.at,
+def prune_search_queries() -> int:
+    """Delete the search queries past their retention. Returns the number deleted."""
+    try:
+        deleted = (
+            db_session.query(SearchQuery)
+            .filter(SearchQuery.at <= func.localtimestamp() - SEARCH_QUERY_RETENTION)
+            .delete(synchronize_session=False)
+        )
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    return deleted
+
+
+# hist_interact is partitioned by month. Partitions are created ahead of
+# time; rows outside of all of them land in the default partition, and are
+# moved out of it once their month gets a partition.
+INTERACTION_PARTITIONS_AHEAD = 2
+_DEFAULT_PARTITION = "hist_interact_default"
+
+
+def _month(moment: datetime.date) -> datetime.date:
+    return datetime.date(moment.year, moment.month, 1)
+
+
+def _add_months(month: datetime.date, n: int) -> datetime.date:
+    year, index = divmod(month.year * 12 + month.month - 1 + n, 12)
+    return datetime.date(year, index + 1, 1)
+
+
+def interaction_partition_name(month: datetime.date) -> str:
+    return f"{InteractionHistory.__tablename__}_{month:%Y%m}"
+
+
+def interaction_partitions() -> List[datetime.date]:
+    """Months with a partition of hist_interact, oldest first."""
+    names = db_session.scalars(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = CAST(:table AS regclass)"
         ),
-        engine,
+        {"table": InteractionHistory.__tablename__},
+    )
+    prefix = f"{InteractionHistory.__tablename__}_"
+    return sorted(
+        datetime.datetime.strptime(n[len(prefix) :], "%Y%m").date()
+        for n in names
+        if n != _DEFAULT_PARTITION
     )
-    data.to_csv(interaction_history_file, index=False, sep="\t")
+
+
+def _create_interaction_partition(cursor, month: datetime.date):
+    name = psql.Identifier(interaction_partition_name(month))
+    start, end = month, _add_months(month, 1)
+    cursor.execute(
+        psql.SQL(
+            "CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        ).format(name, psql.Identifier(InteractionHistory.__tablename__))
+    )
+    # rows of the month may already be in the default partition, which must
+    # not overlap with the new partition
+    cursor.execute(
+        psql.SQL(
+            "WITH moved AS (DELETE FROM {} WHERE at >= %s AND at < %s RETURNING *)"
+            " INSERT INTO {} SELECT * FROM moved"
+        ).format(psql.Identifier(_DEFAULT_PARTITION), name),
+        (start, end),
+    )
+    # DDL can't take bind parameters
+    cursor.execute(
+        psql.SQL("ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM ({}) TO ({})").format(
+            psql.Identifier(InteractionHistory.__tablename__),
+            name,
+            psql.Literal(start),
+            psql.Literal(end),
+        )
+    )
+
+
+def ensure_interaction_partitions(
+    ahead: int = INTERACTION_PARTITIONS_AHEAD,
+    months: Iterable[datetime.date] = (),
+) -> List[datetime.date]:
+    """Create the partitions of hist_interact up to `ahead` months from now,
+    for `months`, and for rows in the default partition. Returns the months
+    of the partitions created."""
+    cursor = db_session.connection().connection.cursor()
+    cursor.execute(
+        psql.SQL("CREATE TABLE IF NOT EXISTS {} PARTITION OF {} DEFAULT").format(
+            psql.Identifier(_DEFAULT_PARTITION),
+            psql.Identifier(InteractionHistory.__tablename__),
+        )
+    )
+    cursor.execute(
+        psql.SQL("SELECT DISTINCT date_trunc('month', at)::date FROM {}").format(
+            psql.Identifier(_DEFAULT_PARTITION)
+        )
+    )
+    stray = [m for (m,) in cursor.fetchall()]
+
+    current = _month(datetime.date.today())
+    wanted = {_add_months(current, n) for n in range(ahead + 1)}
+    wanted.update(_month(m) for m in months)
+    wanted.update(stray)
+    missing = sorted(wanted - set(interaction_partitions()))
+    try:
+        for month in missing:
+            _create_interaction_partition(cursor, month)
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    if missing:
+        logger.info(f"created interaction partitions for {[str(m) for m in missing]}")
+    return missing
+
+
+_ROLLUP_USERS = """
+INSERT INTO interaction_daily_user (day, wisski_user, interactions, items)
+SELECT at::date, wisski_user, count(*), count(DISTINCT wisski_item)
+FROM hist_interact
+WHERE at >= :start AND at < :end
+GROUP BY 1, 2
+ON CONFLICT (day, wisski_user) DO UPDATE
+SET interactions = EXCLUDED.interactions, items = EXCLUDED.items
+"""
+
+_ROLLUP_ITEMS = """
+INSERT INTO interaction_daily_item (day, wisski_item, interactions, users)
+SELECT at::date, wisski_item, count(*), count(DISTINCT wisski_user)
+FROM hist_interact
+WHERE at >= :start AND at < :end
+GROUP BY 1, 2
+ON CONFLICT (day, wisski_item) DO UPDATE
+SET interactions = EXCLUDED.interactions, users = EXCLUDED.users
+"""
+
+
+def rolled_up_until() -> datetime.date | None:
+    """The day after the last day with rolled-up interactions."""
+    day = db_session.scalar(select(func.max(InteractionDailyUser.day)))
+    return day + datetime.timedelta(days=1) if day is not None else None
+
+
+def rollup_interactions(until: datetime.date | None = None) -> Tuple[int, int]:
+    """Aggregate the interactions of the days before `until` that are not
+    rolled up yet into daily counts per user and per item.
+
+    `until` defaults to the day of the export watermark, the first day that
+    may still get interactions. The last rolled-up day is aggregated again,
+    in case interactions arrived after it was. Returns the number of user
+    and item rows written.
+    """
+    if until is None:
+        until = export_watermark().date()
+    start = rolled_up_until()
+    if start is None:
+        first = db_session.scalar(select(func.min(InteractionHistory.at)))
+        if first is None:
+            return 0, 0
+        start = first.date()
+    else:
+        start -= datetime.timedelta(days=1)
+    if start >= until:
+        return 0, 0
+
+    window = {"start": start, "end": until}
+    connection = db_session.connection()
+    users = connection.execute(text(_ROLLUP_USERS), window).rowcount
+    items = connection.execute(text(_ROLLUP_ITEMS), window).rowcount
+    db_session.commit()
+    logger.info(f"rolled up interactions from {start} to {until}")
+    return users, items
+
+
+def prune_interactions(before: datetime.date) -> Tuple[List[datetime.date], int]:
+    """Delete the interactions before `before`, but none that aren't rolled up.
+
+    Partitions entirely before the cutoff are dropped, remaining rows are
+    deleted. Returns the months of the dropped partitions and the number of
+    rows deleted.
+    """
+    end = rolled_up_until()
+    if end is None:
+        return [], 0
+    before = min(before, end)
+
+    dropped = [
+        m for m in interaction_partitions() if _add_months(m, 1) <= before
+    ]
+    try:
+        for month in dropped:
+            db_session.execute(
+                text(f'DROP TABLE "{interaction_partition_name(month)}"')
+            )
+        deleted = (
+            db_session.query(InteractionHistory)
+            .filter(InteractionHistory.at < before)
+            .delete(synchronize_session=False)
+        )
+        db_session.commit()
+    except Exception:
+        db_session.rollback()
+        raise
+    if dropped or deleted:
+        logger.info(
+            f"pruned interactions before {before}: dropped partitions"
+            f" {[str(m) for m in dropped]}, deleted {deleted} rows"
+        )
+    return dropped, deleted
+
+
+# rows are exported up to this long before the time of the export, so rows
+# committed late, e.g. by the batched interaction logger, are not missed by
+# an export using the returned watermark as its `since`
+EXPORT_WATERMARK_LAG = datetime.timedelta(seconds=60)
+
+
+def export_watermark() -> datetime.datetime:
+    """Upper bound of the rows of an export started now."""
+    return db_session.scalar(
+        text("SELECT LOCALTIMESTAMP - :lag"), {"lag": EXPORT_WATERMARK_LAG}
+    )
+
+
+def _time_window(
+    time_column: str, since: datetime.datetime | None, until: datetime.datetime
+) -> psql.Composable:
+    # COPY can't take bind parameters; the values are quoted client-side
+    column = psql.Identifier(time_column)
+    conditions = [psql.SQL("{} <= {}").format(column, psql.Literal(until))]
+    if since is not None:
+        conditions.append(psql.SQL("{} > {}").format(column, psql.Literal(since)))
+    return psql.SQL(" AND ").join(conditions)
+
+
+def _copy_out(
+    columns: Sequence[str],
+    table: str,
+    time_column: str,
+    since: datetime.datetime | None,
+    until: datetime.datetime,
+) -> Iterator[bytes]:
+    query = psql.SQL(
+        "COPY (SELECT {} FROM {} WHERE {} ORDER BY {}) "
+        "TO STDOUT WITH (FORMAT csv, DELIMITER E'\\t', HEADER)"
+    ).format(
+        psql.SQL(", ").join(map(psql.Identifier, columns)),
+        psql.Identifier(table),
+        _time_window(time_column, since, until),
+        psql.Identifier(time_column),
+    )
+
+    # a connection of its own, as the rows are streamed after the request
+    # handler returned
+    connection = get_engine().raw_connection()
+    try:
+        with closing(connection.cursor()) as cursor:
+            with cursor.copy(query) as copy:
+                for data in copy:
+                    yield bytes(data)
+    finally:
+        connection.rollback()
+        connection.close()
+
+
+def export_user_data(
+    until: datetime.datetime, since: datetime.datetime | None = None
+) -> Iterator[bytes]:
+    """Tab-separated users first seen after `since` and up to `until`, as chunks."""
+    return _copy_out(
+        ("wisski_id", "first_seen"), RecommUser.__tablename__, "first_seen", since, until
+    )
+
+
+def export_interaction_data(
+    until: datetime.datetime, since: datetime.datetime | None = None
+) -> Iterator[bytes]:
+    """Tab-separated interactions after `since` and up to `until`, as chunks."""
+    return _copy_out(
+        ("wisski_user", "wisski_item", "at"),
+        InteractionHistory.__tablename__,
+        "at",
+        since,
+        until,
+    )
+
+
+# rows packed into one value by _fetch_packed, well below the 1GB limit of bytea
+PACKED_CHUNK_ROWS = 1_000_000
+
+
+def _fetch_packed(
+    table: str, columns: Sequence[str], where: psql.Composable
+) -> np.ndarray:
+    """Rows of `table` matching `where` as an (n, len(columns)) int64 array,
+    ordered by id. `columns` are SQL expressions of type bigint.
+
+    Every chunk of rows is packed into a single bytea on the server: a round
+    trip per chunk instead of decoding millions of rows one at a time, which
+    takes far longer than the query itself.
+    """
+    packed = psql.SQL(" || ").join(
+        psql.SQL("int8send({})").format(psql.SQL(c)) for c in columns
+    )
+    cursor = db_session.connection().connection.cursor()
+    cursor.execute(
+        psql.SQL("SELECT min(id), max(id) FROM {} WHERE {}").format(
+            psql.Identifier(table), where
+        )
+    )
+    ((first, last),) = cursor.fetchall()
+
+    chunks = []
+    if first is not None:
+        query = psql.SQL(
+            "SELECT string_agg({}, '' ORDER BY id) FROM {} "
+            "WHERE id >= %s AND id < %s AND {}"
+        ).format(packed, psql.Identifier(table), where)
+        for start in range(first, last + 1, PACKED_CHUNK_ROWS):
+            cursor.execute(query, (start, start + PACKED_CHUNK_ROWS))
+            ((data,),) = cursor.fetchall()
+            if data is not None:
+                chunks.append(np.frombuffer(data, dtype=">i8"))
+    if not chunks:
+        return np.empty((0, len(columns)), dtype=np.int64)
+    return np.concatenate(chunks).astype(np.int64).reshape(-1, len(columns))
+
+
+# microseconds since the epoch of a timestamp column, as bigint
+_EPOCH_MICROSECONDS = "(extract(epoch FROM {}) * 1000000)::bigint"
+
+
+def get_interactions(
+    until: datetime.datetime, since: datetime.datetime | None = None
+) -> np.ndarray:
+    """(user, item, at) rows of the interactions after `since` and up to
+    `until` as an (n, 3) array, ordered by time; `at` is in microseconds
+    since the epoch."""
+    rows = _fetch_packed(
+        InteractionHistory.__tablename__,
+        ("wisski_user", "wisski_item", _EPOCH_MICROSECONDS.format("at")),
+        _time_window("at", since, until),
+    )
+    # stable, so interactions at the same time stay in the order of their id
+    return rows[np.argsort(rows[:, 2], kind="stable")]
+
+
+def get_users_seen(
+    until: datetime.datetime, since: datetime.datetime | None = None
+) -> np.ndarray:
+    """WissKI ids of the users first seen after `since` and up to `until`, in that order."""
+    rows = _fetch_packed(
+        RecommUser.__tablename__,
+        ("wisski_id", _EPOCH_MICROSECONDS.format("first_seen")),
+        _time_window("first_seen", since, until),
+    )
+    return rows[np.argsort(rows[:, 1], kind="stable"), 0]
 
 
 class UpdateModelResult(TypedDict):
+    model_version: int
+    delta: bool
     cluster_assignments_to_write: int
     cluster_assignments_written: int
+    cluster_assignments_rejected: int
+    cluster_assignments_deleted: int
     reco_assignments_written: int
     reco_assignments_to_write: int
+    reco_assignments_rejected: int
+    reco_assignments_deleted: int
+    neighbours_written: int
     elapsed: float
+    # seconds spent in each step of the update, in order
+    phases: Dict[str, float]
+
+
+@contextmanager
+def _phase(result: UpdateModelResult, name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        spent = time.perf_counter() - start
+        result["phases"][name] = result["phases"].get(name, 0.0) + spent
+
+
+def _copy_rows(cursor, table: str, columns: Sequence[str], rows: Iterable) -> int:
+    """Stream `rows` (mappings keyed by `columns`) into `table` via COPY."""
+    n = 0
+    cols = ", ".join(f'"{c}"' for c in columns)
+    with cursor.copy(f"COPY {table} ({cols}) FROM STDIN") as copy:
+        for row in rows:
+            copy.write_row([row[c] for c in columns])
+            n += 1
+    return n
+
+
+# Staged rows are moved into the model tables set-wise. Duplicate keys keep
+# the row with the best rank; recommendations for unknown users or items are
+# dropped instead of violating the foreign keys. The constraints stay in
+# place: altering them would lock the tables against request-path writes
+# and reads until the commit.
+_INSERT_CLUSTERS = """
+INSERT INTO item_cluster (version, id, cluster, rank)
+SELECT DISTINCT ON (s.id) %(version)s, s.id, s.cluster, s.rank
+FROM stage_item_cluster s
+ORDER BY s.id, s.rank
+"""
+
+_INSERT_RECOS = """
+INSERT INTO user_recommendation_model (version, "user", item, rank)
+SELECT DISTINCT ON (s."user", s.item) %(version)s, s."user", s.item, s.rank
+FROM stage_reco s
+JOIN rec_user u ON u.wisski_id = s."user"
+JOIN item_cluster c ON c.version = %(version)s AND c.id = s.item
+ORDER BY s."user", s.item, s.rank
+"""
+
+
+# Neighbours of an item are the best ranked items of its cluster plus items
+# viewed by the same users. Only the most recent interactions of each user
+# count, so heavy users don't blow up the number of pairs. Unclustered items
+# (cluster -1) neither get nor are neighbours.
+NEIGHBOURS_PER_ITEM = 20
+NEIGHBOUR_INTERACTIONS_PER_USER = 50
+# weight of one co-viewing user relative to the top item of the cluster
+NEIGHBOUR_COOCCURRENCE_WEIGHT = 1.0
+# only recent interactions count, which also spares reading old partitions
+NEIGHBOUR_HISTORY = datetime.timedelta(days=365)
+
+_BUILD_NEIGHBOURS = """
+INSERT INTO item_neighbour (version, item, rank, neighbour, score)
+WITH items AS (
+    SELECT id, cluster, rank FROM item_cluster
+    WHERE version = %(version)s AND cluster <> -1
+), top AS (
+    SELECT * FROM (
+        SELECT cluster, id,
+            row_number() OVER (PARTITION BY cluster ORDER BY rank, id) AS pos
+        FROM items
+        WHERE cluster <> -1
+    ) t
+    WHERE pos <= %(k)s + 1
+), cluster_pairs AS (
+    SELECT i.id AS item, t.id AS neighbour, 1.0 / t.pos AS score
+    FROM items i
+    JOIN top t ON t.cluster = i.cluster AND t.id <> i.id
+), seen AS (
+    SELECT u, i FROM (
+        SELECT h.wisski_user AS u, h.wisski_item AS i,
+            row_number() OVER (
+                PARTITION BY h.wisski_user ORDER BY max(h.at) DESC
+            ) AS recent
+        FROM hist_interact h
+        JOIN items ON items.id = h.wisski_item
+        WHERE h.at >= LOCALTIMESTAMP - %(history)s
+        GROUP BY h.wisski_user, h.wisski_item
+    ) s
+    WHERE recent <= %(per_user)s
+), co_pairs AS (
+    SELECT a.i AS item, b.i AS neighbour, %(co_weight)s * count(*) AS score
+    FROM seen a
+    JOIN seen b ON a.u = b.u AND a.i <> b.i
+    GROUP BY a.i, b.i
+), ranked AS (
+    SELECT item, neighbour, score,
+        row_number() OVER (PARTITION BY item ORDER BY score DESC, neighbour) - 1 AS rank
+    FROM (
+        SELECT item, neighbour, sum(score) AS score
+        FROM (SELECT * FROM cluster_pairs UNION ALL SELECT * FROM co_pairs) p
+        GROUP BY item, neighbour
+    ) scored
+)
+SELECT %(version)s, item, rank, neighbour, score FROM ranked WHERE rank < %(k)s
+"""
+
+
+def _build_neighbours(cursor, version: int) -> int:
+    cursor.execute("DELETE FROM item_neighbour WHERE version = %s", (version,))
+    cursor.execute(
+        _BUILD_NEIGHBOURS,
+        {
+            "version": version,
+            "k": NEIGHBOURS_PER_ITEM,
+            "per_user": NEIGHBOUR_INTERACTIONS_PER_USER,
+            "co_weight": NEIGHBOUR_COOCCURRENCE_WEIGHT,
+            "history": NEIGHBOUR_HISTORY,
+        },
+    )
+    return cursor.rowcount
+
+
+# Delta updates diff the staged export against the active generation and
+# only touch rows that were inserted, changed or removed.
+_DELTA_NEW_CLUSTERS = """
+CREATE TEMP TABLE new_item_cluster ON COMMIT DROP AS
+SELECT DISTINCT ON (s.id) s.id, s.cluster, s.rank
+FROM stage_item_cluster s
+ORDER BY s.id, s.rank
+"""
+
+_DELTA_NEW_RECOS = """
+CREATE TEMP TABLE new_reco ON COMMIT DROP AS
+SELECT DISTINCT ON (s."user", s.item) s."user", s.item, s.rank
+FROM stage_reco s
+JOIN rec_user u ON u.wisski_id = s."user"
+JOIN new_item_cluster c ON c.id = s.item
+ORDER BY s."user", s.item, s.rank
+"""
+
+_DELTA_UPSERT_CLUSTERS = """
+WITH upserted AS (
+    INSERT INTO item_cluster (version, id, cluster, rank)
+    SELECT %(version)s, n.id, n.cluster, n.rank FROM new_item_cluster n
+    ON CONFLICT (version, id) DO UPDATE
+    SET cluster = EXCLUDED.cluster, rank = EXCLUDED.rank
+    WHERE (item_cluster.cluster, item_cluster.rank)
+        IS DISTINCT FROM (EXCLUDED.cluster, EXCLUDED.rank)
+    RETURNING xmax = 0 AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+FROM upserted
+"""
+
+_DELTA_UPSERT_RECOS = """
+WITH upserted AS (
+    INSERT INTO user_recommendation_model (version, "user", item, rank)
+    SELECT %(version)s, n."user", n.item, n.rank FROM new_reco n
+    ON CONFLICT (version, "user", item) DO UPDATE
+    SET rank = EXCLUDED.rank
+    WHERE user_recommendation_model.rank IS DISTINCT FROM EXCLUDED.rank
+    RETURNING xmax = 0 AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+FROM upserted
+"""
+
+_DELTA_DELETE_RECOS = """
+DELETE FROM user_recommendation_model r
+WHERE r.version = %(version)s
+AND NOT EXISTS (SELECT 1 FROM new_reco n WHERE n."user" = r."user" AND n.item = r.item)
+"""
+
+_DELTA_DELETE_CLUSTERS = """
+DELETE FROM item_cluster c
+WHERE c.version = %(version)s
+AND NOT EXISTS (SELECT 1 FROM new_item_cluster n WHERE n.id = c.id)
+"""
+
+
+def _analyze_new_version(cursor):
+    # until analyzed, the planner takes the rows of a new generation for a
+    # handful and joins them by nested loops in the recommendation insert
+    # and the neighbour build
+    cursor.execute(f"ANALYZE {ItemClusterInfo.__tablename__}")
+
+
+def _create_staging_tables(cursor):
+    cursor.execute(
+        "CREATE TEMP TABLE stage_item_cluster (id integer, cluster integer, rank integer) ON COMMIT DROP"
+    )
+    cursor.execute(
+        'CREATE TEMP TABLE stage_reco ("user" integer, item integer, rank integer) ON COMMIT DROP'
+    )
+
+
+def _load_new_version(
+    cluster_data: Iterable, recommendation_data: Iterable, result: UpdateModelResult
+):
+    version = ModelVersion()
+    db_session.add(version)
+    db_session.flush()
+    params = {"version": version.id}
+
+    cursor = db_session.connection().connection.cursor()
+    _create_staging_tables(cursor)
+
+    # the exports are downloaded and parsed while they are staged
+    with _phase(result, "stage_clusters"):
+        n_cluster = _copy_rows(
+            cursor, "stage_item_cluster", ("id", "cluster", "rank"), cluster_data
+        )
+    with _phase(result, "insert_clusters"):
+        cursor.execute(_INSERT_CLUSTERS, params)
+        result["cluster_assignments_written"] = cursor.rowcount
+        _analyze_new_version(cursor)
+    result["cluster_assignments_to_write"] = n_cluster
+
+    with _phase(result, "stage_recos"):
+        n_recos = _copy_rows(
+            cursor, "stage_reco", ("user", "item", "rank"), recommendation_data
+        )
+    with _phase(result, "insert_recos"):
+        cursor.execute(_INSERT_RECOS, params)
+        result["reco_assignments_written"] = cursor.rowcount
+    result["reco_assignments_to_write"] = n_recos
+
+    with _phase(result, "neighbours"):
+        result["neighbours_written"] = _build_neighbours(cursor, version.id)
+
+    _activate(version.id)
+    result["model_version"] = version.id
+
+
+def _apply_delta(
+    version: int,
+    cluster_data: Iterable,
+    recommendation_data: Iterable,
+    result: UpdateModelResult,
+):
+    params = {"version": version}
+    cursor = db_session.connection().connection.cursor()
+    _create_staging_tables(cursor)
+
+    with _phase(result, "stage_clusters"):
+        result["cluster_assignments_to_write"] = _copy_rows(
+            cursor, "stage_item_cluster", ("id", "cluster", "rank"), cluster_data
+        )
+    with _phase(result, "stage_recos"):
+        result["reco_assignments_to_write"] = _copy_rows(
+            cursor, "stage_reco", ("user", "item", "rank"), recommendation_data
+        )
+
+    with _phase(result, "diff"):
+        cursor.execute(_DELTA_NEW_CLUSTERS)
+        n_cluster = cursor.rowcount
+        cursor.execute(_DELTA_NEW_RECOS)
+        n_recos = cursor.rowcount
+
+    # items first, so new recommendations can reference them; stale items
+    # last, once no recommendation points to them anymore
+    with _phase(result, "insert_clusters"):
+        cursor.execute(_DELTA_UPSERT_CLUSTERS, params)
+        ((cluster_inserted, cluster_updated),) = cursor.fetchall()
+    with _phase(result, "insert_recos"):
+        cursor.execute(_DELTA_DELETE_RECOS, params)
+        reco_deleted = cursor.rowcount
+        cursor.execute(_DELTA_UPSERT_RECOS, params)
+        ((reco_inserted, reco_updated),) = cursor.fetchall()
+    with _phase(result, "insert_clusters"):
+        cursor.execute(_DELTA_DELETE_CLUSTERS, params)
+        cluster_deleted = cursor.rowcount
+
+    logger.info(
+        f"delta for model version {version}: items +{cluster_inserted} ~{cluster_updated} -{cluster_deleted},"
+        f" recommendations +{reco_inserted} ~{reco_updated} -{reco_deleted}"
+    )
+
+    result["model_version"] = version
+    result["cluster_assignments_written"] = cluster_inserted + cluster_updated
+    result["cluster_assignments_deleted"] = cluster_deleted
+    result["reco_assignments_written"] = reco_inserted + reco_updated
+    result["reco_assignments_deleted"] = reco_deleted
+    # rows identical to the active generation are not rewritten, but were
+    # accepted; only duplicates and rows for unknown users/items are rejected
+    result["cluster_assignments_rejected"] = (
+        result["cluster_assignments_to_write"] - n_cluster
+    )
+    result["reco_assignments_rejected"] = result["reco_assignments_to_write"] - n_recos
+
+    if cluster_inserted + cluster_updated + cluster_deleted:
+        with _phase(result, "neighbours"):
+            result["neighbours_written"] = _build_neighbours(cursor, version)
+
+    if cluster_inserted + cluster_updated + cluster_deleted + reco_inserted + reco_updated + reco_deleted:
+        # tells workers that their snapshot of this generation is outdated
+        db_session.query(ModelVersion).filter(ModelVersion.id == version).update(
+            {ModelVersion.revision: ModelVersion.revision + 1}
+        )
 
 
 def update_model_infos(
-    cluster_data: Sequence, recommendation_data: Sequence
+    cluster_data: Iterable,
+    recommendation_data: Iterable,
+    keep_versions: int = 3,
+    delta: bool = False,
 ) -> UpdateModelResult:
+    """Load a new model generation and make it the active one.
+
+    All rows are written under a fresh model version, which is activated in
+    the same transaction. Readers keep seeing the previous generation until
+    the commit and never observe a partially loaded model. Afterwards, only
+    the newest `keep_versions` generations are kept.
+
+    With `delta`, the export is instead diffed against the active generation
+    and only inserted, changed and removed rows are applied to it, again in a
+    single transaction.
+    """
     logger.debug("updating model infos")
     start = time.time()
+    result = UpdateModelResult(
+        model_version=0,
+        delta=False,
+        cluster_assignments_to_write=0,
+        cluster_assignments_written=0,
+        cluster_assignments_rejected=0,
+        cluster_assignments_deleted=0,
+        reco_assignments_to_write=0,
+        reco_assignments_written=0,
+        reco_assignments_rejected=0,
+        reco_assignments_deleted=0,
+        neighbours_written=0,
+        elapsed=0.0,
+        phases={},
+    )
+
+    active = get_model_version() if delta else None
+    if delta and active is None:
+        logger.info("no active model version to apply a delta to, loading in full")
 
     try:
-        # must come first due to foreign key relations to ItemClusterInfo
-        db_session.query(UserRecommendationModel).delete()
-        db_session.query(ItemClusterInfo).delete()
-        db_session.commit()
+        if active is None:
+            _load_new_version(cluster_data, recommendation_data, result)
+            result["cluster_assignments_rejected"] = (
+                result["cluster_assignments_to_write"]
+                - result["cluster_assignments_written"]
+            )
+            result["reco_assignments_rejected"] = (
+                result["reco_assignments_to_write"] - result["reco_assignments_written"]
+            )
+        else:
+            result["delta"] = True
+            _apply_delta(active, cluster_data, recommendation_data, result)
+        with _phase(result, "commit"):
+            db_session.commit()
     except Exception:
         db_session.rollback()
-        logger.exception("Error truncating tables prior to update")
-        return UpdateModelResult(
-            cluster_assignments_to_write=len(cluster_data),
-            cluster_assignments_written=0,
-            reco_assignments_to_write=len(recommendation_data),
-            reco_assignments_written=0,
-            elapsed=time.time() - start,
-        )
-
-    # try is outside the loop as insertion shouldn't fail for single items
-    with db_session.begin():
-        for item in cluster_data:
-            db_session.add(
-                ItemClusterInfo(
-                    id=item["id"], cluster=item["cluster"], rank=item["rank"]
-                )
-            )
+        logger.exception("Error loading model infos")
+        raise
 
-    # try inside loop, as inserting a single row can violate foreign key constraints, in which case we want to simply continue
-    for item in recommendation_data:
-        db_session.add(
-            UserRecommendationModel(
-                user=item["user"], item=item["item"], rank=item["rank"]
-            )
-        )
+    logger.info(
+        f"read {result['cluster_assignments_written']} items to {ItemClusterInfo.__tablename__}"
+        f" ({result['cluster_assignments_rejected']} rejected)"
+    )
+    logger.info(
+        f"read {result['reco_assignments_written']} items to {UserRecommendationModel.__tablename__}"
+        f" ({result['reco_assignments_rejected']} rejected)"
+    )
+
+    if not result["delta"]:
+        logger.info(f"activated model version {result['model_version']}")
         try:
-            db_session.commit()
-        except (IntegrityError, ForeignKeyViolation):
+            with _phase(result, "prune"):
+                prune_model_versions(keep_versions)
+        except Exception:
             db_session.rollback()
-            logger.exception("Integrity error inserting user-reco. Rolling back.")
+            logger.exception("Error pruning old model versions")
+
+    result["elapsed"] = time.time() - start
+    return result
+
+
+# binary COPY representations of the column types bulk loaded from arrays
+_BINARY_TYPES = {
+    "int2": ">i2",
+    "int4": ">i4",
+    "int8": ">i8",
+    "float4": ">f4",
+    "float8": ">f8",
+    "timestamp": ">i8",
+}
+_BINARY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+_BINARY_TRAILER = struct.pack(">h", -1)
+# PostgreSQL counts timestamps from 2000-01-01
+_PG_EPOCH_MICROSECONDS = 946_684_800_000_000
+COPY_CHUNK_ROWS = 1_000_000
 
-    n_rows_cluster = db_session.query(ItemClusterInfo).count()
-    logger.info(f"read {n_rows_cluster} items to {ItemClusterInfo.__tablename__}")
 
-    n_rows_recos = db_session.query(UserRecommendationModel).count()
-    logger.info(f"read {n_rows_recos} items to {UserRecommendationModel.__tablename__}")
+def copy_arrays(cursor, table: str, columns: Mapping[str, np.ndarray]) -> int:
+    """Bulk load equally long arrays into the `columns` of `table`.
 
-    return UpdateModelResult(
-        cluster_assignments_to_write=len(cluster_data),
-        cluster_assignments_written=n_rows_cluster,
-        reco_assignments_to_write=len(recommendation_data),
-        reco_assignments_written=n_rows_recos,
-        elapsed=time.time() - start,
+    The rows are encoded for a binary COPY by numpy, a chunk at a time.
+    Timestamps are given in microseconds since the Unix epoch.
+    """
+    cursor.execute(
+        "SELECT a.attname, t.typname FROM pg_attribute a"
+        " JOIN pg_type t ON t.oid = a.atttypid"
+        " WHERE a.attrelid = %s::regclass AND a.attname = ANY(%s)",
+        (table, list(columns)),
     )
+    types = dict(cursor.fetchall())
+    fields = [("fields", ">i2")]
+    for i, name in enumerate(columns):
+        fields += [(f"length{i}", ">i4"), (f"value{i}", _BINARY_TYPES[types[name]])]
+    dtype = np.dtype(fields)
+
+    n = len(next(iter(columns.values())))
+    statement = psql.SQL("COPY {} ({}) FROM STDIN (FORMAT BINARY)").format(
+        psql.Identifier(table), psql.SQL(", ").join(map(psql.Identifier, columns))
+    )
+    with cursor.copy(statement) as copy:
+        copy.write(_BINARY_HEADER)
+        for start in range(0, n, COPY_CHUNK_ROWS):
+            stop = min(start + COPY_CHUNK_ROWS, n)
+            block = np.empty(stop - start, dtype)
+            block["fields"] = len(columns)
+            for i, (name, values) in enumerate(columns.items()):
+                values = values[start:stop]
+                if types[name] == "timestamp":
+                    values = values - _PG_EPOCH_MICROSECONDS
+                block[f"length{i}"] = dtype[f"value{i}"].itemsize
+                block[f"value{i}"] = values
+            copy.write(block.tobytes())
+        copy.write(_BINARY_TRAILER)
+    return n
+
+
+def truncate_recommendation_data():
+    """Delete all users, interactions and model generations."""
+    db_session.execute(
+        text(
+            "TRUNCATE rec_user, hist_interact, interaction_daily_user,"
+            " interaction_daily_item, model_version, item_cluster,"
+            " user_recommendation_model, item_neighbour RESTART IDENTITY CASCADE"
+        )
+    )
+    db_session.commit()
+    forget_users()
+
+
+def bulk_load_users(wisski_ids: np.ndarray, first_seen: np.ndarray) -> int:
+    """Add users, with the microseconds since the epoch they were first seen."""
+    cursor = db_session.connection().connection.cursor()
+    n = copy_arrays(
+        cursor,
+        RecommUser.__tablename__,
+        {"wisski_id": wisski_ids, "first_seen": first_seen},
+    )
+    db_session.commit()
+    return n
+
+
+def bulk_load_interactions(
+    blocks: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    months: Iterable[datetime.date] = (),
+) -> int:
+    """Add (user, item, microseconds since the epoch) interactions of known users.
+
+    Partitions are created for `months` first, which should cover the
+    interactions; rows of other months are moved out of the default
+    partition afterwards.
+    """
+    ensure_interaction_partitions(months=months)
+    db_session.commit()
+    cursor = db_session.connection().connection.cursor()
+    n = 0
+    for users, items, at in blocks:
+        n += copy_arrays(
+            cursor,
+            InteractionHistory.__tablename__,
+            {"wisski_user": users, "wisski_item": items, "at": at},
+        )
+    db_session.commit()
+    # rows went to the default partition for months without one
+    ensure_interaction_partitions()
+    db_session.commit()
+    return n
+
+
+def load_model_arrays(
+    clusters: Tuple[np.ndarray, np.ndarray, np.ndarray],
+    recommendations: Iterable[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+    keep_versions: int = 3,
+    neighbours: bool = True,
+) -> UpdateModelResult:
+    """Load and activate a model generation given as arrays.
+
+    `clusters` are (item, cluster, rank) and `recommendations` blocks of
+    (user, item, rank); unlike `update_model_infos`, they must be free of
+    duplicates and only refer to known users and items. Without
+    `neighbours`, the item neighbours are left empty.
+    """
+    start = time.time()
+    version = ModelVersion()
+    db_session.add(version)
+    db_session.flush()
+    cursor = db_session.connection().connection.cursor()
+    result = UpdateModelResult(
+        model_version=version.id,
+        delta=False,
+        cluster_assignments_to_write=0,
+        cluster_assignments_written=0,
+        cluster_assignments_rejected=0,
+        cluster_assignments_deleted=0,
+        reco_assignments_to_write=0,
+        reco_assignments_written=0,
+        reco_assignments_rejected=0,
+        reco_assignments_deleted=0,
+        neighbours_written=0,
+        elapsed=0.0,
+        phases={},
+    )
+
+    items, cluster, rank = clusters
+    with _phase(result, "insert_clusters"):
+        n_cluster = copy_arrays(
+            cursor,
+            ItemClusterInfo.__tablename__,
+            {
+                "version": np.full(len(items), version.id),
+                "id": items,
+                "cluster": cluster,
+                "rank": rank,
+            },
+        )
+        _analyze_new_version(cursor)
+    n_recos = 0
+    with _phase(result, "insert_recos"):
+        for users, recommended, rank in recommendations:
+            n_recos += copy_arrays(
+                cursor,
+                UserRecommendationModel.__tablename__,
+                {
+                    "version": np.full(len(users), version.id),
+                    "user": users,
+                    "item": recommended,
+                    "rank": rank,
+                },
+            )
+    if neighbours:
+        with _phase(result, "neighbours"):
+            result["neighbours_written"] = _build_neighbours(cursor, version.id)
+    _activate(version.id)
+    with _phase(result, "commit"):
+        db_session.commit()
+    with _phase(result, "prune"):
+        prune_model_versions(keep_versions)
+
+    result["cluster_assignments_to_write"] = result["cluster_assignments_written"] = n_cluster
+    result["reco_assignments_to_write"] = result["reco_assignments_written"] = n_recos
+    result["elapsed"] = time.time() - start
+    return result
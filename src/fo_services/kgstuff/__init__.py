@@ -1,16 +1,26 @@
 import logging
-from collections.abc import Sequence
-from typing import List
+import os
+from collections.abc import Iterable
+from typing import Dict, List, Tuple
+
+import numpy as np
 
 from ..db import (
     UpdateModelResult,
-    export_interaction_data,
-    export_user_data,
+    ensure_users,
+    get_all_recommendations,
+    get_item_clusters,
+    get_item_neighbours,
     get_itemlist_from_cluster,
-    get_itemlist_from_model,
-    is_new_user,
+    get_model_revision,
+    get_search_queries,
     update_model_infos,
 )
+from .model_file import read_model_file, write_model_file
+from .pagination import InvalidCursor, PageCursor, StaleCursor
+from .query_expansion import QueryExpander, QueryIndex, read_catalogue
+from .ranking import Ranking, RankingEngine
+from .snapshot import RecommendationSnapshot, SnapshotStore
 
 
 logger = logging.getLogger(__name__)
@@ -18,124 +28,226 @@ logger = logging.getLogger(__name__)
 
 class KGHandler(object):
     NUM_DEFAULT_RECOMMENDATIONS = 10
+    NUM_RELATED_ITEMS = 10
+    # seconds between checks whether a newer model has landed in the database
+    SNAPSHOT_CHECK_INTERVAL = 30.0
+    # model generations kept in the database for rolling back
+    MODEL_VERSIONS_TO_KEEP = 3
 
     def __init__(self):
         # we want to mimic the self.args-Object here without calling parse_self...
         # https://stackoverflow.com/a/2827734
         self.data_dir = "/app/"
         self.data_name = "data"
+        # binary copy of the active model, memory-mapped by all workers;
+        # without it, every worker loads the model from the database
+        self.model_file: str | None = None
+        self.snapshots = SnapshotStore(
+            loader=self._load_model,
+            probe=self._model_marker,
+            check_interval=self.SNAPSHOT_CHECK_INTERVAL,
+        )
+        # built on first use, and again when the catalogue or model changes,
+        # taking in the search queries logged until then
+        self.query_index = SnapshotStore(
+            loader=self.load_query_index,
+            probe=self._catalogue_marker,
+            check_interval=self.SNAPSHOT_CHECK_INTERVAL,
+            name="query index",
+        )
+        self.query_expander = QueryExpander()
 
-    def fill_sample_users(self):
-        # for testing purposes: fill db with random user info
-        import os
+    def load_sampled_data(self):
+        # synthetic data is loaded by `flask sample-data generate`
+        pass
 
-        from ..db import Base, db_session, engine
-        from ..models import (
-            InteractionHistory,
-            ItemClusterInfo,
-            RecommUser,
-            UserRecommendationModel,
+    def load_snapshot(self, marker: Tuple[int, int] | None) -> RecommendationSnapshot:
+        if marker is None:
+            logger.warning("no active model version, serving empty recommendations")
+            return RecommendationSnapshot.from_rows(
+                None, np.empty((0, 3)), np.empty(0)
+            )
+
+        version, revision = marker
+        fallback = get_itemlist_from_cluster(self.NUM_DEFAULT_RECOMMENDATIONS, version)
+        snapshot = RecommendationSnapshot.from_rows(
+            version,
+            get_all_recommendations(version),
+            np.array([r[0] for r in fallback], dtype=np.int64),
+            revision,
+            get_item_clusters(version),
+            get_item_neighbours(version),
         )
-
+        return snapshot
+
+    def _model_marker(self):
+        if self.model_file is not None:
+            try:
+                st = os.stat(self.model_file)
+                # os.replace gives a published file a new inode
+                return ("file", self.model_file, st.st_ino, st.st_mtime_ns, st.st_size)
+            except FileNotFoundError:
+                pass
+        return ("db", get_model_revision())
+
+    def _load_model(self, marker) -> RecommendationSnapshot:
+        if marker[0] == "db":
+            return self.load_snapshot(marker[1])
+        return read_model_file(marker[1])
+
+    def publish_model(self) -> RecommendationSnapshot:
+        """Write the active model to the model file, for all workers to map."""
+        snapshot = self.load_snapshot(get_model_revision())
+        if self.model_file is not None:
+            write_model_file(self.model_file, snapshot)
+        self.snapshots.invalidate()
+        return snapshot
+
+    def has_user(self, user_id: int) -> bool:
+        """Whether the served model knows `user_id`; never loads a newer model."""
+        snapshot = self.snapshots.current
+        return snapshot is not None and snapshot.has_user(user_id)
+
+    def _register_users(self, user_ids: List[int]):
+        # make sure unknown users take part in the next training round
         try:
-            UserRecommendationModel.__table__.drop(engine)
-            InteractionHistory.__table__.drop(engine)
-            RecommUser.__table__.drop(engine)
-            ItemClusterInfo.__table__.drop(engine)
+            ensure_users(user_ids)
         except Exception:
-            pass
-        Base.metadata.create_all(bind=engine)
-
-        N = 3
-        recomm_file = f"{self.data_dir}/{self.data_name}/recommendations.csv"
-        if os.path.exists(recomm_file):
-            with open(recomm_file, "rb") as f:
-                try:  # catch OSError in case of a one line file
-                    f.seek(-2, os.SEEK_END)
-                    while f.read(1) != b"\n":
-                        f.seek(-2, os.SEEK_CUR)
-                except OSError:
-                    f.seek(0)
-                last_line = f.readline().decode()
-                N = int(last_line.split(" ")[0]) + 1
-        logger.warning(
-            f"remember: I am creating {N} dummy users right now in KGHandler.fill_sample_data!"
-        )
-
-        for user_id in range(N):
-            db_session.add(RecommUser(wisski_id=user_id))
-        db_session.commit()
-        return N
+            logger.exception("Error registering users")
 
-    def fill_sample_interactions(self, n_users, n_interact_min, n_interact_max):
-        # for testing purposes: fill db with random user info
-        import random
+    @property
+    def catalogue_file(self) -> str:
+        return os.path.join(self.data_dir, self.data_name, "items_id.txt")
 
-        from ..db import db_session
-        from ..models import InteractionHistory
-
-        items = []
-        with open(f"{self.data_dir}/{self.data_name}/items_id.txt", "r") as f:
-            field = f.readline().strip().split(" ")[2]
-            if field != "wisskiid":
-                raise Exception("Deep Shit Error Code")
-            for line in f:
-                items.append(int(line.strip().split(" ")[2]))
-
-        for user in range(n_users):
-            n = random.choice(range(n_interact_min, n_interact_max + 1))
-            interactions = random.sample(items, k=n)
-            for item in interactions:
-                db_session.add(InteractionHistory(wisski_user=user, wisski_item=item))
-
-        db_session.commit()
+    def _catalogue_marker(self):
+        try:
+            mtime = os.stat(self.catalogue_file).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        return (mtime, self.snapshots.get().marker)
+
+    def load_query_index(self, marker) -> QueryIndex:
+        mtime, _ = marker
+        if mtime is None:
+            logger.warning(f"no catalogue at {self.catalogue_file}, query expansion is limited")
+        entries = [] if mtime is None else read_catalogue(self.catalogue_file)
+        snapshot = self.snapshots.get()
+        clusters = dict(
+            zip(snapshot.cluster_items.tolist(), snapshot.clusters.tolist())
+        )
+        return QueryIndex(entries, clusters, get_search_queries())
 
-    def load_sampled_data(self):
-        # import recommendable items to database
-        # ~ self.N = self.fill_sample_users()
-
-        # ~ n_interact_min = 10
-        # ~ n_interact_max = 50
-        # ~ self.fill_sample_interactions(self.N,n_interact_min,n_interact_max)
-        pass
+    def expand_query(self, query: str, max_terms: int = 5) -> List[str]:
+        """Keywords to add to `query`."""
+        return self.query_expander.expand(self.query_index.get(), query, max_terms)
 
     def reload_data(
-        self, cluster_data: Sequence, reco_data: Sequence
+        self, cluster_data: Iterable, reco_data: Iterable, delta: bool = False
     ) -> UpdateModelResult:
-        return update_model_infos(cluster_data, reco_data)
+        result = update_model_infos(
+            cluster_data,
+            reco_data,
+            keep_versions=self.MODEL_VERSIONS_TO_KEEP,
+            delta=delta,
+        )
+        self.publish_model()
+        self.query_index.invalidate()
+        return result
+
+    @staticmethod
+    def _select(
+        snapshot: RecommendationSnapshot, user_id: int, max_n: int, offset: int
+    ) -> Tuple[np.ndarray, bool, int]:
+        """Page of items to recommend from `snapshot`, whether the model knows
+        the user, and the number of items available for the user overall."""
+        reco_items = snapshot.items_for(user_id)
+        known = reco_items is not None
+        if reco_items is None:
+            reco_items = snapshot.fallback
+
+        offset = max(offset, 0)
+        return reco_items[offset : offset + max(max_n, 0)], known, len(reco_items)
+
+    def recommend_page(
+        self,
+        user_id: int,
+        max_n: int,
+        offset: int = 0,
+        cursor: PageCursor | None = None,
+    ) -> Tuple[List[int], PageCursor | None]:
+        """A page of recommendations, and the cursor of the next page if there is one.
+
+        A cursor continues where the previous page ended, in the same model
+        generation; pages are sliced from the snapshot, so every page costs
+        the same.
+        """
+        snapshot = self.snapshots.get()
+        if cursor is not None:
+            if cursor.user != user_id:
+                raise InvalidCursor(f"cursor does not belong to user {user_id}")
+            if cursor.marker != snapshot.marker:
+                raise StaleCursor(
+                    f"cursor of model {cursor.marker}, serving {snapshot.marker}"
+                )
+            offset = cursor.position
+
+        reco_items, known, total = self._select(snapshot, user_id, max_n, offset)
+        if known:
+            logger.debug(f"known user {user_id}. get itemlist from model")
+        else:
+            # unknown to the model; make sure the user is registered for the
+            # next training round and serve the cluster defaults
+            self._register_users([user_id])
+            logger.debug(f"no model for user {user_id}. get itemlist from cluster")
+
+        logger.debug(f"recommending something for wisski user {user_id}")
 
-    def export_user_data(self):
-        usr_file = "/app/known_users.tsv"
-        export_user_data(usr_file)
-        return usr_file
+        end = max(offset, 0) + len(reco_items)
+        next_cursor = None
+        if len(reco_items) and end < total:
+            next_cursor = PageCursor(user=user_id, marker=snapshot.marker, position=end)
 
-    def export_interaction_data(self):
-        intr_file = "/app/user_interactions.tsv"
-        export_interaction_data(intr_file)
-        return intr_file
+        return reco_items.tolist(), next_cursor
 
     def recommend_me_something(
         self, user_id: int, max_n: int, offset: int
     ) -> List[int]:
-        if offset > 0:
-            max_n += offset
-
-        if is_new_user(user_id):
-            reco_items = get_itemlist_from_cluster(self.NUM_DEFAULT_RECOMMENDATIONS)
-            logger.debug(f"new user. get itemlist from cluster: {reco_items}")
-        else:
-            reco_items = get_itemlist_from_model(user_id, max_n)
-            if len(reco_items) == 0:
-                reco_items = get_itemlist_from_cluster(self.NUM_DEFAULT_RECOMMENDATIONS)
-                logger.debug(
-                    f"known user. no recommendations. get itemlist from cluster: {reco_items}"
-                )
-            else:
-                logger.debug(f"known user. get itemlist from model: {reco_items}")
-
-        if offset > 0:
-            reco_items = reco_items[offset : len(reco_items)]
+        return self.recommend_page(user_id, max_n, offset)[0]
+
+    def related_items(self, item_id: int, max_n: int | None = None) -> List[int]:
+        """Items related to `item_id`, from the neighbour index of the model."""
+        if max_n is None:
+            max_n = self.NUM_RELATED_ITEMS
+        return self.snapshots.get().neighbours_of(item_id)[:max_n].tolist()
+
+    def rank(self, user_id: int | None, candidates: Iterable[int]) -> Ranking:
+        """Personalised order of `candidates` for `user_id` (None if anonymous)."""
+        return RankingEngine(self.snapshots.get()).rank(
+            user_id, np.fromiter(candidates, dtype=np.int64)
+        )
 
-        logger.debug(f"recommending something for wisski user {user_id}")
+    def recommend_many(
+        self, requests: Iterable[Tuple[int, int, int]]
+    ) -> Dict[int, List[int]]:
+        """Recommendations for many (user_id, max_n, offset) requests at once.
+
+        All users are answered from the same snapshot; users unknown to the
+        model are registered with a single statement.
+        """
+        snapshot = self.snapshots.get()
+        results = {}
+        unknown = []
+        for user_id, max_n, offset in requests:
+            reco_items, known, _ = self._select(snapshot, user_id, max_n, offset)
+            results[user_id] = reco_items.tolist()
+            if not known:
+                unknown.append(user_id)
+
+        if unknown:
+            self._register_users(unknown)
+
+        logger.debug(
+            f"recommending something for {len(results)} wisski users ({len(unknown)} unknown)"
+        )
 
-        return [r[0] for r in reco_items]
+        return results
@@ -0,0 +1,105 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import tempfile
+from typing import Dict, List
+
+import numpy as np
+
+from .snapshot import RecommendationSnapshot
+
+logger = logging.getLogger(__name__)
+
+# file layout: MAGIC, u64 length of the JSON header, the header, then every
+# array at an offset aligned to ALIGNMENT. All arrays are little-endian int64.
+MAGIC = b"FOMODEL1"
+ALIGNMENT = 64
+DTYPE = np.dtype("<i8")
+
+ARRAYS = (
+    "users",
+    "indptr",
+    "items",
+    "ranks",
+    "fallback",
+    "cluster_items",
+    "clusters",
+    "neighbour_keys",
+    "neighbour_indptr",
+    "neighbours",
+)
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_model_file(path: str, snapshot: RecommendationSnapshot):
+    """Write `snapshot` to `path`, atomically replacing a previous file.
+
+    Readers that mapped the previous file keep their mapping; the new file
+    is only visible once it is complete.
+    """
+    arrays = {name: np.ascontiguousarray(getattr(snapshot, name), DTYPE) for name in ARRAYS}
+    # name -> [offset, length]
+    layout: Dict[str, List[int]] = {}
+    header = {"version": snapshot.version, "revision": snapshot.revision, "arrays": layout}
+
+    # offsets depend on the header size, which depends on the offsets
+    offset = 0
+    for _ in range(2):
+        offset = _aligned(len(MAGIC) + 8 + len(json.dumps(header).encode()) + 64)
+        for name, a in arrays.items():
+            layout[name] = [offset, len(a)]
+            offset = _aligned(offset + a.nbytes)
+    encoded = json.dumps(header).encode()
+
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".model-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(MAGIC)
+            f.write(struct.pack("<Q", len(encoded)))
+            f.write(encoded)
+            for name, a in arrays.items():
+                f.seek(layout[name][0])
+                f.write(a.tobytes())
+            f.truncate(offset)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    logger.info(f"wrote model version {snapshot.marker} to {path} ({offset} bytes)")
+
+
+def read_model_file(path: str) -> RecommendationSnapshot:
+    """Memory-map a file written by `write_model_file`.
+
+    The arrays of the snapshot are read-only views of the mapping, so all
+    processes mapping the same file share its pages.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError(f"{path} is empty")
+        # the mapping stays valid after the file is closed or replaced
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if buffer[: len(MAGIC)] != MAGIC:
+        raise ValueError(f"{path} is not a model file")
+    (length,) = struct.unpack_from("<Q", buffer, len(MAGIC))
+    start = len(MAGIC) + 8
+    header = json.loads(buffer[start : start + length])
+
+    arrays = {
+        name: np.frombuffer(buffer, dtype=DTYPE, count=count, offset=offset)
+        for name, (offset, count) in header["arrays"].items()
+    }
+    return RecommendationSnapshot(
+        header["version"], revision=header["revision"], **arrays
+    )
@@ -0,0 +1,42 @@
+from dataclasses import dataclass
+from typing import Optional, Tuple
+
+from itsdangerous import BadSignature, URLSafeSerializer
+
+
+class InvalidCursor(Exception):
+    """The cursor was tampered with, or belongs to another user."""
+
+
+class StaleCursor(InvalidCursor):
+    """The cursor points into a model generation that is no longer served."""
+
+
+@dataclass(frozen=True)
+class PageCursor:
+    user: int
+    # (version, revision) of the snapshot the previous page came from
+    marker: Optional[Tuple[int, int]]
+    position: int
+
+
+class CursorCodec(object):
+    """Turns page cursors into opaque, signed tokens and back."""
+
+    def __init__(self, secret_key: str | bytes):
+        self.serializer = URLSafeSerializer(secret_key, salt="recommendation-cursor")
+
+    def encode(self, cursor: PageCursor) -> str:
+        marker = list(cursor.marker) if cursor.marker is not None else None
+        return self.serializer.dumps([cursor.user, marker, cursor.position])
+
+    def decode(self, token: str) -> PageCursor:
+        try:
+            user, marker, position = self.serializer.loads(token)
+            return PageCursor(
+                user=int(user),
+                marker=tuple(marker) if marker is not None else None,
+                position=int(position),
+            )
+        except (BadSignature, TypeError, ValueError) as e:
+            raise InvalidCursor("invalid cursor") from e
@@ -0,0 +1,203 @@
+import bisect
+import heapq
+import logging
+import re
+from collections import Counter, defaultdict
+from collections.abc import Iterable, Mapping
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower()) if text else []
+
+
+def _suggestible(term: str) -> bool:
+    # ids and single characters match entities, but make poor keywords
+    return len(term) > 1 and not term.isdigit()
+
+
+def read_catalogue(path: str) -> List[Tuple[int, str]]:
+    """(wisski id, text) of every entity listed in an ``items_id.txt`` file.
+
+    Lines are ``<id> <entity> <wisskiid> [label]``; the text of an entity is
+    the path of its URI plus the optional label.
+    """
+    entries = []
+    with open(path, "r") as f:
+        header = f.readline().split()
+        if header[:3] != ["id", "entity", "wisskiid"]:
+            raise ValueError(f"unexpected catalogue header in {path}: {header}")
+        for line in f:
+            parts = line.strip().split(" ", 3)
+            if len(parts) < 3:
+                continue
+            uri = parts[1].strip("<>")
+            text = uri.split("://", 1)[-1].partition("/")[2]
+            if len(parts) > 3:
+                text = f"{text} {parts[3]}"
+            entries.append((int(parts[2]), text))
+    return entries
+
+
+class QueryIndex(object):
+    """Read-only inverted index over the texts of catalogue entities, with the
+    co-occurrence of terms in logged search queries.
+
+    Terms map to the positions of the entities containing them. The sorted
+    vocabulary doubles as a prefix tree: all completions of a prefix are a
+    contiguous run found by binary search.
+    """
+
+    # terms found in a larger share of entities are too generic to suggest
+    MAX_DOCUMENT_FREQUENCY = 0.2
+    # matched entities whose terms are considered for an expansion
+    MAX_MATCHED_ENTITIES = 50
+    # suggestible terms kept per cluster
+    TERMS_PER_CLUSTER = 10
+    # completions of the last, possibly unfinished, term of a query
+    MAX_COMPLETIONS = 3
+    MIN_PREFIX_LENGTH = 3
+
+    def __init__(
+        self,
+        entries: Iterable[Tuple[int, str]],
+        clusters: Optional[Mapping[int, int]] = None,
+        queries: Iterable[str] = (),
+    ):
+        postings: Dict[str, List[int]] = defaultdict(list)
+        entity_ids = []
+        entity_terms = []
+        for position, (wisski_id, text) in enumerate(entries):
+            terms = sorted(set(tokenize(text)))
+            entity_ids.append(wisski_id)
+            entity_terms.append(terms)
+            for term in terms:
+                postings[term].append(position)
+
+        self.entity_ids = np.array(entity_ids, dtype=np.int64)
+        self.postings = {t: np.array(p, dtype=np.int64) for t, p in postings.items()}
+        self.vocabulary = sorted(self.postings)
+
+        max_df = max(1, int(self.MAX_DOCUMENT_FREQUENCY * len(entity_ids)))
+        self.suggestible = {
+            t for t, p in self.postings.items() if _suggestible(t) and len(p) <= max_df
+        }
+        self.entity_terms = [
+            tuple(t for t in all_terms if t in self.suggestible)
+            for all_terms in entity_terms
+        ]
+
+        # cluster of every entity, and the most common terms of every cluster
+        clusters = clusters or {}
+        self.entity_clusters = [clusters.get(i, -1) for i in entity_ids]
+        cluster_terms: Dict[int, Counter] = defaultdict(Counter)
+        for cluster, suggested in zip(self.entity_clusters, self.entity_terms):
+            if cluster >= 0:
+                cluster_terms[cluster].update(suggested)
+        self.cluster_terms = {
+            c: [t for t, _ in counts.most_common(self.TERMS_PER_CLUSTER)]
+            for c, counts in cluster_terms.items()
+        }
+
+        self.cooccurrence = TermCooccurrence(queries)
+
+    def __len__(self) -> int:
+        return len(self.entity_ids)
+
+    def complete(self, prefix: str, limit: int = MAX_COMPLETIONS) -> List[str]:
+        """Suggestible vocabulary terms starting with `prefix`, most frequent first."""
+        if len(prefix) < self.MIN_PREFIX_LENGTH:
+            return []
+        start = bisect.bisect_left(self.vocabulary, prefix)
+        end = bisect.bisect_left(self.vocabulary, prefix + "\U0010ffff", lo=start)
+        # bounded, so short prefixes stay cheap
+        candidates = [
+            t for t in self.vocabulary[start : min(end, start + 100)]
+            if t != prefix and t in self.suggestible
+        ]
+        candidates.sort(key=lambda t: -len(self.postings[t]))
+        return candidates[:limit]
+
+    def entities(self, term: str) -> np.ndarray:
+        """Positions of the entities containing `term`."""
+        return self.postings.get(term, self.entity_ids[:0])
+
+    def related_terms(self, terms: Iterable[str]) -> Dict[str, float]:
+        """Terms of entities matching `terms`, and of their clusters, with weights."""
+        scores: Dict[str, float] = defaultdict(float)
+        matched = [self.entities(t) for t in terms]
+        matched = [m for m in matched if len(m)]
+        if not matched:
+            return scores
+
+        for positions in matched:
+            # rare terms are more telling than common ones
+            weight = 1.0 / len(positions)
+            for position in positions[: self.MAX_MATCHED_ENTITIES]:
+                for term in self.entity_terms[position]:
+                    scores[term] += weight
+                cluster = self.entity_clusters[position]
+                for term in self.cluster_terms.get(cluster, ()):
+                    scores[term] += 0.5 * weight
+        return scores
+
+
+class TermCooccurrence(object):
+    """Counts of terms used together in search queries."""
+
+    MAX_TERMS_PER_QUERY = 10
+
+    def __init__(self, queries: Iterable[str] = (), max_terms: int = 50000):
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        for query in queries:
+            terms = sorted(set(tokenize(query)))[: self.MAX_TERMS_PER_QUERY]
+            terms = [t for t in terms if _suggestible(t)]
+            if len(terms) < 2:
+                continue
+            for term in terms:
+                counts[term].update(t for t in terms if t != term)
+        # keep the terms used together with others most often
+        kept = heapq.nlargest(max_terms, counts, key=lambda t: counts[t].total())
+        self._counts = {t: counts[t] for t in kept}
+
+    def related(self, term: str, limit: int = 10) -> List[Tuple[str, int]]:
+        counts = self._counts.get(term)
+        return counts.most_common(limit) if counts else []
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+
+class QueryExpander(object):
+    """Suggests keywords for a query from the catalogue and logged queries."""
+
+    COOCCURRENCE_WEIGHT = 1.0
+    CATALOGUE_WEIGHT = 1.0
+    COMPLETION_WEIGHT = 2.0
+
+    def expand(self, index: QueryIndex, query: str, max_terms: int = 5) -> List[str]:
+        terms = tokenize(query)
+        if not terms:
+            return []
+
+        scores: Dict[str, float] = defaultdict(float)
+        for term in terms:
+            for other, count in index.cooccurrence.related(term):
+                scores[other] += self.COOCCURRENCE_WEIGHT * count
+
+        matched = [t for t in terms if t in index.postings]
+        completions = [] if terms[-1] in index.postings else index.complete(terms[-1])
+        for term, score in index.related_terms(matched + completions[:1]).items():
+            scores[term] += self.CATALOGUE_WEIGHT * score
+        for rank, term in enumerate(completions):
+            scores[term] += self.COMPLETION_WEIGHT / (1 + rank)
+
+        for term in terms:
+            scores.pop(term, None)
+        return heapq.nlargest(max_terms, scores, key=scores.__getitem__)
@@ -0,0 +1,88 @@
+from typing import Optional, TypedDict
+
+import numpy as np
+
+from .snapshot import RecommendationSnapshot
+
+# candidate ids that are not WissKI ids of the model
+UNKNOWN_ITEM = -1
+
+
+class Ranking(TypedDict):
+    # permutation of the candidate positions, best first
+    order: np.ndarray
+    # candidate positions recommended to the user by the model
+    recommended: np.ndarray
+    # candidate positions from clusters the user is interested in
+    affine: np.ndarray
+    reason: str
+
+
+class RankingEngine(object):
+    """Personalised re-ranking of candidate lists against a model snapshot.
+
+    Every candidate gets a score of
+
+        RECOMMENDED_WEIGHT / (1 + rank)  if the model recommends it to the user
+      + CLUSTER_WEIGHT * share of the user's recommendations in its cluster
+      + POSITION_WEIGHT * (1 - position / n)  to retain the order of the input
+
+    and the candidates are sorted by that score in a single vectorised pass.
+    """
+
+    RECOMMENDED_WEIGHT = 1.0
+    CLUSTER_WEIGHT = 1.0
+    POSITION_WEIGHT = 0.5
+
+    def __init__(self, snapshot: RecommendationSnapshot):
+        self.snapshot = snapshot
+
+    def rank(self, user_id: Optional[int], candidates: np.ndarray) -> Ranking:
+        candidates = np.asarray(candidates, dtype=np.int64)
+        n = len(candidates)
+        identity = np.arange(n)
+        empty = np.empty(0, dtype=np.int64)
+
+        if n == 0:
+            return Ranking(order=identity, recommended=empty, affine=empty, reason="empty")
+
+        items = ranks = None
+        if user_id is not None:
+            items = self.snapshot.items_for(user_id)
+            ranks = self.snapshot.ranks_for(user_id)
+        if items is None or ranks is None or len(items) == 0:
+            return Ranking(
+                order=identity, recommended=empty, affine=empty, reason="no-profile"
+            )
+
+        scores = self.POSITION_WEIGHT * (1.0 - identity / n)
+
+        # candidates the model recommends to the user directly
+        by_item = np.argsort(items, kind="stable")
+        sorted_items = items[by_item]
+        pos = np.minimum(np.searchsorted(sorted_items, candidates), len(items) - 1)
+        hit = (sorted_items[pos] == candidates) & (candidates != UNKNOWN_ITEM)
+        scores[hit] += self.RECOMMENDED_WEIGHT / (1.0 + ranks[by_item[pos[hit]]])
+
+        # cluster profile of the user, weighted by the rank of the items
+        item_clusters = self.snapshot.clusters_of(items)
+        known = item_clusters >= 0
+        profile, inverse = np.unique(item_clusters[known], return_inverse=True)
+        affine = np.zeros(n, dtype=bool)
+        if len(profile):
+            weights = np.bincount(inverse, weights=1.0 / (1.0 + ranks[known]))
+            weights = weights / weights.sum()
+
+            candidate_clusters = self.snapshot.clusters_of(candidates)
+            cpos = np.minimum(np.searchsorted(profile, candidate_clusters), len(profile) - 1)
+            affine = (profile[cpos] == candidate_clusters) & (candidate_clusters >= 0)
+            scores[affine] += self.CLUSTER_WEIGHT * weights[cpos[affine]]
+
+        # stable, so ties keep the order of the input
+        order = np.argsort(-scores, kind="stable")
+        return Ranking(
+            order=order,
+            recommended=np.flatnonzero(hit),
+            affine=np.flatnonzero(affine & ~hit),
+            reason="profile",
+        )
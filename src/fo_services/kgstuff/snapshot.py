@@ -0,0 +1,232 @@
+import logging
+import threading
+import time
+from collections.abc import Callable
+from typing import Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _frozen(a) -> np.ndarray:
+    a = np.ascontiguousarray(a, dtype=np.int64)
+    a.flags.writeable = False
+    return a
+
+
+def _csr(rows) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    # rows: (n, 3) array of (key, value, rank); returns keys, indptr, values, ranks
+    rows = np.asarray(rows, dtype=np.int64).reshape(-1, 3)
+    rows = rows[np.lexsort((rows[:, 2], rows[:, 0]))]
+
+    keys, counts = np.unique(rows[:, 0], return_counts=True)
+    indptr = np.zeros(len(keys) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    return keys, indptr, rows[:, 1], rows[:, 2]
+
+
+class RecommendationSnapshot(object):
+    """Read-only view of one model generation.
+
+    Per-user recommendations are kept in CSR form: the items of
+    ``users[i]`` are ``items[indptr[i]:indptr[i + 1]]``, ordered by rank.
+    The cluster of ``cluster_items[j]`` is ``clusters[j]``, and the related
+    items of ``neighbour_keys[j]`` are stored alike in ``neighbour_indptr``
+    and ``neighbours``.
+    """
+
+    def __init__(
+        self,
+        version: Optional[int],
+        users: np.ndarray,
+        indptr: np.ndarray,
+        items: np.ndarray,
+        ranks: np.ndarray,
+        fallback: np.ndarray,
+        revision: int = 0,
+        cluster_items: Optional[np.ndarray] = None,
+        clusters: Optional[np.ndarray] = None,
+        neighbour_keys: Optional[np.ndarray] = None,
+        neighbour_indptr: Optional[np.ndarray] = None,
+        neighbours: Optional[np.ndarray] = None,
+    ):
+        self.version = version
+        self.revision = revision
+        self.users = _frozen(users)
+        self.indptr = _frozen(indptr)
+        self.items = _frozen(items)
+        self.ranks = _frozen(ranks)
+        self.fallback = _frozen(fallback)
+        self.cluster_items = _frozen(() if cluster_items is None else cluster_items)
+        self.clusters = _frozen(() if clusters is None else clusters)
+        self.neighbour_keys = _frozen(() if neighbour_keys is None else neighbour_keys)
+        self.neighbour_indptr = _frozen(
+            (0,) if neighbour_indptr is None else neighbour_indptr
+        )
+        self.neighbours = _frozen(() if neighbours is None else neighbours)
+
+    @classmethod
+    def from_rows(
+        cls,
+        version: Optional[int],
+        reco_rows: np.ndarray,
+        fallback: np.ndarray,
+        revision: int = 0,
+        cluster_rows: Optional[np.ndarray] = None,
+        neighbour_rows: Optional[np.ndarray] = None,
+    ) -> "RecommendationSnapshot":
+        # reco_rows: (n, 3) array of (user, item, rank)
+        users, indptr, items, ranks = _csr(reco_rows)
+
+        # cluster_rows: (m, 2) array of (item, cluster)
+        if cluster_rows is None:
+            cluster_rows = np.empty((0, 2))
+        cluster_rows = np.asarray(cluster_rows, dtype=np.int64).reshape(-1, 2)
+        cluster_rows = cluster_rows[np.argsort(cluster_rows[:, 0], kind="stable")]
+
+        # neighbour_rows: (k, 3) array of (item, neighbour, rank)
+        if neighbour_rows is None:
+            neighbour_rows = np.empty((0, 3))
+        neighbour_keys, neighbour_indptr, neighbours, _ = _csr(neighbour_rows)
+
+        return cls(
+            version,
+            users,
+            indptr,
+            items,
+            ranks,
+            fallback,
+            revision,
+            cluster_rows[:, 0],
+            cluster_rows[:, 1],
+            neighbour_keys,
+            neighbour_indptr,
+            neighbours,
+        )
+
+    @property
+    def marker(self) -> Optional[Tuple[int, int]]:
+        """(version, revision) this snapshot was built from; None for an empty model."""
+        return None if self.version is None else (self.version, self.revision)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def _position(self, user_id: int) -> int:
+        pos = int(np.searchsorted(self.users, user_id))
+        if pos < len(self.users) and self.users[pos] == user_id:
+            return pos
+        return -1
+
+    def has_user(self, user_id: int) -> bool:
+        return self._position(user_id) >= 0
+
+    def items_for(self, user_id: int) -> Optional[np.ndarray]:
+        """Ranked items for `user_id`, or None if the model does not know the user."""
+        pos = self._position(user_id)
+        if pos < 0:
+            return None
+        return self.items[self.indptr[pos] : self.indptr[pos + 1]]
+
+    def ranks_for(self, user_id: int) -> Optional[np.ndarray]:
+        """Model ranks of the items returned by `items_for`."""
+        pos = self._position(user_id)
+        if pos < 0:
+            return None
+        return self.ranks[self.indptr[pos] : self.indptr[pos + 1]]
+
+    def neighbours_of(self, item_id: int) -> np.ndarray:
+        """Related items of `item_id`, best first; empty for unknown items."""
+        pos = int(np.searchsorted(self.neighbour_keys, item_id))
+        if pos < len(self.neighbour_keys) and self.neighbour_keys[pos] == item_id:
+            return self.neighbours[
+                self.neighbour_indptr[pos] : self.neighbour_indptr[pos + 1]
+            ]
+        return self.neighbours[:0]
+
+    def clusters_of(self, items: np.ndarray) -> np.ndarray:
+        """Cluster of every item in `items`, -1 for items without a cluster."""
+        items = np.asarray(items, dtype=np.int64)
+        if len(self.cluster_items) == 0:
+            return np.full(items.shape, -1, dtype=np.int64)
+        pos = np.searchsorted(self.cluster_items, items)
+        pos = np.minimum(pos, len(self.cluster_items) - 1)
+        return np.where(self.cluster_items[pos] == items, self.clusters[pos], -1)
+
+
+class SnapshotStore(object):
+    """Holds the current snapshot of a worker and swaps it when the model changes.
+
+    `probe` returns a marker of the data currently in the database, e.g. the
+    (version, revision) of the model, and is called at most once per
+    `check_interval` seconds. `loader` builds a new snapshot whenever the
+    marker differs from the one the current snapshot was loaded for. Readers
+    are never blocked by a refresh once a first snapshot exists; they keep
+    getting the previous one until the swap.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[Optional[Tuple[int, int]]], RecommendationSnapshot],
+        probe: Callable[[], Optional[Tuple[int, int]]],
+        check_interval: float = 30.0,
+        name: str = "recommendation snapshot",
+    ):
+        self.loader = loader
+        self.probe = probe
+        self.check_interval = check_interval
+        self.name = name
+        self._snapshot: Optional[RecommendationSnapshot] = None
+        self._marker: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> RecommendationSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None:
+            if time.monotonic() < self._next_check:
+                return snapshot
+            # only one thread refreshes; everybody else keeps using the old snapshot
+            if not self._lock.acquire(blocking=False):
+                return snapshot
+        else:
+            self._lock.acquire()
+
+        try:
+            current = self._snapshot
+            if current is not None and current is not snapshot:
+                # loaded by another thread while we waited
+                return current
+            return self._refresh()
+        finally:
+            self._lock.release()
+
+    def _refresh(self) -> RecommendationSnapshot:
+        current = self._snapshot
+        try:
+            marker = self.probe()
+            if current is None or self._marker != marker:
+                start = time.time()
+                current = self.loader(marker)
+                self._snapshot = current
+                self._marker = marker
+                logger.info(
+                    f"loaded {self.name} for {marker} "
+                    f"({len(current)} entries) in {time.time() - start:.3f}s"
+                )
+        except Exception:
+            if current is None:
+                raise
+            logger.exception(f"Error refreshing {self.name}, keeping old one")
+
+        self._next_check = time.monotonic() + self.check_interval
+        return current
+
+    @property
+    def current(self) -> Optional[RecommendationSnapshot]:
+        """The snapshot in use, without checking for a newer one; None before the first load."""
+        return self._snapshot
+
+    def invalidate(self):
+        self._next_check = 0.0
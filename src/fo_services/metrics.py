@@ -0,0 +1,500 @@
+"""Request metrics, shared between the uwsgi workers through files.
+
+Every process adds to a value file of its own in `Metrics.directory`: a
+memory map of (key, float64) entries, so recording a value costs no more
+than a dict lookup and a write to memory. A scrape reads the files of all
+processes, sums the counters and histograms, and reports gauges per
+process. Files of processes that are gone are kept until the next start,
+so their counts don't vanish from the sums.
+"""
+
+import bisect
+import glob
+import math
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Iterator
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+from flask import current_app, g, has_request_context, request
+
+COUNTER = "counter"
+GAUGE = "gauge"
+HISTOGRAM = "histogram"
+
+# upper bounds of the request duration buckets, in seconds
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# phases of a request whose time is recorded separately
+PHASES = ("auth", "db", "serialize")
+
+# process metrics are published at most this often, in seconds
+PUBLISH_INTERVAL = 1.0
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_HEADER = struct.Struct("<Q")
+_KEY_LENGTH = struct.Struct("<I")
+_VALUE = struct.Struct("<d")
+
+_LABEL = re.compile(r'(\w+)="((?:[^"\\]|\\.)*)"')
+
+
+def _padded(n: int) -> int:
+    return (n + 7) & ~7
+
+
+class _ValueFile(object):
+    """Append-only memory-mapped file of named float64 values.
+
+    The header holds the number of bytes in use; it is updated after an
+    entry is complete, so readers never see half-written keys.
+    """
+
+    INITIAL_SIZE = 1 << 16
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        os.ftruncate(self._fd, self.INITIAL_SIZE)
+        self._map = mmap.mmap(self._fd, self.INITIAL_SIZE)
+        self._used = _HEADER.size
+        _HEADER.pack_into(self._map, 0, self._used)
+        self._positions: Dict[str, int] = {}
+
+    def _position(self, key: str) -> int:
+        position = self._positions.get(key)
+        if position is None:
+            encoded = key.encode()
+            value_at = self._used + _padded(_KEY_LENGTH.size + len(encoded))
+            end = value_at + _VALUE.size
+            if end > len(self._map):
+                self._grow(end)
+            _KEY_LENGTH.pack_into(self._map, self._used, len(encoded))
+            start = self._used + _KEY_LENGTH.size
+            self._map[start : start + len(encoded)] = encoded
+            _VALUE.pack_into(self._map, value_at, 0.0)
+            self._used = end
+            _HEADER.pack_into(self._map, 0, self._used)
+            self._positions[key] = position = value_at
+        return position
+
+    def _grow(self, needed: int):
+        size = len(self._map)
+        while size < needed:
+            size *= 2
+        os.ftruncate(self._fd, size)
+        self._map.close()
+        self._map = mmap.mmap(self._fd, size)
+
+    def add(self, key: str, amount: float):
+        position = self._position(key)
+        (value,) = _VALUE.unpack_from(self._map, position)
+        _VALUE.pack_into(self._map, position, value + amount)
+
+    def set(self, key: str, value: float):
+        _VALUE.pack_into(self._map, self._position(key), value)
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        return self.read_entries(bytes(self._map[: self._used]))
+
+    @staticmethod
+    def read_entries(data: bytes) -> Iterator[Tuple[str, float]]:
+        if len(data) < _HEADER.size:
+            return
+        (used,) = _HEADER.unpack_from(data, 0)
+        # the file may have grown while it was read
+        used = min(used, len(data))
+        position = _HEADER.size
+        while position + _KEY_LENGTH.size <= used:
+            (length,) = _KEY_LENGTH.unpack_from(data, position)
+            value_at = position + _padded(_KEY_LENGTH.size + length)
+            if value_at + _VALUE.size > used:
+                return
+            start = position + _KEY_LENGTH.size
+            key = data[start : start + length].decode()
+            (value,) = _VALUE.unpack_from(data, value_at)
+            yield key, value
+            position = value_at + _VALUE.size
+
+    @classmethod
+    def read(cls, path: str) -> List[Tuple[str, float]]:
+        with open(path, "rb") as f:
+            return list(cls.read_entries(f.read()))
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+
+class _MemoryValues(object):
+    """Values of a single process, when there is no directory to share them."""
+
+    def __init__(self):
+        self._values: Dict[str, float] = defaultdict(float)
+
+    def add(self, key: str, amount: float):
+        self._values[key] += amount
+
+    def set(self, key: str, value: float):
+        self._values[key] = value
+
+    def items(self) -> Iterator[Tuple[str, float]]:
+        return iter(list(self._values.items()))
+
+    def close(self):
+        pass
+
+
+def _labels(labels: Dict[str, str]) -> str:
+    return ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'),
+        )
+        for name, value in sorted(labels.items())
+    )
+
+
+def _key(kind: str, name: str, labels: Dict[str, str]) -> str:
+    # g(auge) or c(ounter), the sample name and its rendered labels
+    return f"{kind}\0{name}\0{_labels(labels)}"
+
+
+def _alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _number(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if value == int(value):
+        return str(int(value))
+    return repr(value)
+
+
+class Metrics(object):
+    """Counters, gauges and histograms in the Prometheus text format.
+
+    Without a `directory` values are kept in memory, and a scrape only sees
+    the process answering it.
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._opened_in: Optional[str] = None
+        self._values = None
+        self._families: Dict[str, tuple] = {}
+
+    def describe(self, name: str, kind: str, help: str, buckets=None):
+        self._families[name] = (kind, help, buckets)
+
+    def _file(self):
+        # a value file per process, created after uwsgi forked the workers,
+        # and again if the directory was changed since
+        pid = os.getpid()
+        if self._pid != pid or self._opened_in != self.directory:
+            if self.directory is None:
+                self._values = _MemoryValues()
+            else:
+                os.makedirs(self.directory, exist_ok=True)
+                self._values = _ValueFile(os.path.join(self.directory, f"metrics-{pid}.bin"))
+            self._pid = pid
+            self._opened_in = self.directory
+        return self._values
+
+    def inc(self, name: str, amount: float = 1.0, **labels):
+        with self._lock:
+            self._file().add(_key("c", name, labels), amount)
+
+    def set(self, name: str, value: float, **labels):
+        with self._lock:
+            self._file().set(_key("g", name, labels), value)
+
+    def set_total(self, name: str, value: float, **labels):
+        """Set a counter to a total this process keeps itself."""
+        with self._lock:
+            self._file().set(_key("c", name, labels), value)
+
+    def observe(self, name: str, value: float, buckets=DURATION_BUCKETS, **labels):
+        # buckets are stored as plain counts and accumulated when scraped
+        index = bisect.bisect_left(buckets, value)
+        le = _number(buckets[index]) if index < len(buckets) else "+Inf"
+        with self._lock:
+            values = self._file()
+            values.add(_key("c", f"{name}_bucket", {**labels, "le": le}), 1)
+            values.add(_key("c", f"{name}_sum", labels), value)
+            values.add(_key("c", f"{name}_count", labels), 1)
+
+    def _entries(self) -> Iterator[Tuple[Optional[int], List[Tuple[str, float]]]]:
+        if self.directory is None:
+            with self._lock:
+                entries = list(self._file().items())
+            yield None, entries
+            return
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.bin")):
+            try:
+                pid = int(os.path.basename(path)[len("metrics-") : -len(".bin")])
+                yield pid, _ValueFile.read(path)
+            except (ValueError, OSError):
+                continue
+
+    def collect(self) -> Dict[Tuple[str, str], float]:
+        """The samples of all processes, by sample name and labels."""
+        samples: Dict[Tuple[str, str], float] = defaultdict(float)
+        for pid, entries in self._entries():
+            alive = pid is None or pid == os.getpid() or _alive(pid)
+            for key, value in entries:
+                kind, name, labels = key.split("\0")
+                if kind == "g":
+                    if not alive:
+                        continue
+                    if pid is not None:
+                        labels = ",".join(filter(None, (labels, f'pid="{pid}"')))
+                samples[name, labels] += value
+        return samples
+
+    def render(self) -> str:
+        by_family: Dict[str, List[Tuple[str, str, float]]] = defaultdict(list)
+        for (name, labels), value in self.collect().items():
+            family = name
+            for suffix in ("_bucket", "_sum", "_count"):
+                base = name[: -len(suffix)]
+                if name.endswith(suffix) and self._families.get(base, ("",))[0] == HISTOGRAM:
+                    family = base
+            by_family[family].append((name, labels, value))
+
+        lines = []
+        for family in sorted(by_family):
+            kind, help, buckets = self._families.get(family, ("untyped", "", None))
+            if help:
+                lines.append(f"# HELP {family} {help}")
+            lines.append(f"# TYPE {family} {kind}")
+            rows = sorted(by_family[family])
+            if kind == HISTOGRAM:
+                rows = _histogram_rows(family, rows, buckets)
+            for name, labels, value in rows:
+                labels = f"{{{labels}}}" if labels else ""
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+    def remove_dead(self):
+        """Delete the value files of processes that are gone."""
+        if self.directory is None:
+            return
+        for path in glob.glob(os.path.join(self.directory, "metrics-*.bin")):
+            try:
+                pid = int(os.path.basename(path)[len("metrics-") : -len(".bin")])
+            except ValueError:
+                continue
+            if pid != os.getpid() and not _alive(pid):
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def reset(self):
+        with self._lock:
+            if self._values is not None:
+                self._values.close()
+                if isinstance(self._values, _ValueFile):
+                    os.unlink(self._values.path)
+            self._values = None
+            self._pid = None
+
+
+def _histogram_rows(family: str, rows, buckets):
+    """Rows of a histogram with every bucket, each counting all values up to
+    its bound, followed by the sum and count of each set of labels."""
+    counts: Dict[str, Dict[str, float]] = defaultdict(dict)
+    totals: Dict[str, List[Tuple[str, str, float]]] = defaultdict(list)
+    for name, labels, value in rows:
+        parsed = _LABEL.findall(labels)
+        rest = ",".join(f'{k}="{v}"' for k, v in parsed if k != "le")
+        if name == f"{family}_bucket":
+            le = dict(parsed)["le"]
+            counts[rest][le] = counts[rest].get(le, 0.0) + value
+        else:
+            totals[rest].append((name, labels, value))
+
+    bounds = [_number(b) for b in buckets or ()] + ["+Inf"]
+    result = []
+    for rest in sorted(set(counts) | set(totals)):
+        cumulative = 0.0
+        for le in sorted(set(bounds) | set(counts[rest]), key=float):
+            cumulative += counts[rest].get(le, 0.0)
+            labels = ",".join(filter(None, (rest, f'le="{le}"')))
+            result.append((f"{family}_bucket", labels, cumulative))
+        result.extend(sorted(totals[rest]))
+    return result
+
+
+metrics = Metrics()
+
+metrics.describe("fo_http_requests_total", COUNTER, "Requests answered, by endpoint, method and status.")
+metrics.describe("fo_http_request_errors_total", COUNTER, "Requests answered with a 5xx status.")
+metrics.describe(
+    "fo_http_request_duration_seconds",
+    HISTOGRAM,
+    "Time to answer a request.",
+    buckets=DURATION_BUCKETS,
+)
+metrics.describe(
+    "fo_http_request_phase_seconds_total",
+    COUNTER,
+    "Time spent answering requests, by phase: auth, db, serialize and other.",
+)
+metrics.describe("fo_db_pool_checked_out", GAUGE, "Database connections in use.")
+metrics.describe("fo_db_pool_checkouts_total", COUNTER, "Database connection checkouts.")
+metrics.describe("fo_db_pool_wait_seconds_total", COUNTER, "Time spent waiting for a database connection.")
+metrics.describe("fo_db_pool_timeouts_total", COUNTER, "Checkouts that found no database connection in time.")
+metrics.describe("fo_db_queries_total", COUNTER, "Database queries run.")
+metrics.describe("fo_db_query_seconds_total", COUNTER, "Time spent in database queries.")
+metrics.describe("fo_interactions_total", COUNTER, "Interaction events, by outcome: written, dropped or failed.")
+metrics.describe("fo_interactions_queued", GAUGE, "Interaction events waiting to be written.")
+metrics.describe("fo_log_records_dropped_total", COUNTER, "Log records dropped for a full queue.")
+metrics.describe("fo_log_records_queued", GAUGE, "Log records waiting to be written.")
+metrics.describe("fo_ldap_pool_open", GAUGE, "LDAP service connections open.")
+metrics.describe("fo_ldap_pool_idle", GAUGE, "LDAP service connections open and not in use.")
+metrics.describe("fo_ldap_connections_total", COUNTER, "LDAP service connections, by event: created, reused or discarded.")
+metrics.describe("fo_ldap_pool_waits_total", COUNTER, "Checkouts that waited for an LDAP service connection.")
+metrics.describe("fo_ldap_pool_wait_seconds_total", COUNTER, "Time spent waiting for an LDAP service connection.")
+metrics.describe("fo_ldap_pool_exhausted_total", COUNTER, "Checkouts that found no LDAP service connection in time.")
+metrics.describe("fo_ldap_user_binds_total", COUNTER, "LDAP binds checking the password of a user.")
+metrics.describe("fo_ldap_search_retries_total", COUNTER, "LDAP searches retried on a fresh connection.")
+
+
+@contextmanager
+def phase(name: str):
+    """Record the time of the block as phase `name` of the current request.
+
+    Database time within the block is counted towards `name`, not db.
+    """
+    if not has_request_context():
+        yield
+        return
+    from .db import current_queries
+
+    queries = current_queries()
+    db_before = queries.seconds if queries is not None else 0.0
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases = g.setdefault("metric_phases", defaultdict(float))
+        phases[name] += time.perf_counter() - start
+        if queries is not None:
+            phases["db_in_phases"] += queries.seconds - db_before
+
+
+def timed_representation(name: str, representation):
+    """Wrap a flask-restx representation function to record it as phase `name`."""
+
+    def timed(data, code, headers=None):
+        with phase(name):
+            return representation(data, code, headers)
+
+    return timed
+
+
+def _publish_process_metrics():
+    from .db import database_metrics
+    from .services.interaction_logger import interaction_logger
+    from .structured_logging import log_stats
+
+    db = database_metrics()
+    metrics.set("fo_db_pool_checked_out", db["pool"]["checked_out"])
+    metrics.set_total("fo_db_pool_checkouts_total", db["pool"]["checkouts"])
+    metrics.set_total("fo_db_pool_wait_seconds_total", db["pool"]["wait_seconds"])
+    metrics.set_total("fo_db_pool_timeouts_total", db["pool"]["timeouts"])
+    metrics.set_total("fo_db_queries_total", db["queries"]["total"])
+    metrics.set_total("fo_db_query_seconds_total", db["queries"]["seconds"])
+
+    stats = interaction_logger.stats()
+    for outcome in ("written", "dropped", "failed"):
+        metrics.set_total("fo_interactions_total", stats[outcome], outcome=outcome)
+    metrics.set("fo_interactions_queued", stats["queued"])
+
+    logs = log_stats(current_app)
+    metrics.set_total("fo_log_records_dropped_total", logs["dropped"])
+    metrics.set("fo_log_records_queued", logs["queued"])
+
+    ldap_client = current_app.extensions.get("ldap_client")
+    if ldap_client is not None:
+        ldap = ldap_client.metrics()
+        metrics.set("fo_ldap_pool_open", ldap["open"])
+        metrics.set("fo_ldap_pool_idle", ldap["idle"])
+        for event in ("created", "reused", "discarded"):
+            metrics.set_total("fo_ldap_connections_total", ldap[event], event=event)
+        metrics.set_total("fo_ldap_pool_waits_total", ldap["waits"])
+        metrics.set_total("fo_ldap_pool_wait_seconds_total", ldap["wait_seconds"])
+        metrics.set_total("fo_ldap_pool_exhausted_total", ldap["exhausted"])
+        metrics.set_total("fo_ldap_user_binds_total", ldap["user_binds"])
+        metrics.set_total("fo_ldap_search_retries_total", ldap["retries"])
+
+
+def init_app(app):
+    """Record the metrics of every request answered by `app`.
+
+    The value files go to METRICS_DIR, by default metrics/ in the instance
+    folder.
+    """
+    metrics.directory = app.config.get(
+        "METRICS_DIR", os.path.join(app.instance_path, "metrics")
+    )
+    os.makedirs(metrics.directory, exist_ok=True)
+    metrics.remove_dead()
+    published = [0.0]
+
+    @app.before_request
+    def start_request_metrics():
+        g.metric_start = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.pop("metric_start", None)
+        if start is None:
+            return response
+        elapsed = time.perf_counter() - start
+        endpoint = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        status = response.status_code
+
+        metrics.inc(
+            "fo_http_requests_total", endpoint=endpoint, method=request.method, status=status
+        )
+        if status >= 500:
+            metrics.inc("fo_http_request_errors_total", endpoint=endpoint, method=request.method)
+        metrics.observe("fo_http_request_duration_seconds", elapsed, endpoint=endpoint)
+
+        from .db import current_queries
+
+        phases = g.pop("metric_phases", {})
+        queries = current_queries()
+        db = (queries.seconds if queries is not None else 0.0) - phases.get("db_in_phases", 0.0)
+        spent = {name: phases.get(name, 0.0) for name in PHASES if name != "db"}
+        spent["db"] = max(db, 0.0)
+        spent["other"] = max(elapsed - sum(spent.values()), 0.0)
+        for name, seconds in spent.items():
+            metrics.inc(
+                "fo_http_request_phase_seconds_total", seconds, endpoint=endpoint, phase=name
+            )
+
+        now = time.monotonic()
+        if now - published[0] >= PUBLISH_INTERVAL:
+            published[0] = now
+            _publish_process_metrics()
+        return response
@@ -0,0 +1,305 @@
+"""Versioned schema migrations.
+
+Migrations are applied in order of their version by `flask schema upgrade`,
+which deployments run before starting the workers, and are recorded in
+schema_migrations. The baseline migration creates the schema as of the
+first migration, written out rather than derived from the models, and every
+later change of the models needs a migration of its own. Migrations have to
+be idempotent: one that failed halfway is run again from the start.
+"""
+
+import datetime
+import logging
+from collections.abc import Callable
+from dataclasses import dataclass
+from typing import Dict, List
+
+from sqlalchemy import inspect, select, text
+
+from .db import db_session, ensure_interaction_partitions, get_engine
+from .models import (
+    InteractionHistory,
+    ItemClusterInfo,
+    ModelVersion,
+    SchemaMigration,
+)
+
+logger = logging.getLogger(__name__)
+
+# key of the advisory lock serialising concurrent upgrades
+_LOCK_KEY = 0x666F5F6D6967
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    apply: Callable[[], None]
+
+
+MIGRATIONS: List[Migration] = []
+
+
+def migration(version: int, name: str):
+    def register(apply: Callable[[], None]):
+        if MIGRATIONS and MIGRATIONS[-1].version >= version:
+            raise ValueError(f"migration {version} is out of order")
+        MIGRATIONS.append(Migration(version, name, apply))
+        return apply
+
+    return register
+
+
+def _upgrade_model_tables():
+    engine = db_session.get_bind()
+    inspector = inspect(engine)
+
+    # model tables from before model versioning only hold data derived from
+    # the training API, which the next update reloads. Recreate them.
+    if inspector.has_table(ItemClusterInfo.__tablename__):
+        columns = {c["name"] for c in inspector.get_columns(ItemClusterInfo.__tablename__)}
+        if "version" not in columns:
+            logger.warning("dropping unversioned model tables")
+            with engine.begin() as conn:
+                conn.execute(text("DROP TABLE IF EXISTS user_recommendation_model"))
+                conn.execute(text("DROP TABLE item_cluster"))
+
+    if inspector.has_table(ModelVersion.__tablename__):
+        columns = {c["name"] for c in inspector.get_columns(ModelVersion.__tablename__)}
+        if "revision" not in columns:
+            with engine.begin() as conn:
+                conn.execute(
+                    text(
+                        "ALTER TABLE model_version ADD COLUMN revision integer NOT NULL DEFAULT 0"
+                    )
+                )
+
+
+def _detach_unpartitioned_interactions() -> bool:
+    """Move a hist_interact from before partitioning out of the way, for
+    `_migrate_unpartitioned_interactions` to copy it into the new table."""
+    kind = db_session.scalar(
+        text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:table)"),
+        {"table": InteractionHistory.__tablename__},
+    )
+    if kind != "r":
+        return False
+    logger.warning("partitioning the interaction history")
+    # the sequence and the primary key index would clash with the new table
+    db_session.execute(text("ALTER TABLE hist_interact RENAME TO hist_interact_unpartitioned"))
+    db_session.execute(
+        text("ALTER SEQUENCE hist_interact_id_seq RENAME TO hist_interact_unpartitioned_id_seq")
+    )
+    db_session.execute(
+        text(
+            "ALTER TABLE hist_interact_unpartitioned"
+            " RENAME CONSTRAINT hist_interact_pkey TO hist_interact_unpartitioned_pkey"
+        )
+    )
+    db_session.commit()
+    return True
+
+
+def _migrate_unpartitioned_interactions():
+    months = db_session.scalars(
+        text("SELECT DISTINCT date_trunc('month', at)::date FROM hist_interact_unpartitioned")
+    ).all()
+    ensure_interaction_partitions(months=months)
+    count = db_session.execute(
+        text(
+            "INSERT INTO hist_interact (id, wisski_user, wisski_item, at)"
+            " SELECT id, wisski_user, wisski_item, coalesce(at, LOCALTIMESTAMP)"
+            " FROM hist_interact_unpartitioned"
+        )
+    ).rowcount
+    db_session.execute(
+        text(
+            "SELECT setval(pg_get_serial_sequence('hist_interact', 'id'),"
+            " (SELECT coalesce(max(id), 0) + 1 FROM hist_interact), false)"
+        )
+    )
+    db_session.execute(text("DROP TABLE hist_interact_unpartitioned"))
+    db_session.commit()
+    logger.warning(f"moved {count} interactions into the partitioned interaction history")
+
+
+# the schema as of the first migration, frozen: changes to the models after
+# it go into migrations of their own. Tables of a database created by
+# init_db before there were migrations already exist and are kept.
+_BASELINE_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS "user" (
+        id SERIAL NOT NULL,
+        name VARCHAR(255) NOT NULL,
+        password VARCHAR(255),
+        is_ldap_user BOOLEAN NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        deleted_at TIMESTAMP WITHOUT TIME ZONE,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    )""",
+    """CREATE TABLE IF NOT EXISTS rec_user (
+        id SERIAL NOT NULL,
+        wisski_id INTEGER NOT NULL,
+        first_seen TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id, wisski_id),
+        UNIQUE (wisski_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS hist_interact (
+        id SERIAL NOT NULL,
+        wisski_user INTEGER NOT NULL,
+        wisski_item INTEGER NOT NULL,
+        at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        PRIMARY KEY (id, at),
+        FOREIGN KEY (wisski_user) REFERENCES rec_user (wisski_id)
+    ) PARTITION BY RANGE (at)""",
+    """CREATE TABLE IF NOT EXISTS interaction_daily_user (
+        day DATE NOT NULL,
+        wisski_user INTEGER NOT NULL,
+        interactions INTEGER NOT NULL,
+        items INTEGER NOT NULL,
+        PRIMARY KEY (day, wisski_user)
+    )""",
+    """CREATE TABLE IF NOT EXISTS interaction_daily_item (
+        day DATE NOT NULL,
+        wisski_item INTEGER NOT NULL,
+        interactions INTEGER NOT NULL,
+        users INTEGER NOT NULL,
+        PRIMARY KEY (day, wisski_item)
+    )""",
+    """CREATE TABLE IF NOT EXISTS model_version (
+        id SERIAL NOT NULL,
+        created_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+        activated_at TIMESTAMP WITHOUT TIME ZONE,
+        is_active BOOLEAN NOT NULL,
+        revision INTEGER DEFAULT 0 NOT NULL,
+        PRIMARY KEY (id)
+    )""",
+    """CREATE UNIQUE INDEX IF NOT EXISTS ix_model_version_active
+        ON model_version (is_active) WHERE is_active""",
+    """CREATE TABLE IF NOT EXISTS item_cluster (
+        version INTEGER NOT NULL,
+        id INTEGER NOT NULL,
+        cluster INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        PRIMARY KEY (version, id),
+        FOREIGN KEY (version) REFERENCES model_version (id) ON DELETE CASCADE
+    )""",
+    """CREATE TABLE IF NOT EXISTS user_recommendation_model (
+        version INTEGER NOT NULL,
+        "user" INTEGER NOT NULL,
+        item INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        PRIMARY KEY (version, "user", item),
+        FOREIGN KEY (version, item) REFERENCES item_cluster (version, id) ON DELETE CASCADE,
+        FOREIGN KEY ("user") REFERENCES rec_user (wisski_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS item_neighbour (
+        version INTEGER NOT NULL,
+        item INTEGER NOT NULL,
+        rank INTEGER NOT NULL,
+        neighbour INTEGER NOT NULL,
+        score DOUBLE PRECISION NOT NULL,
+        PRIMARY KEY (version, item, rank),
+        FOREIGN KEY (version) REFERENCES model_version (id) ON DELETE CASCADE
+    )""",
+]
+
+
+@migration(1, "baseline")
+def _baseline():
+    # creates a new database, and brings one created by init_db before there
+    # were migrations up to date
+    _upgrade_model_tables()
+    unpartitioned = _detach_unpartitioned_interactions()
+    for statement in _BASELINE_SCHEMA:
+        db_session.execute(text(statement))
+    db_session.commit()
+    if unpartitioned:
+        _migrate_unpartitioned_interactions()
+
+
+@migration(2, "hot path indexes")
+def _hot_path_indexes():
+    for statement in [
+        # recommendations of a generation in order, see db.get_all_recommendations
+        """CREATE INDEX IF NOT EXISTS ix_user_recommendation_model_user_rank
+            ON user_recommendation_model (version, "user", rank, item)""",
+        # clusters of items joined to recommendations, without heap fetches
+        """CREATE INDEX IF NOT EXISTS ix_item_cluster_cluster
+            ON item_cluster (version, id) INCLUDE (cluster)""",
+        # best ranked items of all clusters, see db.get_itemlist_from_cluster
+        """CREATE INDEX IF NOT EXISTS ix_item_cluster_top
+            ON item_cluster (version, rank, cluster, id) WHERE cluster <> -1""",
+        # recent interactions of a user, e.g. for item neighbours
+        """CREATE INDEX IF NOT EXISTS ix_hist_interact_user_at
+            ON hist_interact (wisski_user, at) INCLUDE (wisski_item)""",
+    ]:
+        db_session.execute(text(statement))
+    db_session.commit()
+    for table in ["user_recommendation_model", "item_cluster", "hist_interact"]:
+        db_session.execute(text(f'ANALYZE "{table}"'))
+    db_session.commit()
+
+
+@migration(3, "search query log")
+def _search_query_log():
+    for statement in [
+        """CREATE TABLE IF NOT EXISTS search_query (
+            id SERIAL NOT NULL,
+            at TIMESTAMP WITHOUT TIME ZONE DEFAULT LOCALTIMESTAMP NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (id)
+        )""",
+        "CREATE INDEX IF NOT EXISTS ix_search_query_at ON search_query (at)",
+    ]:
+        db_session.execute(text(statement))
+    db_session.commit()
+
+
+def applied_migrations() -> Dict[int, datetime.datetime]:
+    """Versions of the applied migrations, with the time they were applied."""
+    if not inspect(db_session.get_bind()).has_table(SchemaMigration.__tablename__):
+        return {}
+    return {
+        m.version: m.applied_at
+        for m in db_session.scalars(select(SchemaMigration))
+    }
+
+
+def pending_migrations() -> List[Migration]:
+    applied = applied_migrations()
+    return [m for m in MIGRATIONS if m.version not in applied]
+
+
+def upgrade() -> List[Migration]:
+    """Apply all pending migrations and create upcoming partitions.
+
+    Returns the migrations applied.
+    """
+    # on a connection of its own, as migrations commit as they go
+    with get_engine().connect() as lock:
+        lock.execute(text("SELECT pg_advisory_lock(:key)"), {"key": _LOCK_KEY})
+        try:
+            db_session.execute(
+                text(
+                    "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                    " version INTEGER NOT NULL,"
+                    " name VARCHAR(255) NOT NULL,"
+                    " applied_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,"
+                    " PRIMARY KEY (version))"
+                )
+            )
+            db_session.commit()
+            applied = []
+            for m in pending_migrations():
+                logger.info(f"applying migration {m.version}: {m.name}")
+                m.apply()
+                db_session.add(SchemaMigration(version=m.version, name=m.name))
+                db_session.commit()
+                applied.append(m)
+            ensure_interaction_partitions()
+        finally:
+            db_session.rollback()
+            lock.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _LOCK_KEY})
+            lock.commit()
+    return applied
@@ -6,6 +6,19 @@ import datetime
 from ..db import Base
 
 
+class SchemaMigration(Base):
+    # migrations applied to the database, see fo_services.migrations
+    __tablename__ = "schema_migrations"
+    version: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    name: Mapped[str] = mapped_column(sa.String(255))
+    applied_at: Mapped[datetime.datetime] = mapped_column(
+        sa.DateTime, default=sa.func.now()
+    )
+
+    def __repr__(self) -> str:
+        return f"SchemaMigration(version={self.version!r}, name={self.name!r}, applied_at={self.applied_at!r})"
+
+
 class User(Base):
     __tablename__ = "user"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
@@ -36,42 +49,174 @@ class RecommUser(Base):
 
 
 class InteractionHistory(Base):
+    # partitioned by month of `at`, see db.ensure_interaction_partitions
     __tablename__ = "hist_interact"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     wisski_user: Mapped[int] = mapped_column(sa.ForeignKey("rec_user.wisski_id"))
     # wisski_item should not be foreign key relation, as new items may be added that have not been seen by the model yet
     wisski_item: Mapped[int]
-    at: Mapped[datetime.datetime] = mapped_column(sa.DateTime, default=sa.func.now())
+    # the partition key has to be part of the primary key
+    at: Mapped[datetime.datetime] = mapped_column(
+        sa.DateTime, primary_key=True, default=sa.func.now()
+    )
+
+    __table_args__ = (
+        # recent interactions of a user, e.g. for item neighbours
+        sa.Index(
+            "ix_hist_interact_user_at",
+            "wisski_user",
+            "at",
+            postgresql_include=["wisski_item"],
+        ),
+        {"postgresql_partition_by": "RANGE (at)"},
+    )
 
     def __repr__(self) -> str:
         return f"InteractionHistory(id={self.id!r}, wisski_user={self.wisski_user!r}, wisski_item={self.wisski_item!r}, at={self.at!r})"
 
 
+class InteractionDailyUser(Base):
+    # interactions of a user per day, kept beyond the retention of hist_interact
+    __tablename__ = "interaction_daily_user"
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    wisski_user: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    interactions: Mapped[int]
+    # distinct items
+    items: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"InteractionDailyUser(day={self.day!r}, wisski_user={self.wisski_user!r}, interactions={self.interactions!r}, items={self.items!r})"
+
+
+class InteractionDailyItem(Base):
+    # interactions with an item per day, kept beyond the retention of hist_interact
+    __tablename__ = "interaction_daily_item"
+    day: Mapped[datetime.date] = mapped_column(primary_key=True)
+    wisski_item: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    interactions: Mapped[int]
+    # distinct users
+    users: Mapped[int]
+
+    def __repr__(self) -> str:
+        return f"InteractionDailyItem(day={self.day!r}, wisski_item={self.wisski_item!r}, interactions={self.interactions!r}, users={self.users!r})"
+
+
+class ModelVersion(Base):
+    # one row per model generation. Exactly one generation is active and
+    # served; older ones are kept around for rolling back.
+    __tablename__ = "model_version"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    created_at: Mapped[datetime.datetime] = mapped_column(
+        sa.DateTime, default=sa.func.now()
+    )
+    activated_at: Mapped[datetime.datetime] = mapped_column(
+        sa.DateTime, default=None, nullable=True
+    )
+    is_active: Mapped[bool] = mapped_column(default=False)
+    # bumped by every delta update applied to this generation
+    revision: Mapped[int] = mapped_column(default=0, server_default="0")
+
+    __table_args__ = (
+        sa.Index(
+            "ix_model_version_active",
+            "is_active",
+            unique=True,
+            postgresql_where=sa.text("is_active"),
+        ),
+    )
+
+    def __repr__(self) -> str:
+        return f"ModelVersion(id={self.id!r}, created_at={self.created_at!r}, activated_at={self.activated_at!r}, is_active={self.is_active!r}, revision={self.revision!r})"
+
+
 class ItemClusterInfo(Base):
     __tablename__ = "item_cluster"
-    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    version: Mapped[int] = mapped_column(
+        sa.ForeignKey("model_version.id", ondelete="CASCADE"), primary_key=True
+    )
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
     cluster: Mapped[int]
     rank: Mapped[int]
+
+    __table_args__ = (
+        # clusters of items joined to recommendations, without heap fetches
+        sa.Index(
+            "ix_item_cluster_cluster",
+            "version",
+            "id",
+            postgresql_include=["cluster"],
+        ),
+        # best ranked items of all clusters, see db.get_itemlist_from_cluster
+        sa.Index(
+            "ix_item_cluster_top",
+            "version",
+            "rank",
+            "cluster",
+            "id",
+            postgresql_where=sa.text("cluster <> -1"),
+        ),
+    )
     # ~ among_top5   :  Mapped[bool]                =   mapped_column(unique=False, default=False)
     # ~ among_top10  :  Mapped[bool]                =   mapped_column(unique=False, default=False)
     # ~ among_top50  :  Mapped[bool]                =   mapped_column(unique=False, default=False)
 
     def __repr__(self) -> str:
-        return f"ItemClusterInfo(id={self.id!r}, cluster={self.cluster!r}, rank={self.rank!r})"
+        return f"ItemClusterInfo(version={self.version!r}, id={self.id!r}, cluster={self.cluster!r}, rank={self.rank!r})"
 
 
 class UserRecommendationModel(Base):
     __tablename__ = "user_recommendation_model"
+    version: Mapped[int] = mapped_column(primary_key=True)
     user: Mapped[int] = mapped_column(
         sa.ForeignKey("rec_user.wisski_id"), primary_key=True
     )
-    item: Mapped[int] = mapped_column(
-        sa.ForeignKey("item_cluster.id"), primary_key=True
-    )
+    item: Mapped[int] = mapped_column(primary_key=True)
     rank: Mapped[int]
 
+    __table_args__ = (
+        sa.ForeignKeyConstraint(
+            ["version", "item"],
+            ["item_cluster.version", "item_cluster.id"],
+            ondelete="CASCADE",
+        ),
+        # recommendations of a generation in order, see db.get_all_recommendations
+        sa.Index("ix_user_recommendation_model_user_rank", "version", "user", "rank", "item"),
+    )
+
+    def __repr__(self) -> str:
+        return f"UserRecommendationModel(version={self.version!r}, user={self.user!r}, item={self.item!r}, rank={self.rank!r})"
+
+
+class ItemNeighbour(Base):
+    # top-k related items of every item of a model generation, derived from
+    # cluster membership and co-occurrence in the interaction history
+    __tablename__ = "item_neighbour"
+    version: Mapped[int] = mapped_column(
+        sa.ForeignKey("model_version.id", ondelete="CASCADE"), primary_key=True
+    )
+    item: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    rank: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    neighbour: Mapped[int]
+    score: Mapped[float]
+
+    def __repr__(self) -> str:
+        return f"ItemNeighbour(version={self.version!r}, item={self.item!r}, rank={self.rank!r}, neighbour={self.neighbour!r}, score={self.score!r})"
+
+
+class SearchQuery(Base):
+    # queries extended by /queries/extend; query expansion learns from them
+    __tablename__ = "search_query"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    # stamped by the database, like the export watermarks
+    at: Mapped[datetime.datetime] = mapped_column(
+        sa.DateTime, server_default=sa.text("LOCALTIMESTAMP")
+    )
+    text: Mapped[str] = mapped_column(sa.Text)
+
+    __table_args__ = (sa.Index("ix_search_query_at", "at"),)
+
     def __repr__(self) -> str:
-        return f"UserRecommendationModel(user={self.user!r}, item={self.item!r}, rank={self.rank!r})"
+        return f"SearchQuery(id={self.id!r}, at={self.at!r}, text={self.text!r})"
 
 
 # ~ class RecommHistory(Base):
@@ -10,10 +10,13 @@ from flask import (
     session,
     url_for,
 )
+from sqlalchemy import event, inspect
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from fo_services import LDAP
+from fo_services.credential_cache import CredentialCache
 from fo_services.db import db_session, get_user
+from fo_services.metrics import phase
 from fo_services.models import User
 
 import logging
@@ -22,6 +25,34 @@ logger = logging.getLogger(__name__)
 
 bp = Blueprint("auth", __name__, url_prefix="/auth")
 
+# shared by the HTTP basic auth of all APIs
+credential_cache = CredentialCache()
+
+
+@bp.record_once
+def configure_credential_cache(state):
+    credential_cache.ttl = state.app.config.get("AUTH_CACHE_TTL", 300)
+    credential_cache.max_size = state.app.config.get("AUTH_CACHE_SIZE", 1024)
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def invalidate_cached_credentials(mapper, connection, target):
+    names = {target.name, *inspect(target).attrs.name.history.deleted}
+    for name in names:
+        credential_cache.invalidate(name)
+
+
+def _credential_stamp(user: User) -> str:
+    # changes whenever a password is set or a user deleted, in any worker
+    return f"{user.is_ldap_user}:{user.password}:{user.deleted_at}"
+
+
+def _log_in(username, known_user):
+    g.user = known_user
+    session.clear()
+    session["user_id"] = username
+
 
 def check_login(username, password):
     known_user = get_user(username)
@@ -43,13 +74,34 @@ def check_login(username, password):
                         f"cant add {username} to the db during login as it is already registered"
                     )
     if success:
-        g.user = known_user
-        session.clear()
-        session["user_id"] = username
+        _log_in(username, known_user)
         return (True, known_user)
     return (False, None)
 
 
+def verify_credentials(username, password):
+    """Check HTTP basic auth credentials; returns the user name on success.
+
+    Successful checks are cached for a while, so that API clients don't pay
+    for password hashing or LDAP binds on every request. The user is loaded
+    either way, and a cached check only holds while the stored user is
+    unchanged.
+    """
+    with phase("auth"):
+        known_user = get_user(username)
+        if known_user is not None and credential_cache.check(
+            username, password, _credential_stamp(known_user)
+        ):
+            _log_in(username, known_user)
+            return known_user.name
+
+        success, known_user = check_login(username, password)
+        if success:
+            credential_cache.add(username, password, _credential_stamp(known_user))
+            return known_user.name
+        return None
+
+
 @bp.route("/user/create", methods=("GET", "POST"))
 def create_user():
     if request.method == "POST":
@@ -102,7 +154,7 @@ def login():
 @bp.before_app_request
 def load_logged_in_user():
     user_id = session.get("user_id")
-    logger.debug("load user for id " + str(user_id))
+    logger.debug("load user for id %s", user_id)
 
     if user_id is None:
         g.user = None
@@ -0,0 +1,195 @@
+import abc
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from collections.abc import Callable, Sequence
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# stops the writer thread once everything queued before it is written
+_STOP = object()
+
+
+class BatchLogger(abc.ABC):
+    """Buffers events and writes them in batches from a background thread.
+
+    `log()` never waits for the database. Events are held in a queue of at
+    most `max_queue` entries; when it is full they are dropped, or, with
+    `block_timeout` > 0, the caller waits that long for room first. The
+    writer thread is started lazily in each process, so it also works after
+    the forking of uwsgi workers (which must run with threads enabled).
+    Queued events are flushed when the interpreter exits.
+    """
+
+    name = "event"
+
+    def __init__(
+        self,
+        writer: Optional[Callable[[Sequence], int]] = None,
+        max_queue: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        block_timeout: float = 0.0,
+    ):
+        self.writer = writer
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.block_timeout = block_timeout
+
+        self._lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._stats = {"written": 0, "dropped": 0, "failed": 0, "batches": 0}
+
+    def _enqueue(self, event) -> bool:
+        self._ensure_started()
+        try:
+            if self.block_timeout > 0:
+                self._queue.put(event, timeout=self.block_timeout)
+            else:
+                self._queue.put_nowait(event)
+            return True
+        except queue.Full:
+            with self._lock:
+                self._stats["dropped"] += 1
+                dropped = self._stats["dropped"]
+            # don't flood the log while the database is unavailable
+            if dropped & (dropped - 1) == 0:
+                logger.warning(f"{self.name} queue full, {dropped} events dropped")
+            return False
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._stats, "queued": self._queue.qsize()}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            # a fresh queue: a forked child must not write its parent's events
+            self._queue = queue.Queue(maxsize=self.max_queue)
+            self._thread = threading.Thread(
+                target=self._run,
+                args=(self._queue,),
+                name=f"{self.name}-logger",
+                daemon=True,
+            )
+            self._thread.start()
+            if self._pid is None:
+                atexit.register(self.stop)
+            self._pid = os.getpid()
+
+    def stop(self, timeout: float = 5.0):
+        """Write out everything queued so far and stop the writer thread."""
+        with self._lock:
+            thread = self._thread
+            if thread is None or self._pid != os.getpid():
+                return
+            self._thread = None
+            self._pid = None
+        # the sentinel may wait for room, it is never dropped
+        self._queue.put(_STOP)
+        thread.join(timeout)
+
+    def _run(self, events: queue.Queue):
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                item = events.get()
+                deadline = time.monotonic() + self.flush_interval
+                while item is not _STOP:
+                    batch.append(item)
+                    if len(batch) >= self.batch_size:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    try:
+                        item = events.get(timeout=remaining)
+                    except queue.Empty:
+                        break
+                stopping = item is _STOP
+                self._write(batch)
+            except Exception:
+                logger.exception(f"{self.name} logger failed")
+
+    def _write(self, batch):
+        if not batch:
+            return
+        writer = self.writer or self._store
+        try:
+            written = writer(batch)
+        except Exception:
+            logger.exception(f"error writing {len(batch)} {self.name} events, dropping them")
+            with self._lock:
+                self._stats["failed"] += len(batch)
+            return
+        with self._lock:
+            self._stats["written"] += written
+            self._stats["batches"] += 1
+
+    @abc.abstractmethod
+    def _store(self, batch) -> int:
+        """Write a batch of events; returns the number written."""
+
+
+class InteractionLogger(BatchLogger):
+    """Buffers interaction events and writes them in batches, see `BatchLogger`."""
+
+    name = "interaction"
+
+    def log(self, wisski_user, wisski_item) -> bool:
+        """Queue an interaction; returns False if it was dropped."""
+        if not isinstance(wisski_user, int) or not isinstance(wisski_item, int):
+            # anonymous users have nothing to be logged
+            logger.debug(f"not logging interaction {wisski_user!r}/{wisski_item!r}")
+            return False
+
+        # stamped by the database when written, on the clock of the export
+        # watermark; a stamp taken here could be older than a watermark
+        # taken before the event is written, and the event never exported
+        return self._enqueue((wisski_user, wisski_item))
+
+    def _store(self, batch) -> int:
+        from ..db import db_session, log_interactions
+
+        try:
+            return log_interactions(batch)
+        finally:
+            db_session.remove()
+
+
+class QueryLogger(BatchLogger):
+    """Buffers search queries and writes them in batches, see `BatchLogger`."""
+
+    name = "query"
+    # longer queries are cut, they are pasted text rather than searches
+    MAX_QUERY_LENGTH = 500
+
+    def log(self, query) -> bool:
+        """Queue a search query; returns False if it was dropped."""
+        query = query.strip() if isinstance(query, str) else ""
+        if not query:
+            return False
+        return self._enqueue(query[: self.MAX_QUERY_LENGTH])
+
+    def _store(self, batch) -> int:
+        from ..db import db_session, log_search_queries
+
+        try:
+            return log_search_queries(batch)
+        finally:
+            db_session.remove()
+
+
+interaction_logger = InteractionLogger()
+query_logger = QueryLogger()
@@ -0,0 +1,257 @@
+import datetime
+import io
+import logging
+import os
+import tempfile
+import threading
+from collections.abc import Callable
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# bumped when the arrays of the cache file change
+FORMAT = 1
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+_MICROSECOND = datetime.timedelta(microseconds=1)
+
+
+def to_microseconds(moment: datetime.datetime) -> int:
+    return (moment - _EPOCH) // _MICROSECOND
+
+
+def from_microseconds(microseconds: int) -> datetime.datetime:
+    return _EPOCH + datetime.timedelta(microseconds=int(microseconds))
+
+
+def _extend_dictionary(ids: np.ndarray, new: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """`ids` with the unknown ids of `new` appended in order of appearance,
+    and the position of every element of `new` in the result."""
+    order = np.argsort(ids, kind="stable")
+    known = ids[order]
+    pos = np.minimum(np.searchsorted(known, new), max(len(known) - 1, 0))
+    found = known[pos] == new if len(known) else np.zeros(len(new), dtype=bool)
+
+    unknown, first = np.unique(new[~found], return_index=True)
+    ids = np.concatenate([ids, unknown[np.argsort(first)]])
+
+    order = np.argsort(ids, kind="stable")
+    return ids, order[np.searchsorted(ids[order], new)]
+
+
+class InteractionMatrix(object):
+    """User–item interactions as id dictionaries and index arrays.
+
+    Users and items get an index when they are first seen. The dictionaries
+    only grow, so the index of an id is the same in every export built from
+    the same cache. Interactions are kept in the order of their time.
+    """
+
+    def __init__(
+        self,
+        user_ids: np.ndarray,
+        item_ids: np.ndarray,
+        users: np.ndarray,
+        items: np.ndarray,
+        at: np.ndarray,
+        watermark: Optional[int],
+    ):
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+        self.users = users
+        self.items = items
+        # microseconds since the epoch
+        self.at = at
+        # everything up to this time is included
+        self.watermark = watermark
+
+    @classmethod
+    def empty(cls) -> "InteractionMatrix":
+        ids = np.empty(0, dtype=np.int64)
+        index = np.empty(0, dtype=np.int32)
+        return cls(ids, ids, index, index, ids, None)
+
+    def __len__(self) -> int:
+        return len(self.at)
+
+    def extend(
+        self, new_users: np.ndarray, interactions: np.ndarray, watermark: int
+    ) -> "InteractionMatrix":
+        """A matrix with the (user, item, at) rows of `interactions` appended.
+
+        The rows must be later than the watermark of this matrix.
+        """
+        user_ids, _ = _extend_dictionary(self.user_ids, new_users)
+        # users of interactions may have been registered after the watermark
+        user_ids, users = _extend_dictionary(user_ids, interactions[:, 0])
+        item_ids, items = _extend_dictionary(self.item_ids, interactions[:, 1])
+        return InteractionMatrix(
+            user_ids,
+            item_ids,
+            np.concatenate([self.users, users.astype(np.int32)]),
+            np.concatenate([self.items, items.astype(np.int32)]),
+            np.concatenate([self.at, interactions[:, 2]]),
+            watermark,
+        )
+
+    def to_csr(self, since: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """The interactions after `since` as a CSR matrix of users × items.
+
+        Items of a user are ordered by time; ``scipy.sparse.csr_array((
+        np.ones(len(indices)), indices, indptr))`` builds the matrix.
+        """
+        start = 0 if since is None else np.searchsorted(self.at, since, side="right")
+        users = self.users[start:]
+        # stable, so the items of every user stay in the order of time
+        order = np.argsort(users, kind="stable")
+        indptr = np.zeros(len(self.user_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(users, minlength=len(self.user_ids)), out=indptr[1:])
+        return {
+            "user_ids": self.user_ids,
+            "item_ids": self.item_ids,
+            "indptr": indptr,
+            "indices": self.items[start:][order],
+            "timestamps": self.at[start:][order],
+            "watermark": np.array(
+                self.watermark if self.watermark is not None else -1, dtype=np.int64
+            ),
+            "since": np.array(since if since is not None else -1, dtype=np.int64),
+        }
+
+    def to_npz(self, since: Optional[int] = None) -> bytes:
+        buffer = io.BytesIO()
+        np.savez(buffer, allow_pickle=False, **self.to_csr(since))
+        return buffer.getvalue()
+
+    def save(self, path: str):
+        """Write the matrix to `path`, atomically replacing a previous file."""
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix=".interactions-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    format=np.int64(FORMAT),
+                    user_ids=self.user_ids,
+                    item_ids=self.item_ids,
+                    users=self.users,
+                    items=self.items,
+                    at=self.at,
+                    watermark=np.int64(
+                        self.watermark if self.watermark is not None else -1
+                    ),
+                )
+                f.flush()
+                os.fsync(f.fileno())
+            os.chmod(tmp, 0o644)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "InteractionMatrix":
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["format"]) != FORMAT:
+                raise ValueError(f"{path} has format {int(data['format'])}, not {FORMAT}")
+            watermark = int(data["watermark"])
+            return cls(
+                data["user_ids"],
+                data["item_ids"],
+                data["users"],
+                data["items"],
+                data["at"],
+                watermark if watermark >= 0 else None,
+            )
+
+
+class InteractionMatrixCache(object):
+    """Keeps the interaction matrix up to date, loading only rows that are new.
+
+    The matrix is stored in `path`, so it survives restarts and is shared by
+    all workers; without a path it is kept in memory only.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        fetch_users: Optional[Callable] = None,
+        fetch_interactions: Optional[Callable] = None,
+    ):
+        self.path = path
+        self.fetch_users = fetch_users
+        self.fetch_interactions = fetch_interactions
+        self._lock = threading.Lock()
+        self._matrix = InteractionMatrix.empty()
+        self._file_marker: Optional[Tuple[int, int, int]] = None
+
+    def _stored(self) -> InteractionMatrix:
+        # another worker may have brought the file further than we are
+        if self.path is None:
+            return self._matrix
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            if self._file_marker is not None:
+                # reset by another worker
+                self._matrix = InteractionMatrix.empty()
+                self._file_marker = None
+            return self._matrix
+        marker = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if marker != self._file_marker:
+            try:
+                self._matrix = InteractionMatrix.load(self.path)
+            except Exception:
+                logger.exception(f"ignoring interaction matrix {self.path}")
+                self._matrix = InteractionMatrix.empty()
+            self._file_marker = marker
+        return self._matrix
+
+    def get(self, until: datetime.datetime) -> InteractionMatrix:
+        """The matrix of all interactions up to `until`."""
+        fetch_users, fetch_interactions = self.fetch_users, self.fetch_interactions
+        if fetch_users is None or fetch_interactions is None:
+            from ..db import get_interactions, get_users_seen
+
+            fetch_users, fetch_interactions = get_users_seen, get_interactions
+
+        with self._lock:
+            matrix = self._stored()
+            watermark = to_microseconds(until)
+            if matrix.watermark is not None and matrix.watermark >= watermark:
+                return matrix
+
+            since = (
+                from_microseconds(matrix.watermark)
+                if matrix.watermark is not None
+                else None
+            )
+            interactions = fetch_interactions(until, since)
+            matrix = matrix.extend(fetch_users(until, since), interactions, watermark)
+            logger.info(
+                f"added {len(interactions)} interactions to the interaction matrix,"
+                f" {len(matrix)} in total"
+            )
+            if self.path is not None:
+                matrix.save(self.path)
+                st = os.stat(self.path)
+                self._file_marker = (st.st_ino, st.st_mtime_ns, st.st_size)
+            self._matrix = matrix
+            return matrix
+
+    def reset(self):
+        """Forget the matrix, e.g. after interactions were deleted."""
+        with self._lock:
+            self._matrix = InteractionMatrix.empty()
+            self._file_marker = None
+            if self.path is not None:
+                try:
+                    os.unlink(self.path)
+                except FileNotFoundError:
+                    pass
+
+
+interaction_matrix = InteractionMatrixCache()
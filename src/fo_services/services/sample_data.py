@@ -0,0 +1,150 @@
+"""Synthetic users, interactions and models, for benchmarks and capacity planning.
+
+Everything is drawn from a seeded generator, so the same scale and seed
+always give the same data. Item popularity follows a power law: a few
+items get most interactions and recommendations, as in real catalogues,
+and the number of interactions per user is heavy-tailed as well. Arrays
+are generated in blocks, so millions of rows never have to be held as
+Python objects.
+"""
+
+import datetime
+from collections.abc import Iterator
+from dataclasses import asdict, dataclass
+from typing import Tuple
+
+import numpy as np
+
+from .interaction_matrix import from_microseconds, to_microseconds
+
+# users per generated block of interactions or recommendations
+BLOCK_USERS = 100_000
+
+_DAY_MICROSECONDS = 86_400_000_000
+
+
+@dataclass(frozen=True)
+class SampleScale:
+    users: int = 10_000
+    items: int = 50_000
+    clusters: int = 50
+    # share of items without a cluster (-1)
+    noise: float = 0.1
+    # mean; the actual numbers are log-normally distributed
+    interactions_per_user: float = 20.0
+    recos_per_user: int = 20
+    # exponent of the power law of item popularity
+    popularity: float = 1.1
+    # interactions reach back this far
+    days: int = 180
+    seed: int = 0
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class SampleData(object):
+    """Generates the tables of a scale, relative to `now`."""
+
+    def __init__(self, scale: SampleScale, now: datetime.datetime | None = None):
+        self.scale = scale
+        self.now = to_microseconds(now or datetime.datetime.now())
+        rng = np.random.default_rng(scale.seed)
+        # item ids by popularity, so the popular ones are not just the low ids
+        self.by_popularity = rng.permutation(scale.items).astype(np.int64)
+        weights = 1.0 / np.arange(1, scale.items + 1) ** scale.popularity
+        self._popularity_cdf = np.cumsum(weights / weights.sum())
+
+    def _rng(self, part: int, block: int = 0) -> np.random.Generator:
+        # independent streams, so every table can be generated on its own
+        return np.random.default_rng([self.scale.seed, part, block])
+
+    def _popular(self, rng: np.random.Generator, size) -> np.ndarray:
+        """Positions in `by_popularity`, drawn by popularity."""
+        positions = np.searchsorted(self._popularity_cdf, rng.random(size), side="right")
+        return np.minimum(positions, self.scale.items - 1)
+
+    @property
+    def start(self) -> int:
+        return self.now - self.scale.days * _DAY_MICROSECONDS
+
+    def months(self) -> list[datetime.date]:
+        """The months interactions fall into."""
+        first, last = from_microseconds(self.start), from_microseconds(self.now).date()
+        months = []
+        month = datetime.date(first.year, first.month, 1)
+        while month <= last:
+            months.append(month)
+            month = (month + datetime.timedelta(days=32)).replace(day=1)
+        return months
+
+    def users(self) -> Tuple[np.ndarray, np.ndarray]:
+        """WissKI ids and the time users were first seen."""
+        rng = self._rng(1)
+        first_seen = self.start + (
+            rng.random(self.scale.users) * (self.now - self.start)
+        ).astype(np.int64)
+        return np.arange(self.scale.users, dtype=np.int64), first_seen
+
+    def clusters(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Item ids, their clusters and their ranks within the cluster.
+
+        Cluster sizes follow a power law too; items are ranked by popularity.
+        """
+        rng = self._rng(2)
+        n = self.scale.items
+        weights = 1.0 / np.arange(1, self.scale.clusters + 1)
+        cluster = rng.choice(self.scale.clusters, size=n, p=weights / weights.sum())
+        cluster[rng.random(n) < self.scale.noise] = -1
+
+        # positions are in order of popularity already
+        positions = np.arange(n)
+        order = np.lexsort((positions, cluster))
+        sorted_clusters = cluster[order]
+        starts = np.flatnonzero(np.r_[True, sorted_clusters[1:] != sorted_clusters[:-1]])
+        rank = np.empty(n, dtype=np.int64)
+        rank[order] = np.arange(n) - np.repeat(starts, np.diff(np.r_[starts, n]))
+        return self.by_popularity, cluster.astype(np.int64), rank
+
+    def interactions(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Blocks of users, items and times of interactions, after the user
+        was first seen."""
+        _, first_seen = self.users()
+        mean = self.scale.interactions_per_user
+        sigma = 1.0
+        for block, start in enumerate(range(0, self.scale.users, BLOCK_USERS)):
+            rng = self._rng(3, block)
+            users = np.arange(start, min(start + BLOCK_USERS, self.scale.users))
+            counts = np.rint(
+                rng.lognormal(np.log(max(mean, 1e-9)) - sigma**2 / 2, sigma, len(users))
+            ).astype(np.int64)
+            user_of = np.repeat(users, counts)
+            seen = first_seen[user_of]
+            at = seen + (rng.random(len(user_of)) * (self.now - seen)).astype(np.int64)
+            items = self.by_popularity[self._popular(rng, len(user_of))]
+            yield user_of, items, at
+
+    def recommendations(self) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """Blocks of users, items and ranks; distinct items per user, the
+        popular ones more often and ranked first."""
+        k = min(self.scale.recos_per_user, self.scale.items)
+        if k <= 0:
+            return
+        for block, start in enumerate(range(0, self.scale.users, BLOCK_USERS)):
+            rng = self._rng(4, block)
+            users = np.arange(start, min(start + BLOCK_USERS, self.scale.users))
+            # twice as many draws as needed, as popular items repeat
+            picks = np.sort(self._popular(rng, (len(users), 2 * k)), axis=1)
+            repeated = np.zeros_like(picks, dtype=bool)
+            repeated[:, 1:] = picks[:, 1:] == picks[:, :-1]
+            # distinct picks first, in order of popularity
+            order = np.argsort(repeated, axis=1, kind="stable")[:, :k]
+            picks = np.take_along_axis(picks, order, axis=1)
+            keep = ~np.take_along_axis(repeated, order, axis=1)
+
+            rank = np.broadcast_to(np.arange(k), picks.shape)
+            yield (
+                np.broadcast_to(users[:, None], picks.shape)[keep],
+                self.by_popularity[picks[keep]],
+                rank[keep],
+            )
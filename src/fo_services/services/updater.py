@@ -4,10 +4,19 @@ from ..db import UpdateModelResult
 
 
 class UpdaterService(object):
-    def __init__(self, api_client: TrainingApiClient):
+    def __init__(self, api_client: TrainingApiClient, kg: KGHandler | None = None):
         self.api_client = api_client
+        if kg is None:
+            # share the application's handler, so its snapshot is refreshed
+            # right after an update triggered in this process
+            from .. import KG
 
-    def reload_data(self) -> UpdateModelResult:
-        cluster_data = self.api_client.get_cluster()
-        reco_data = self.api_client.get_recommendations()
-        return KGHandler().reload_data(cluster_data, reco_data)
+            kg = KG
+        self.kg = kg
+
+    def reload_data(self, delta: bool = False) -> UpdateModelResult:
+        # both exports are consumed lazily by the database loader, so they are
+        # never held in memory as a whole
+        cluster_data = self.api_client.stream_cluster()
+        reco_data = self.api_client.stream_recommendations()
+        return self.kg.reload_data(cluster_data, reco_data, delta=delta)
@@ -0,0 +1,189 @@
+"""Structured log messages, written from a background thread.
+
+`StructuredMessage` defers building its JSON until a handler formats it.
+`init_app` puts a bounded queue in front of the handlers of the app
+logger, so formatting and writing happen in a writer thread and a request
+only pays for appending a record to the queue. When the queue is full,
+records are dropped rather than waited for.
+"""
+
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import threading
+from typing import Any, Dict, List, Optional
+
+# lists of ids in messages are cut to this many items, by default
+DEFAULT_MAX_ITEMS = 20
+
+
+class LogSettings(object):
+    """Sampling and truncation of structured messages, per `module` field.
+
+    `modules` maps a module to a dict with "sample", the fraction of its
+    messages to log, and "max_items", the length lists are cut to.
+    """
+
+    def __init__(self, max_items: Optional[int] = DEFAULT_MAX_ITEMS, modules=None):
+        self.max_items = max_items
+        self.modules: Dict[str, Dict[str, Any]] = modules or {}
+
+    def _of(self, module: Optional[str]) -> Dict[str, Any]:
+        return self.modules.get(module, {}) if module is not None else {}
+
+    def sample_rate(self, module: Optional[str]) -> float:
+        return float(self._of(module).get("sample", 1.0))
+
+    def max_items_of(self, module: Optional[str]) -> Optional[int]:
+        return self._of(module).get("max_items", self.max_items)
+
+
+settings = LogSettings()
+
+
+class StructuredMessage(object):
+    """A log message of key-value pairs, rendered as compact JSON.
+
+    Lists longer than the module's `max_items` are cut, and their length is
+    added as `<key>_count`. Values are serialized when the message is
+    written, so they must not be changed after logging.
+    """
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.created = datetime.datetime.now()
+
+    @property
+    def module(self) -> Optional[str]:
+        return self.kwargs.get("module")
+
+    def __str__(self):
+        limit = settings.max_items_of(self.module)
+        fields = {}
+        for key, value in self.kwargs.items():
+            if limit is not None and isinstance(value, (list, tuple)) and len(value) > limit:
+                fields[key] = value[:limit]
+                fields[f"{key}_count"] = len(value)
+            else:
+                fields[key] = value
+        fields["time"] = str(self.created)
+        return json.dumps(fields, separators=(",", ":"), default=str)
+
+
+class _Sampler(logging.Filter):
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not isinstance(record.msg, StructuredMessage):
+            return True
+        rate = settings.sample_rate(record.msg.module)
+        return rate >= 1.0 or random.random() < rate
+
+
+class _Listener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # the sentinel may wait for room, it is never dropped
+        self.queue.put(self._sentinel)
+
+
+class QueueLogHandler(logging.handlers.QueueHandler):
+    """Passes records to `handlers` through a bounded queue.
+
+    The writer thread is started lazily in each process, so it also works
+    after the forking of uwsgi workers. Queued records are written when the
+    interpreter exits.
+    """
+
+    def __init__(self, handlers: List[logging.Handler], max_queue: int = 10000):
+        records: queue.Queue = queue.Queue(maxsize=max_queue)
+        super().__init__(records)
+        # QueueHandler only promises put_nowait, stats need qsize
+        self.queue: queue.Queue = records
+        self.handlers = handlers
+        self.max_queue = max_queue
+        self.addFilter(_Sampler())
+
+        self._start_lock = threading.Lock()
+        self._pid: Optional[int] = None
+        self._listener: Optional[_Listener] = None
+        self._dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # unlike QueueHandler, leave formatting to the writer thread; only
+        # tracebacks are rendered here, while their frames are current
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            with self._start_lock:
+                self._dropped += 1
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "dropped": self._dropped}
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid == os.getpid():
+                return
+            # a fresh queue: a forked child must not write its parent's records
+            self.queue = queue.Queue(maxsize=self.max_queue)
+            self._listener = _Listener(
+                self.queue, *self.handlers, respect_handler_level=True
+            )
+            self._listener.start()
+            if self._pid is None:
+                atexit.register(self.stop)
+            self._pid = os.getpid()
+
+    def stop(self):
+        """Write out everything queued so far and stop the writer thread."""
+        with self._start_lock:
+            listener = self._listener
+            if listener is None or self._pid != os.getpid():
+                return
+            self._listener = None
+            self._pid = None
+        listener.stop()
+
+
+def init_app(app) -> QueueLogHandler:
+    """Move the handlers of the app logger behind a queue.
+
+    Configured by LOG_LEVEL, LOG_QUEUE_SIZE, LOG_MAX_ITEMS and LOG_MODULES,
+    e.g. ``{"ranking": {"sample": 0.1, "max_items": 5}}``.
+    """
+    config = app.config
+    settings.max_items = config.get("LOG_MAX_ITEMS", DEFAULT_MAX_ITEMS)
+    settings.modules = dict(config.get("LOG_MODULES", {}))
+
+    logger = app.logger
+    logger.setLevel(config.get("LOG_LEVEL", "INFO"))
+    handlers = []
+    # the app logger is shared by every app of the package, e.g. in tests
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        if isinstance(handler, QueueLogHandler):
+            handler.stop()
+            handlers.extend(handler.handlers)
+        else:
+            handlers.append(handler)
+    handler = QueueLogHandler(handlers, max_queue=int(config.get("LOG_QUEUE_SIZE", 10000)))
+    logger.addHandler(handler)
+    return handler
+
+
+def log_stats(app) -> Dict[str, int]:
+    for handler in app.logger.handlers:
+        if isinstance(handler, QueueLogHandler):
+            return handler.stats()
+    return {"queued": 0, "dropped": 0}
@@ -19,12 +19,14 @@ LDAP = LDAPExtension()
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     db_fd, db_path = tempfile.mkstemp()
     app = create_app(
         {
             "TESTING": True,
             "DATABASE": db_path,
+            "METRICS_DIR": str(tmp_path / "metrics"),
+            "MODEL_FILE": str(tmp_path / "model.bin"),
         }
     )
 
@@ -0,0 +1,80 @@
+import io
+import json
+
+import pytest
+import pytest_mock
+import requests
+
+from fo_services.client.api_clients import ApiError, TrainingApiClient, _iter_json_array
+
+rows = [{"user": i, "item": 2 * i, "rank": i % 7, "label": "Grüße [x]"} for i in range(50)]
+payload = json.dumps(rows).encode("utf8")
+
+
+def chunked(data: bytes, size: int):
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize(("size",), ((1,), (7,), (64,), (len(payload),)))
+def test_iter_json_array(size: int):
+    assert list(_iter_json_array(chunked(payload, size))) == rows
+
+
+@pytest.mark.parametrize(
+    ("data", "expected"),
+    (
+        (b"[]", []),
+        (b"  [ ]  ", []),
+        (b"[1, 22, 333]", [1, 22, 333]),
+        (b'[[1, 2], {"a": [3]}]', [[1, 2], {"a": [3]}]),
+    ),
+)
+def test_iter_json_array_values(data: bytes, expected):
+    assert list(_iter_json_array(chunked(data, 1))) == expected
+
+
+@pytest.mark.parametrize(("data",), ((b'{"a": 1}',), (b'[{"a": 1}',), (b"",)))
+def test_iter_json_array_invalid(data: bytes):
+    with pytest.raises(ApiError):
+        list(_iter_json_array(chunked(data, 3)))
+
+
+def make_response(status: int, content_type: str, body: bytes) -> requests.Response:
+    r = requests.Response()
+    r.status_code = status
+    r.headers["Content-Type"] = content_type
+    r.raw = io.BytesIO(body)
+    r.request = requests.Request("GET", "http://training/api").prepare()
+    return r
+
+
+@pytest.mark.parametrize(
+    ("content_type", "body"),
+    (
+        ("application/json", payload),
+        ("application/x-ndjson", b"\n".join(json.dumps(r).encode() for r in rows)),
+        (
+            "application/json-seq",
+            b"".join(b"\x1e" + json.dumps(r).encode() + b"\n" for r in rows),
+        ),
+    ),
+)
+def test_stream_recommendations(
+    mocker: pytest_mock.MockerFixture, content_type: str, body: bytes
+):
+    client = TrainingApiClient("http://training")
+    mocker.patch.object(
+        client.session, "get", return_value=make_response(200, content_type, body)
+    )
+
+    assert list(client.stream_recommendations()) == rows
+
+
+def test_stream_error(mocker: pytest_mock.MockerFixture):
+    client = TrainingApiClient("http://training")
+    mocker.patch.object(
+        client.session, "get", return_value=make_response(500, "text/html", b"")
+    )
+
+    with pytest.raises(ApiError):
+        client.get_cluster()
@@ -0,0 +1,81 @@
+import json
+
+import numpy as np
+import pytest
+import pytest_mock
+from flask.testing import FlaskClient
+
+from fo_services import KG, api_app_v1
+from fo_services.api_app_v1 import MAX_BATCH_USERS
+from fo_services.kgstuff.snapshot import RecommendationSnapshot
+
+AUTH = {"Authorization": "Basic dGVzdDp0ZXN0"}
+FALLBACK = [7, 8, 9]
+
+
+def recommend(client: FlaskClient, payload):
+    return client.post("/api/v1/recommend/batch", json=payload, headers=AUTH)
+
+
+@pytest.fixture
+def ensure_users(mocker: pytest_mock.MockerFixture):
+    """Serves a snapshot of users 1 and 2; returns the registration of unknown users."""
+    mocker.patch.object(api_app_v1, "verify_credentials", return_value="test")
+    # (user, item, rank), out of rank order
+    rows = np.array(
+        [(1, 12, 2), (1, 10, 0), (1, 11, 1), (2, 21, 1), (2, 20, 0)], dtype=np.int64
+    )
+    snapshot = RecommendationSnapshot.from_rows(1, rows, np.array(FALLBACK))
+    mocker.patch.object(KG.snapshots, "get", return_value=snapshot)
+    return mocker.patch("fo_services.kgstuff.ensure_users")
+
+
+def test_known_and_unknown_users(client: FlaskClient, ensure_users):
+    response = recommend(client, {"users": [{"user": 2}, {"user": 5}, {"user": 1}]})
+
+    assert response.status_code == 200
+    assert response.json["items"] == {
+        "2": ["20", "21"],
+        "5": [str(i) for i in FALLBACK],
+        "1": ["10", "11", "12"],
+    }
+    # unknown users are registered at once
+    ensure_users.assert_called_once_with([5])
+
+
+def test_users_are_answered_in_request_order(client: FlaskClient, ensure_users):
+    users = [3, 1, 2, 4]
+    response = recommend(client, {"users": [{"user": u} for u in users]})
+
+    items = json.loads(response.data, object_pairs_hook=list)[0][1]
+    assert [user for user, _ in items] == [str(u) for u in users]
+
+
+def test_size_and_offset_per_user(client: FlaskClient, ensure_users):
+    response = recommend(
+        client,
+        {
+            "users": [{"user": 1, "n": 1, "offset": 1}, {"user": 2}, {"user": 6}],
+            "n": 1,
+        },
+    )
+
+    assert response.json["items"] == {"1": ["11"], "2": ["20"], "6": ["7"]}
+
+
+def test_size_limit(client: FlaskClient, ensure_users):
+    users = [{"user": u} for u in range(MAX_BATCH_USERS + 1)]
+
+    response = recommend(client, {"users": users})
+    assert response.status_code == 400
+    assert f"At most {MAX_BATCH_USERS} users" in response.json["message"]
+    ensure_users.assert_not_called()
+
+    response = recommend(client, {"users": users[:MAX_BATCH_USERS]})
+    assert response.status_code == 200
+    assert len(response.json["items"]) == MAX_BATCH_USERS
+
+
+def test_invalid_payload_is_rejected(client: FlaskClient, ensure_users):
+    assert recommend(client, {"users": [{"user": "someone"}]}).status_code == 400
+    assert recommend(client, {}).status_code == 400
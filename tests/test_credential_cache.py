@@ -0,0 +1,114 @@
+import pytest
+import pytest_mock
+from flask import Flask, g, session
+
+from fo_services import page_auth
+from fo_services.credential_cache import CredentialCache
+from fo_services.models import User
+
+
+def test_check_after_add():
+    cache = CredentialCache()
+    assert not cache.check("user", "secret")
+
+    cache.add("user", "secret")
+    assert cache.check("user", "secret")
+    assert not cache.check("user", "wrong")
+    assert not cache.check("other", "secret")
+
+
+def test_no_plaintext_in_cache():
+    cache = CredentialCache()
+    cache.add("user", "secret")
+    assert all(b"secret" not in digest for digest in cache._entries)
+
+
+def test_expiry(mocker: pytest_mock.MockerFixture):
+    now = mocker.patch("fo_services.credential_cache.time.monotonic", return_value=0)
+    cache = CredentialCache(ttl=10)
+    cache.add("user", "secret")
+
+    now.return_value = 9
+    assert cache.check("user", "secret")
+    now.return_value = 11
+    assert not cache.check("user", "secret")
+    assert len(cache) == 0
+
+
+def test_disabled():
+    cache = CredentialCache(ttl=0)
+    cache.add("user", "secret")
+    assert not cache.check("user", "secret")
+
+
+def test_bounded_lru():
+    cache = CredentialCache(max_size=2)
+    cache.add("a", "a")
+    cache.add("b", "b")
+    assert cache.check("a", "a")
+    cache.add("c", "c")
+
+    assert len(cache) == 2
+    assert cache.check("a", "a")
+    assert not cache.check("b", "b")
+    assert cache.check("c", "c")
+
+
+def test_invalidate():
+    cache = CredentialCache()
+    cache.add("a", "old")
+    cache.add("a", "new")
+    cache.add("b", "b")
+
+    cache.invalidate("a")
+    assert not cache.check("a", "old")
+    assert not cache.check("a", "new")
+    assert cache.check("b", "b")
+
+    cache.invalidate()
+    assert len(cache) == 0
+
+
+def test_stamp_is_part_of_the_key():
+    cache = CredentialCache()
+    cache.add("user", "secret", "hash-1")
+
+    assert cache.check("user", "secret", "hash-1")
+    assert not cache.check("user", "secret", "hash-2")
+    assert not cache.check("user", "secret")
+
+
+@pytest.fixture
+def stored_user(mocker: pytest_mock.MockerFixture):
+    page_auth.credential_cache.invalidate()
+    user = User(name="user", password="hash-1", is_ldap_user=False)
+    mocker.patch.object(page_auth, "get_user", side_effect=lambda name: user)
+    yield user
+    page_auth.credential_cache.invalidate()
+
+
+def test_cached_credentials_log_the_user_in(
+    app: Flask, stored_user: User, mocker: pytest_mock.MockerFixture
+):
+    check = mocker.patch.object(page_auth, "check_password_hash", return_value=True)
+    for _ in range(2):
+        with app.test_request_context():
+            assert page_auth.verify_credentials("user", "secret") == "user"
+            assert g.user is stored_user
+            assert session["user_id"] == "user"
+    assert check.call_count == 1
+
+
+def test_changed_user_is_checked_again(
+    app: Flask, stored_user: User, mocker: pytest_mock.MockerFixture
+):
+    check = mocker.patch.object(page_auth, "check_password_hash", return_value=True)
+    with app.test_request_context():
+        assert page_auth.verify_credentials("user", "secret") == "user"
+
+    # as if another worker had set a new password
+    stored_user.password = "hash-2"
+    check.return_value = False
+    with app.test_request_context():
+        assert page_auth.verify_credentials("user", "secret") is None
+    assert check.call_count == 2
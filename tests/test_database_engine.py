@@ -0,0 +1,42 @@
+import pytest
+from sqlalchemy import text
+
+import fo_services.db as db
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    db.configure_engine(
+        {
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{tmp_path / 'test.db'}",
+            "SQLALCHEMY_POOL_SIZE": "1",
+            "SQLALCHEMY_MAX_OVERFLOW": "0",
+            "SQLALCHEMY_POOL_PRE_PING": "false",
+        }
+    )
+    yield
+    db.configure_engine({})
+
+
+def test_engine_is_built_on_first_use(sqlite_engine):
+    assert db._engine is None
+    engine = db.get_engine()
+    assert db.get_engine() is engine
+    assert engine.pool.size() == 1
+    assert engine.echo is False
+
+
+def test_queries_are_counted_per_context(sqlite_engine):
+    with db.track_queries() as stats:
+        db.db_session.execute(text("SELECT 1"))
+        db.db_session.execute(text("SELECT 2"))
+    db.db_session.execute(text("SELECT 3"))
+    db.db_session.remove()
+
+    assert stats.queries == 2
+    metrics = db.database_metrics()
+    assert metrics["queries"]["total"] == 3
+    assert metrics["queries"]["requests"] == 1
+    assert metrics["queries"]["per_request"]["le_2"] == 1
+    assert metrics["pool"]["checkouts"] >= 1
+    assert metrics["pool"]["checked_out"] == 0
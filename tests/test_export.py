@@ -0,0 +1,153 @@
+import datetime
+import gzip
+import os
+
+import numpy as np
+import pytest
+import pytest_mock
+from flask.testing import FlaskClient
+from sqlalchemy import event, text
+
+import fo_services.db as db
+from fo_services import api_maintenance_v1
+from fo_services.api_maintenance_v1 import _gzipped
+from fo_services.services.interaction_matrix import to_microseconds
+
+DATABASE_URI = os.environ.get("FO_TEST_DATABASE_URI")
+
+WATERMARK = datetime.datetime(2024, 5, 1, 12, 30)
+AUTH = {"Authorization": "Basic dGVzdDp0ZXN0"}
+
+
+def test_gzipped_chunks_decompress_to_input():
+    chunks = [b"wisski_user\twisski_item\tat\n"] + [
+        f"{i}\t{i * 7}\t2024-01-01 00:00:00\n".encode() for i in range(1000)
+    ]
+    assert gzip.decompress(b"".join(_gzipped(iter(chunks)))) == b"".join(chunks)
+
+
+def test_gzipped_empty_export_is_valid():
+    assert gzip.decompress(b"".join(_gzipped(iter([])))) == b""
+
+
+@pytest.fixture
+def exports(mocker: pytest_mock.MockerFixture):
+    mocker.patch.object(api_maintenance_v1, "verify_credentials", return_value="test")
+    mocker.patch.object(api_maintenance_v1, "export_watermark", return_value=WATERMARK)
+    export = mocker.patch.object(
+        api_maintenance_v1, "export_interaction_data", return_value=iter([b"rows\n"])
+    )
+    return export
+
+
+def test_export_is_bounded_by_the_watermark(client: FlaskClient, exports):
+    response = client.post("/maintenance/v1/db/export_interactions", headers=AUTH)
+
+    assert response.status_code == 200
+    assert response.data == b"rows\n"
+    assert response.headers["X-Export-Watermark"] == WATERMARK.isoformat()
+    exports.assert_called_once_with(WATERMARK, None)
+
+
+def test_watermark_is_the_since_of_the_next_export(client: FlaskClient, exports):
+    response = client.post(
+        "/maintenance/v1/db/export_interactions",
+        query_string={"since": "2024-05-01T11:00:00.250000"},
+        headers=AUTH,
+    )
+
+    assert response.status_code == 200
+    exports.assert_called_once_with(
+        WATERMARK, datetime.datetime(2024, 5, 1, 11, 0, 0, 250000)
+    )
+
+
+@pytest.mark.parametrize("since", ["yesterday", "2024-05-01T11:00:00+00:00"])
+def test_invalid_since_is_rejected(client: FlaskClient, exports, since: str):
+    response = client.post(
+        "/maintenance/v1/db/export_interactions",
+        query_string={"since": since},
+        headers=AUTH,
+    )
+
+    assert response.status_code == 400
+    assert "Invalid since" in response.json["message"]
+    exports.assert_not_called()
+
+
+def test_matrix_export_applies_since(
+    client: FlaskClient, exports, mocker: pytest_mock.MockerFixture
+):
+    matrix = mocker.patch.object(api_maintenance_v1, "interaction_matrix")
+    matrix.get.return_value.to_npz.return_value = b"npz"
+    since = datetime.datetime(2024, 5, 1, 11)
+
+    response = client.post(
+        "/maintenance/v1/db/export_interaction_matrix",
+        query_string={"since": since.isoformat()},
+        headers=AUTH,
+    )
+
+    assert response.status_code == 200
+    assert response.headers["X-Export-Watermark"] == WATERMARK.isoformat()
+    matrix.get.assert_called_once_with(WATERMARK)
+    matrix.get.return_value.to_npz.assert_called_once_with(to_microseconds(since))
+
+
+@pytest.fixture
+def database():
+    if DATABASE_URI is None:
+        pytest.skip("FO_TEST_DATABASE_URI is not set")
+    from fo_services.migrations import upgrade
+
+    db.configure_engine({"SQLALCHEMY_DATABASE_URI": DATABASE_URI})
+    engine = db.get_engine()
+    db.Base.metadata.drop_all(engine)
+    upgrade()
+    db.forget_users()
+
+    yield engine
+
+    db.db_session.remove()
+    db.forget_users()
+    db.configure_engine({})
+
+
+def test_incremental_exports_neither_skip_nor_repeat_rows(database):
+    # one row from before the lag of the watermark, one within it
+    db.log_interactions([(1, 10), (1, 11)])
+    db.db_session.execute(
+        text("UPDATE hist_interact SET at = at - :lag WHERE wisski_item = 10"),
+        {"lag": 2 * db.EXPORT_WATERMARK_LAG},
+    )
+    db.db_session.commit()
+    first = db.export_watermark()
+    second = first + 2 * db.EXPORT_WATERMARK_LAG
+
+    rows = [
+        b"".join(db.export_interaction_data(first)),
+        b"".join(db.export_interaction_data(second, since=first)),
+    ]
+    items = [
+        [line.split(b"\t")[1] for line in chunk.splitlines()[1:]] for chunk in rows
+    ]
+    assert items == [[b"10"], [b"11"]]
+    assert np.array_equal(db.get_interactions(second)[:, 1], [10, 11])
+
+
+def test_interactions_are_stamped_on_the_clock_of_the_watermark(database):
+    # a database whose local time is far off the local time of the app
+    def far_off(dbapi_connection, record):
+        dbapi_connection.execute("SET TIME ZONE 'Pacific/Kiritimati'")
+
+    database.dispose()
+    event.listen(database, "connect", far_off)
+    try:
+        db.log_interactions([(1, 10)])
+        stamped = db.db_session.scalar(text("SELECT at FROM hist_interact"))
+        now = db.db_session.scalar(text("SELECT LOCALTIMESTAMP"))
+        assert now - datetime.timedelta(seconds=5) <= stamped <= now
+        assert db.export_watermark() < stamped
+    finally:
+        db.db_session.remove()
+        event.remove(database, "connect", far_off)
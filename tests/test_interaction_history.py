@@ -0,0 +1,167 @@
+import datetime
+import os
+
+import pytest
+from sqlalchemy import text
+
+import fo_services.db as db
+from fo_services.db import _add_months, _month, interaction_partition_name
+from fo_services.migrations import upgrade
+
+
+def test_month_arithmetic():
+    assert _month(datetime.date(2024, 2, 29)) == datetime.date(2024, 2, 1)
+    assert _add_months(datetime.date(2024, 11, 1), 1) == datetime.date(2024, 12, 1)
+    assert _add_months(datetime.date(2024, 11, 1), 2) == datetime.date(2025, 1, 1)
+    assert _add_months(datetime.date(2024, 1, 1), -1) == datetime.date(2023, 12, 1)
+    assert _add_months(datetime.date(2024, 1, 1), 25) == datetime.date(2026, 2, 1)
+
+
+def test_partition_names_sort_by_month():
+    months = [datetime.date(2024, m, 1) for m in (1, 10, 12)]
+    names = [interaction_partition_name(m) for m in months]
+    assert names == ["hist_interact_202401", "hist_interact_202410", "hist_interact_202412"]
+    assert sorted(names) == names
+
+
+# partitions, rollups and retention, checked against a scratch database; set
+# FO_TEST_DATABASE_URI to a PostgreSQL database whose contents may be dropped
+
+DATABASE_URI = os.environ.get("FO_TEST_DATABASE_URI")
+
+needs_database = pytest.mark.skipif(
+    DATABASE_URI is None, reason="FO_TEST_DATABASE_URI is not set"
+)
+
+MARCH = datetime.date(2020, 3, 1)
+
+
+@pytest.fixture
+def database():
+    db.configure_engine({"SQLALCHEMY_DATABASE_URI": DATABASE_URI})
+    engine = db.get_engine()
+    db.Base.metadata.drop_all(engine)
+    upgrade()
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO rec_user (wisski_id, first_seen)"
+                " SELECT g, now() FROM generate_series(1, 3) g"
+            )
+        )
+
+    yield engine
+
+    db.db_session.remove()
+    db.configure_engine({})
+
+
+def interact(engine, *rows):
+    """Insert (user, item, at) rows, bypassing the partition maintenance."""
+    with engine.begin() as conn:
+        conn.execute(
+            text(
+                "INSERT INTO hist_interact (wisski_user, wisski_item, at)"
+                " VALUES (:u, :i, :at)"
+            ),
+            [{"u": u, "i": i, "at": at} for u, i, at in rows],
+        )
+
+
+def partitions_of_rows(engine):
+    with engine.connect() as conn:
+        return conn.execute(
+            text(
+                "SELECT tableoid::regclass::text, count(*) FROM hist_interact"
+                " GROUP BY 1 ORDER BY 1"
+            )
+        ).all()
+
+
+@needs_database
+def test_upcoming_partitions_are_created(database):
+    current = _month(datetime.date.today())
+    assert db.interaction_partitions() == [
+        _add_months(current, n) for n in range(db.INTERACTION_PARTITIONS_AHEAD + 1)
+    ]
+    # nothing left to create
+    assert db.ensure_interaction_partitions() == []
+
+
+@needs_database
+def test_stray_rows_are_moved_into_a_new_partition(database):
+    interact(
+        database,
+        (1, 10, datetime.datetime(2020, 3, 31, 23, 59)),
+        (1, 11, datetime.datetime(2020, 4, 1)),
+    )
+    assert partitions_of_rows(database) == [("hist_interact_default", 2)]
+
+    assert db.ensure_interaction_partitions() == [MARCH, _add_months(MARCH, 1)]
+    assert partitions_of_rows(database) == [
+        ("hist_interact_202003", 1),
+        ("hist_interact_202004", 1),
+    ]
+    with database.connect() as conn:
+        bound = conn.scalar(
+            text(
+                "SELECT pg_get_expr(relpartbound, oid) FROM pg_class"
+                " WHERE relname = 'hist_interact_202003'"
+            )
+        )
+    assert bound == (
+        "FOR VALUES FROM ('2020-03-01 00:00:00') TO ('2020-04-01 00:00:00')"
+    )
+
+
+@needs_database
+def test_partitions_are_created_for_months_asked_for(database):
+    assert db.ensure_interaction_partitions(months=[datetime.date(2020, 3, 15)]) == [MARCH]
+    interact(database, (1, 10, datetime.datetime(2020, 3, 15)))
+    assert partitions_of_rows(database) == [("hist_interact_202003", 1)]
+
+
+@needs_database
+def test_days_are_rolled_up_once_complete(database):
+    interact(
+        database,
+        (1, 10, datetime.datetime(2020, 3, 1, 8)),
+        (1, 10, datetime.datetime(2020, 3, 1, 9)),
+        (2, 10, datetime.datetime(2020, 3, 1, 10)),
+        (1, 11, datetime.datetime(2020, 3, 2, 8)),
+    )
+    db.ensure_interaction_partitions()
+
+    assert db.rollup_interactions(until=datetime.date(2020, 3, 2)) == (2, 1)
+    assert db.rolled_up_until() == datetime.date(2020, 3, 2)
+    with database.connect() as conn:
+        assert conn.execute(
+            text("SELECT day, wisski_item, interactions, users FROM interaction_daily_item")
+        ).all() == [(datetime.date(2020, 3, 1), 10, 3, 2)]
+
+    # the last rolled-up day is aggregated again
+    assert db.rollup_interactions(until=datetime.date(2020, 3, 3)) == (3, 2)
+    assert db.rolled_up_until() == datetime.date(2020, 3, 3)
+
+
+@needs_database
+def test_retention_keeps_what_is_not_rolled_up(database):
+    interact(
+        database,
+        (1, 10, datetime.datetime(2020, 3, 10)),
+        (1, 11, datetime.datetime(2020, 4, 10)),
+        (1, 12, datetime.datetime(2020, 4, 20)),
+    )
+    db.ensure_interaction_partitions()
+    # nothing rolled up, nothing pruned
+    assert db.prune_interactions(datetime.date(2020, 5, 1)) == ([], 0)
+
+    db.rollup_interactions(until=datetime.date(2020, 4, 15))
+    dropped, deleted = db.prune_interactions(datetime.date(2020, 5, 1))
+
+    # the cutoff is capped at the end of the rollup
+    assert dropped == [MARCH]
+    assert deleted == 1
+    assert MARCH not in db.interaction_partitions()
+    with database.connect() as conn:
+        assert conn.scalars(text("SELECT wisski_item FROM hist_interact")).all() == [12]
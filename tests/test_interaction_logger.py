@@ -0,0 +1,81 @@
+import threading
+
+from fo_services.services.interaction_logger import InteractionLogger, QueryLogger
+
+
+class RecordingWriter(object):
+    def __init__(self, fail=False):
+        self.batches = []
+        self.fail = fail
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, batch):
+        self.gate.wait(5)
+        if self.fail:
+            raise RuntimeError("database gone")
+        self.batches.append(list(batch))
+        return len(batch)
+
+
+def test_events_are_written_in_batches():
+    writer = RecordingWriter()
+    # hold the writer until everything is queued
+    writer.gate.clear()
+    interactions = InteractionLogger(writer, batch_size=4, flush_interval=60)
+    for i in range(10):
+        assert interactions.log(i % 3, 100 + i)
+    writer.gate.set()
+    interactions.stop()
+
+    events = [e for batch in writer.batches for e in batch]
+    assert events == [(i % 3, 100 + i) for i in range(10)]
+    assert all(len(batch) <= 4 for batch in writer.batches)
+    assert interactions.stats()["written"] == 10
+
+
+def test_anonymous_users_are_skipped():
+    writer = RecordingWriter()
+    interactions = InteractionLogger(writer)
+    assert not interactions.log("", 1)
+    assert not interactions.log(1, None)
+    interactions.stop()
+    assert writer.batches == []
+
+
+def test_full_queue_drops_events():
+    writer = RecordingWriter()
+    writer.gate.clear()
+    interactions = InteractionLogger(writer, max_queue=2, batch_size=1)
+    accepted = [interactions.log(1, i) for i in range(10)]
+    assert not all(accepted)
+    assert interactions.stats()["dropped"] == accepted.count(False)
+
+    writer.gate.set()
+    interactions.stop()
+    assert interactions.stats()["written"] == accepted.count(True)
+
+
+def test_failing_writer_keeps_running():
+    writer = RecordingWriter(fail=True)
+    interactions = InteractionLogger(writer, batch_size=1, flush_interval=60)
+    interactions.log(1, 1)
+    interactions.log(1, 2)
+    interactions.stop()
+
+    stats = interactions.stats()
+    assert stats["failed"] == 2
+    assert stats["written"] == 0
+
+
+def test_queries_are_logged_trimmed():
+    writer = RecordingWriter()
+    queries = QueryLogger(writer)
+    assert queries.log("  bayreuth opera ")
+    assert queries.log("x" * 1000)
+    assert not queries.log("   ")
+    assert not queries.log(None)
+    queries.stop()
+
+    logged = [q for batch in writer.batches for q in batch]
+    assert logged == ["bayreuth opera", "x" * QueryLogger.MAX_QUERY_LENGTH]
@@ -0,0 +1,127 @@
+import datetime
+import io
+
+import numpy as np
+
+from fo_services.services.interaction_matrix import (
+    InteractionMatrix,
+    InteractionMatrixCache,
+    to_microseconds,
+)
+
+T0 = datetime.datetime(2024, 5, 1, 12)
+
+
+def at(minutes):
+    return to_microseconds(T0 + datetime.timedelta(minutes=minutes))
+
+
+class FakeDB(object):
+    def __init__(self):
+        # (user, item, at)
+        self.interactions = []
+        # (user, first seen)
+        self.users = []
+        self.calls = []
+
+    def _window(self, rows, column, until, since):
+        return [
+            r for r in rows
+            if r[column] <= to_microseconds(until)
+            and (since is None or r[column] > to_microseconds(since))
+        ]
+
+    def fetch_interactions(self, until, since):
+        self.calls.append(since)
+        rows = self._window(self.interactions, 2, until, since)
+        return np.array(rows, dtype=np.int64).reshape(-1, 3)
+
+    def fetch_users(self, until, since):
+        return np.array([u for u, _ in self._window(self.users, 1, until, since)])
+
+
+def make_cache(tmp_path=None):
+    fake = FakeDB()
+    cache = InteractionMatrixCache(
+        str(tmp_path / "interactions.npz") if tmp_path else None,
+        fetch_users=fake.fetch_users,
+        fetch_interactions=fake.fetch_interactions,
+    )
+    return fake, cache
+
+
+def decode(matrix, since=None):
+    data = np.load(io.BytesIO(matrix.to_npz(since)))
+    rows = np.repeat(np.arange(len(data["user_ids"])), np.diff(data["indptr"]))
+    return data, list(
+        zip(
+            data["user_ids"][rows].tolist(),
+            data["item_ids"][data["indices"]].tolist(),
+            data["timestamps"].tolist(),
+        )
+    )
+
+
+def test_csr_export_orders_items_of_users_by_time():
+    fake, cache = make_cache()
+    fake.users = [(7, at(0)), (3, at(0)), (5, at(1))]
+    fake.interactions = [(3, 30, at(1)), (7, 10, at(2)), (3, 20, at(3)), (7, 30, at(4))]
+
+    data, rows = decode(cache.get(T0 + datetime.timedelta(minutes=10)))
+
+    assert data["user_ids"].tolist() == [7, 3, 5]
+    assert data["item_ids"].tolist() == [30, 10, 20]
+    # user 5 has no interactions, but a row of the matrix
+    assert data["indptr"].tolist() == [0, 2, 4, 4]
+    assert rows == [(7, 10, at(2)), (7, 30, at(4)), (3, 30, at(1)), (3, 20, at(3))]
+    assert int(data["watermark"]) == at(10)
+
+
+def test_only_new_interactions_are_fetched(tmp_path):
+    fake, cache = make_cache(tmp_path)
+    fake.interactions = [(1, 10, at(1))]
+    first = cache.get(T0 + datetime.timedelta(minutes=5))
+
+    fake.interactions += [(2, 20, at(6)), (1, 30, at(7))]
+    second = cache.get(T0 + datetime.timedelta(minutes=10))
+
+    assert fake.calls == [None, T0 + datetime.timedelta(minutes=5)]
+    assert len(first) == 1 and len(second) == 3
+    # indices of known ids don't change
+    assert second.user_ids.tolist() == [1, 2]
+    assert second.item_ids.tolist() == [10, 20, 30]
+
+    # up to date, nothing to fetch
+    cache.get(T0 + datetime.timedelta(minutes=10))
+    assert len(fake.calls) == 2
+
+    _, rows = decode(second, since=at(5))
+    assert rows == [(1, 30, at(7)), (2, 20, at(6))]
+
+
+def test_matrix_file_is_shared_and_reset(tmp_path):
+    fake, cache = make_cache(tmp_path)
+    fake.interactions = [(1, 10, at(1)), (2, 10, at(2))]
+    cache.get(T0 + datetime.timedelta(minutes=5))
+
+    # another worker continues from the file
+    other = InteractionMatrixCache(
+        cache.path,
+        fetch_users=fake.fetch_users,
+        fetch_interactions=fake.fetch_interactions,
+    )
+    assert len(other.get(T0 + datetime.timedelta(minutes=5))) == 2
+    assert len(fake.calls) == 1
+
+    other.reset()
+    assert len(cache.get(T0 + datetime.timedelta(minutes=5))) == 2
+    assert fake.calls[-1] is None
+
+
+def test_empty_matrix_round_trips(tmp_path):
+    path = str(tmp_path / "interactions.npz")
+    InteractionMatrix.empty().save(path)
+
+    matrix = InteractionMatrix.load(path)
+    assert matrix.watermark is None
+    assert len(matrix) == 0
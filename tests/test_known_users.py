@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+import pytest_mock
+
+from fo_services import db
+from fo_services.kgstuff import KGHandler
+from fo_services.kgstuff.snapshot import RecommendationSnapshot
+
+
+@pytest.fixture
+def session(mocker: pytest_mock.MockerFixture):
+    db.forget_users()
+    mocker.patch.object(db, "_known_user_probe", None)
+    session = mocker.patch.object(db, "db_session")
+    yield session
+    db.forget_users()
+
+
+def test_known_users_skip_the_database(session):
+    session.scalars.return_value.all.return_value = [2]
+
+    assert db.ensure_users([1, 2, 2]) == [2]
+    assert session.scalars.call_count == 1
+    session.commit.assert_called_once()
+
+    assert db.ensure_users([2, 1]) == []
+    assert not db.ensure_user(1)
+    assert session.scalars.call_count == 1
+
+
+def test_remembered_users(session):
+    db.remember_users([5, 6])
+    assert db.ensure_users([6, 5]) == []
+
+    db.forget_users([5])
+    session.scalars.return_value.all.return_value = []
+    assert not db.ensure_user(5)
+    assert session.scalars.call_count == 1
+
+
+def test_failed_insert_is_not_remembered(session):
+    session.scalars.side_effect = RuntimeError("database gone")
+    with pytest.raises(RuntimeError):
+        db.ensure_user(1)
+    session.rollback.assert_called_once()
+
+    session.scalars.side_effect = None
+    session.scalars.return_value.all.return_value = [1]
+    assert db.ensure_user(1)
+
+
+def test_users_of_the_model_skip_the_database(session):
+    kg = KGHandler()
+    kg.snapshots.loader = lambda marker: RecommendationSnapshot.from_rows(
+        1, np.array([(3, 10, 0), (7, 11, 0)]), np.empty(0)
+    )
+    kg.snapshots.probe = lambda: (1, 0)
+    db.set_known_user_probe(kg.has_user)
+    session.scalars.return_value.all.return_value = [3]
+
+    # no model served yet
+    assert db.ensure_users([3]) == [3]
+    db.forget_users()
+    kg.snapshots.get()
+
+    assert db.ensure_users([3, 7]) == []
+    assert session.scalars.call_count == 1
+    # model users are looked up, not copied
+    assert len(db._known_users) == 0
+
+
+def test_known_users_are_bounded(session, mocker: pytest_mock.MockerFixture):
+    mocker.patch.object(db, "MAX_KNOWN_USERS", 3)
+    db.remember_users(range(5))
+    assert list(db._known_users) == [2, 3, 4]
+
+    # remembering again makes a user the most recent one
+    db.remember_users([2, 5])
+    assert list(db._known_users) == [4, 2, 5]
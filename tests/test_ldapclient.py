@@ -7,8 +7,8 @@ from fo_services.LDAPAuthClient import _require_keys, LDAPConfig, LDAPAuthClient
 ldap_config = LDAPConfig(
     uri="FAKE_URI",
     starttls=True,
-    bind_dn="FAKE_DN",
-    bind_password="FAKE_PASSWORD",
+    bind_dn="cn=SERVICE,ou=TEST,o=TEST",
+    bind_password="SERVICE",
     base="ou=TEST,o=TEST",
     filter="(objectClass=*)",
 )
@@ -28,6 +28,21 @@ connection.strategy.add_entry(
     "cn=SEARCH,ou=TEST,o=TEST",
     {"userPassword": "SEARCH", "uid": "SEARCH", "objectClass": "person"},
 )
+connection.strategy.add_entry(
+    "cn=SERVICE,ou=TEST,o=TEST",
+    {"userPassword": "SERVICE", "objectClass": "account"},
+)
+
+
+def mock_connection(strategy=ldap3.MOCK_SYNC):
+    """Connection factory binding against the mock entries above."""
+
+    def factory(server, bind_dn, password):
+        return ldap3.Connection(
+            server, user=bind_dn, password=password, client_strategy=strategy
+        )
+
+    return factory
 
 
 def test_require_keys():
@@ -49,23 +64,14 @@ def test_simple_bind_starttls(mocker: pytest_mock.mocker, starttls: bool):
         filter="",
     )
     ldap_client = LDAPAuthClient(ldap_config)
-    connection = ldap3.Connection(
-        server,
-        user="cn=FAKE_USER,ou=TEST,o=TEST",
-        password="FAKE_PASSWORD",
-        client_strategy=ldap3.MOCK_ASYNC,
-    )
-    connection.strategy.add_entry(
-        "cn=FAKE_USER,ou=TEST,o=TEST", {"userPassword": "FAKE_PASSWORD"}
-    )
     mocker.patch.object(ldap_client, "get_server", return_value=server)
     mocker.patch.object(
-        ldap_client,
-        "connection",
-        connection,
+        ldap_client, "_new_connection", mock_connection(ldap3.MOCK_ASYNC)
     )
 
-    result, conn = ldap_client.simple_bind(server, "FAKE_DN", "FAKE_PASSWORD")
+    result, conn = ldap_client.simple_bind(
+        server, "cn=FAKE_USER,ou=TEST,o=TEST", "FAKE_PASSWORD"
+    )
     assert result
 
 
@@ -80,16 +86,8 @@ def test_simple_bind(
     mocker: pytest_mock.mocker, user: str, password: str, expected: bool
 ):
     mocker.patch.object(ldap_client, "get_server", return_value=server)
-    connection = ldap3.Connection(
-        server,
-        user=user,
-        password=password,
-        client_strategy=ldap3.MOCK_ASYNC,
-    )
     mocker.patch.object(
-        ldap_client,
-        "connection",
-        connection,
+        ldap_client, "_new_connection", mock_connection(ldap3.MOCK_ASYNC)
     )
 
     result, conn = ldap_client.simple_bind(server, user, password)
@@ -107,11 +105,7 @@ def test_simple_bind(
 def test_search(mocker: pytest_mock.mocker, user: str, password: str, expected: bool):
     mocker.patch.object(ldap_client, "get_server", return_value=server)
 
-    mocker.patch.object(
-        ldap_client,
-        "connection",
-        connection,
-    )
+    mocker.patch.object(ldap_client, "_new_connection", mock_connection())
 
     result, conn, obj = ldap_client.authenticated_search(
         server, password, [("uid", user)]
@@ -130,11 +124,128 @@ def test_search(mocker: pytest_mock.mocker, user: str, password: str, expected:
 def test_auth(mocker: pytest_mock.mocker, user: str, password: str, expected: bool):
     mocker.patch.object(ldap_client, "get_server", return_value=server)
 
-    mocker.patch.object(
-        ldap_client,
-        "connection",
-        connection,
-    )
+    mocker.patch.object(ldap_client, "_new_connection", mock_connection())
 
     result = ldap_client.auth(user, password)
     assert result == expected
+
+
+def pooled_client(mocker: pytest_mock.mocker, **pool) -> LDAPAuthClient:
+    client = LDAPAuthClient(LDAPConfig(**{**ldap_config.__dict__, **pool}))
+    mocker.patch.object(client, "get_server", return_value=server)
+    mocker.patch.object(client, "_new_connection", mock_connection())
+    return client
+
+
+def test_service_connection_is_reused(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker)
+
+    assert client.auth("SEARCH", "SEARCH")
+    assert client.auth("SEARCH", "SEARCH")
+    assert client.auth("SEARCH", "BAD") is None
+
+    metrics = client.metrics()
+    assert metrics["created"] == 1
+    assert metrics["reused"] == 2
+    assert metrics["open"] == metrics["idle"] == 1
+    assert metrics["user_binds"] == 3
+
+
+def test_broken_service_connection_is_replaced(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker)
+    with client.service_connection(server) as conn:
+        pass
+    conn.unbind()
+
+    assert client.auth("SEARCH", "SEARCH")
+    metrics = client.metrics()
+    assert metrics["created"] == 2
+    assert metrics["discarded"] == 1
+    assert metrics["open"] == 1
+
+
+def test_failed_search_does_not_return_connection(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker)
+    with pytest.raises(RuntimeError):
+        with client.service_connection(server):
+            raise RuntimeError("search failed")
+
+    assert client.metrics()["open"] == 0
+
+
+def test_pool_exhausted(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker, pool_size=1, pool_timeout=0.01)
+    with client.service_connection(server):
+        with pytest.raises(ldap3.core.exceptions.LDAPException):
+            with client.service_connection(server):
+                pass
+
+    metrics = client.metrics()
+    assert metrics["exhausted"] == 1
+    assert metrics["waits"] == 1
+
+
+def test_bad_service_credentials(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker, bind_password="BAD")
+    assert client.authenticated_search(server, "SEARCH", [("uid", "SEARCH")]) == (
+        False,
+        None,
+        None,
+    )
+    assert client.metrics()["open"] == 0
+
+
+def test_dead_service_connection_is_retried_on_a_fresh_one(
+    mocker: pytest_mock.mocker,
+):
+    client = pooled_client(mocker)
+    assert client.auth("SEARCH", "SEARCH")
+    # the server dropped the idle connection
+    (idle, _), = list(client._pool.queue)
+    mocker.patch.object(
+        idle,
+        "search",
+        side_effect=ldap3.core.exceptions.LDAPSessionTerminatedByServerError("gone"),
+    )
+
+    assert client.auth("SEARCH", "SEARCH")
+    metrics = client.metrics()
+    assert metrics["retries"] == 1
+    assert metrics["created"] == 2
+    assert metrics["discarded"] == 1
+    assert metrics["open"] == 1
+
+
+def test_search_is_retried_once(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker)
+    search = mocker.patch.object(
+        ldap3.Connection,
+        "search",
+        side_effect=ldap3.core.exceptions.LDAPSocketReceiveError("unreachable"),
+    )
+
+    assert client.auth("SEARCH", "SEARCH") is None
+    assert search.call_count == 2
+    assert client.metrics()["retries"] == 1
+    assert client.metrics()["open"] == 0
+
+
+def test_error_result_is_retried(mocker: pytest_mock.mocker):
+    client = pooled_client(mocker)
+    search = ldap3.Connection.search
+    busy = {"result": 51, "description": "busy"}
+    calls = []
+
+    def busy_once(conn, *args, **kwargs):
+        calls.append(conn)
+        found = search(conn, *args, **kwargs)
+        if len(calls) == 1:
+            conn.result = busy
+        return found
+
+    mocker.patch.object(ldap3.Connection, "search", busy_once)
+
+    assert client.auth("SEARCH", "SEARCH")
+    assert len(calls) == 2
+    assert calls[0] is not calls[1]
+    assert client.metrics()["retries"] == 1
@@ -0,0 +1,143 @@
+import os
+import subprocess
+import sys
+
+from flask import Flask
+
+from fo_services.LDAPAuthClient import LDAPAuthClient, LDAPConfig
+from fo_services.metrics import (
+    COUNTER,
+    GAUGE,
+    HISTOGRAM,
+    Metrics,
+    _key,
+    _publish_process_metrics,
+    _ValueFile,
+    init_app,
+    metrics,
+    phase,
+)
+
+
+def dead_pid():
+    # a process that has exited, and been waited for
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def test_counters_are_summed_over_processes(tmp_path):
+    m = Metrics(str(tmp_path))
+    m.describe("requests_total", COUNTER, "Requests.")
+    m.describe("queued", GAUGE, "Queued.")
+    m.inc("requests_total", endpoint="/a")
+    m.inc("requests_total", 2, endpoint="/a")
+    m.set("queued", 5)
+
+    # a worker that has exited since
+    other = _ValueFile(str(tmp_path / f"metrics-{dead_pid()}.bin"))
+    other.add(_key("c", "requests_total", {"endpoint": "/a"}), 4)
+    other.add(_key("c", "requests_total", {"endpoint": "/b"}), 1)
+    other.set(_key("g", "queued", {}), 7)
+    other.close()
+
+    samples = m.collect()
+    assert samples["requests_total", 'endpoint="/a"'] == 7
+    assert samples["requests_total", 'endpoint="/b"'] == 1
+    # gauges of processes that are gone are left out
+    assert dict((k, v) for k, v in samples.items() if k[0] == "queued") == {
+        ("queued", f'pid="{os.getpid()}"'): 5
+    }
+
+    m.remove_dead()
+    assert os.listdir(tmp_path) == [f"metrics-{os.getpid()}.bin"]
+    m.reset()
+
+
+def test_histograms_are_rendered_cumulatively(tmp_path):
+    m = Metrics(str(tmp_path))
+    m.describe("duration_seconds", HISTOGRAM, "Duration.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.7, 3.0):
+        m.observe("duration_seconds", value, buckets=(0.1, 1.0), endpoint="/a")
+
+    lines = m.render().splitlines()
+    assert lines == [
+        "# HELP duration_seconds Duration.",
+        "# TYPE duration_seconds histogram",
+        'duration_seconds_bucket{endpoint="/a",le="0.1"} 1',
+        'duration_seconds_bucket{endpoint="/a",le="1"} 3',
+        'duration_seconds_bucket{endpoint="/a",le="+Inf"} 4',
+        'duration_seconds_count{endpoint="/a"} 4',
+        'duration_seconds_sum{endpoint="/a"} 4.25',
+    ]
+    m.reset()
+
+
+def test_value_file_grows(tmp_path):
+    values = _ValueFile(str(tmp_path / "metrics-1.bin"))
+    for i in range(5000):
+        values.add(_key("c", "series", {"n": i}), i)
+    values.close()
+
+    entries = dict(_ValueFile.read(str(tmp_path / "metrics-1.bin")))
+    assert len(entries) == 5000
+    assert entries[_key("c", "series", {"n": 4999})] == 4999
+
+
+def test_requests_are_recorded_per_endpoint(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config["METRICS_DIR"] = str(tmp_path / "metrics")
+    init_app(app)
+
+    @app.route("/items/<int:item>")
+    def item(item):
+        with phase("auth"):
+            pass
+        if item == 0:
+            raise ValueError("no item")
+        return "ok"
+
+    client = app.test_client()
+    client.get("/items/1")
+    client.get("/items/2")
+    client.get("/items/0")
+
+    samples = metrics.collect()
+    endpoint = 'endpoint="/items/<int:item>"'
+    assert samples["fo_http_requests_total", f'{endpoint},method="GET",status="200"'] == 2
+    assert samples["fo_http_requests_total", f'{endpoint},method="GET",status="500"'] == 1
+    assert samples["fo_http_request_errors_total", f'{endpoint},method="GET"'] == 1
+    assert samples["fo_http_request_duration_seconds_count", endpoint] == 3
+    for name in ("auth", "db", "serialize", "other"):
+        assert ("fo_http_request_phase_seconds_total", f'{endpoint},phase="{name}"') in samples
+    metrics.reset()
+    metrics.directory = None
+
+
+def test_ldap_pool_is_published(tmp_path):
+    app = Flask(__name__, instance_path=str(tmp_path))
+    app.config["METRICS_DIR"] = str(tmp_path / "metrics")
+    init_app(app)
+    client = LDAPAuthClient(
+        LDAPConfig(
+            uri="FAKE_URI",
+            starttls=False,
+            base="FAKE_BASE",
+            bind_dn="FAKE_DN",
+            bind_password="FAKE_PASSWORD",
+            filter="",
+        )
+    )
+    client._metrics.update(created=3, reused=5, retries=1)
+    app.extensions["ldap_client"] = client
+
+    with app.app_context():
+        _publish_process_metrics()
+
+    samples = metrics.collect()
+    assert samples["fo_ldap_connections_total", 'event="created"'] == 3
+    assert samples["fo_ldap_connections_total", 'event="reused"'] == 5
+    assert samples["fo_ldap_search_retries_total", ""] == 1
+    assert samples["fo_ldap_pool_open", f'pid="{os.getpid()}"'] == 0
+    metrics.reset()
+    metrics.directory = None
@@ -0,0 +1,64 @@
+import os
+
+import numpy as np
+import pytest
+
+from fo_services.kgstuff.model_file import read_model_file, write_model_file
+from fo_services.kgstuff.snapshot import RecommendationSnapshot
+
+reco_rows = np.array([(7, 30, 2), (3, 10, 0), (7, 31, 0), (3, 11, 1), (7, 32, 1)])
+snapshot = RecommendationSnapshot.from_rows(
+    4,
+    reco_rows,
+    np.array([99, 98]),
+    revision=2,
+    cluster_rows=np.array([(10, 1), (30, 2)]),
+    neighbour_rows=np.array([(10, 11, 0), (10, 12, 1)]),
+)
+
+
+def test_roundtrip(tmp_path):
+    path = tmp_path / "model.bin"
+    write_model_file(str(path), snapshot)
+    mapped = read_model_file(str(path))
+
+    assert mapped.marker == (4, 2)
+    assert mapped.items_for(7).tolist() == [31, 32, 30]
+    assert mapped.ranks_for(3).tolist() == [0, 1]
+    assert mapped.fallback.tolist() == [99, 98]
+    assert mapped.clusters_of([10, 30, 31]).tolist() == [1, 2, -1]
+    assert mapped.neighbours_of(10).tolist() == [11, 12]
+
+    # zero-copy views of the read-only mapping
+    assert not mapped.items.flags.owndata
+    with pytest.raises(ValueError):
+        mapped.items[0] = 1
+
+
+def test_empty_model(tmp_path):
+    path = tmp_path / "model.bin"
+    empty = RecommendationSnapshot.from_rows(None, np.empty((0, 3)), np.empty(0))
+    write_model_file(str(path), empty)
+    mapped = read_model_file(str(path))
+    assert mapped.marker is None
+    assert len(mapped) == 0
+
+
+def test_replace_keeps_existing_mappings(tmp_path):
+    path = tmp_path / "model.bin"
+    write_model_file(str(path), snapshot)
+    old = read_model_file(str(path))
+
+    newer = RecommendationSnapshot.from_rows(5, reco_rows[:2], np.array([1]))
+    write_model_file(str(path), newer)
+
+    assert old.items_for(7).tolist() == [31, 32, 30]
+    assert read_model_file(str(path)).marker == (5, 0)
+    assert os.listdir(tmp_path) == ["model.bin"]
+
+
+def test_rejects_other_files(tmp_path):
+    path = tmp_path / "model.bin"
+    path.write_bytes(b"not a model at all")
+    with pytest.raises(ValueError):
+        read_model_file(str(path))
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import pytest_mock
+
+from fo_services.kgstuff import KGHandler
+from fo_services.kgstuff.pagination import (
+    CursorCodec,
+    InvalidCursor,
+    PageCursor,
+    StaleCursor,
+)
+from fo_services.kgstuff.snapshot import RecommendationSnapshot, SnapshotStore
+
+reco_rows = np.array([(1, 100 + i, i) for i in range(7)])
+fallback = np.arange(50, 55)
+
+
+@pytest.fixture
+def kg(mocker: pytest_mock.MockerFixture):
+    markers = [(1, 0)]
+    kg = KGHandler()
+    kg.snapshots = SnapshotStore(
+        lambda marker: RecommendationSnapshot.from_rows(
+            marker[0], reco_rows, fallback, revision=marker[1]
+        ),
+        lambda: markers[-1],
+    )
+    mocker.patch.object(kg, "_register_users")
+    kg.markers = markers
+    return kg
+
+
+def test_codec_roundtrip():
+    codec = CursorCodec("secret")
+    cursor = PageCursor(user=42, marker=(3, 1), position=20)
+    token = codec.encode(cursor)
+    assert codec.decode(token) == cursor
+
+    with pytest.raises(InvalidCursor):
+        CursorCodec("other").decode(token)
+    with pytest.raises(InvalidCursor):
+        codec.decode("garbage")
+
+
+@pytest.mark.parametrize(("user", "expected"), ((1, list(range(100, 107))), (2, list(range(50, 55)))))
+def test_pages(kg: KGHandler, user: int, expected):
+    pages = []
+    items, cursor = kg.recommend_page(user, 3)
+    pages.append(items)
+    while cursor is not None:
+        items, cursor = kg.recommend_page(user, 3, cursor=cursor)
+        pages.append(items)
+
+    assert [i for page in pages for i in page] == expected
+    assert all(len(page) == 3 for page in pages[:-1])
+
+
+def test_offset_applies_to_fallback(kg: KGHandler):
+    assert kg.recommend_me_something(2, 2, 1) == [51, 52]
+    assert kg.recommend_me_something(1, 2, 6) == [106]
+    assert kg.recommend_me_something(1, 2, 7) == []
+
+
+def test_cursor_checks(kg: KGHandler):
+    _, cursor = kg.recommend_page(1, 3)
+    with pytest.raises(InvalidCursor):
+        kg.recommend_page(2, 3, cursor=cursor)
+
+    kg.markers.append((2, 0))
+    kg.snapshots.invalidate()
+    with pytest.raises(StaleCursor):
+        kg.recommend_page(1, 3, cursor=cursor)
@@ -0,0 +1,121 @@
+import os
+import os.path
+
+import pytest
+from sqlalchemy import text
+
+import fo_services.db as db
+from fo_services.kgstuff.query_expansion import (
+    QueryExpander,
+    QueryIndex,
+    TermCooccurrence,
+    read_catalogue,
+    tokenize,
+)
+
+entries = [
+    (1, "Lázaro Cárdenas president mexico"),
+    (2, "Cárdenas family archive"),
+    (3, "mexico city photographs"),
+    (4, "bayreuth opera photographs"),
+    (5, "bayreuth festival"),
+    (6, "wolfgang petry"),
+    (7, "opera house"),
+    (8, "archive of the festival"),
+    (9, "president portrait"),
+    (10, "mexico"),
+]
+index = QueryIndex(entries, clusters={4: 0, 5: 0, 7: 0})
+
+DATABASE_URI = os.environ.get("FO_TEST_DATABASE_URI")
+
+
+def test_tokenize():
+    assert tokenize("Mr. Cárdenas, 1934_x") == ["mr", "cárdenas", "1934", "x"]
+    assert tokenize("") == []
+
+
+def test_complete():
+    assert index.complete("pho") == ["photographs"]
+    assert index.complete("pre") == ["president"]
+    # too short to complete
+    assert index.complete("ph") == []
+    assert index.complete("xyz") == []
+
+
+def test_related_terms():
+    related = index.related_terms(["bayreuth"])
+    assert {"opera", "festival", "photographs"} <= set(related)
+    # from the cluster, not from an entity containing "bayreuth"
+    assert "house" in related
+
+
+def test_read_catalogue():
+    path = os.path.join(os.path.dirname(__file__), "..", "data", "items_id.txt")
+    entries = read_catalogue(path)
+    assert entries[0] == (10081, "wisski/navigate/10081/view")
+
+    # generic terms and ids are not suggested
+    catalogue = QueryIndex(entries)
+    assert len(catalogue) == len(entries)
+    assert catalogue.related_terms(["10081"]) == {}
+
+
+def test_cooccurrence():
+    cooccurrence = TermCooccurrence(
+        ["Cárdenas Mexico", "cardenas mexico 1934", "mexico revolution"]
+    )
+
+    assert dict(cooccurrence.related("mexico")) == {
+        "cardenas": 1,
+        "cárdenas": 1,
+        "revolution": 1,
+    }
+    assert cooccurrence.related("1934") == []
+
+
+def test_cooccurrence_keeps_the_most_used_terms():
+    queries = [f"t{i} u{i}" for i in range(100)] + ["common t1", "common t2"]
+    cooccurrence = TermCooccurrence(queries, max_terms=10)
+    assert len(cooccurrence) == 10
+    assert dict(cooccurrence.related("common")) == {"t1": 1, "t2": 1}
+
+
+def test_expand():
+    expander = QueryExpander()
+    assert expander.expand(index, "") == []
+
+    keywords = expander.expand(index, "bayreuth opera")
+    assert "opera" not in keywords
+    assert keywords[0] in {"festival", "photographs", "house"}
+
+    # completion of an unfinished last word
+    assert expander.expand(index, "mexico pres")[0] == "president"
+
+    assert expander.expand(index, "schlager") == []
+    logged = QueryIndex(entries, queries=["wolfgang petry schlager"] * 3)
+    assert expander.expand(logged, "schlager")[:2] == ["petry", "wolfgang"]
+
+
+@pytest.mark.skipif(DATABASE_URI is None, reason="FO_TEST_DATABASE_URI is not set")
+def test_logged_queries_are_read_back_within_the_retention():
+    from fo_services.migrations import upgrade
+
+    db.configure_engine({"SQLALCHEMY_DATABASE_URI": DATABASE_URI})
+    engine = db.get_engine()
+    db.Base.metadata.drop_all(engine)
+    upgrade()
+    try:
+        assert db.log_search_queries(["old query", "bayreuth opera", "mexico"]) == 3
+        with engine.begin() as conn:
+            conn.execute(
+                text("UPDATE search_query SET at = at - :age WHERE text = 'old query'"),
+                {"age": db.SEARCH_QUERY_RETENTION},
+            )
+
+        assert sorted(db.get_search_queries()) == ["bayreuth opera", "mexico"]
+        assert len(db.get_search_queries(limit=1)) == 1
+        assert db.prune_search_queries() == 1
+    finally:
+        db.db_session.remove()
+        db.configure_engine({})
@@ -0,0 +1,63 @@
+import numpy as np
+
+from fo_services.kgstuff.ranking import RankingEngine
+from fo_services.kgstuff.snapshot import RecommendationSnapshot
+
+reco_rows = np.array(
+    [
+        # user, item, rank
+        (1, 10, 0),
+        (1, 11, 1),
+        (1, 20, 2),
+        (2, 30, 0),
+    ]
+)
+cluster_rows = np.array(
+    [
+        # item, cluster
+        (10, 0),
+        (11, 0),
+        (12, 0),
+        (20, 1),
+        (21, 1),
+        (30, 2),
+        (31, 2),
+    ]
+)
+engine = RankingEngine(
+    RecommendationSnapshot.from_rows(1, reco_rows, np.array([]), 0, cluster_rows)
+)
+
+
+def test_rank_profile():
+    candidates = [99, 21, 12, 20, 11, 10, 31]
+    ranking = engine.rank(1, candidates)
+
+    ranked = [candidates[i] for i in ranking["order"]]
+    # the user's main cluster outweighs a weak recommendation
+    assert ranked == [10, 11, 12, 20, 21, 99, 31]
+    assert sorted(candidates[i] for i in ranking["recommended"]) == [10, 11, 20]
+    assert sorted(candidates[i] for i in ranking["affine"]) == [12, 21]
+    assert ranking["reason"] == "profile"
+
+
+def test_rank_keeps_order_without_profile():
+    candidates = [31, 10, 99]
+    for user in (None, 5):
+        ranking = engine.rank(user, candidates)
+        assert ranking["order"].tolist() == [0, 1, 2]
+        assert ranking["reason"] == "no-profile"
+
+    assert engine.rank(1, [])["reason"] == "empty"
+
+
+def test_rank_unknown_candidates():
+    ranking = engine.rank(2, [-1, 5, 31, 30])
+    assert ranking["order"].tolist() == [3, 2, 0, 1]
+
+
+def test_rank_many_candidates():
+    candidates = np.arange(10000)[::-1]
+    ranking = engine.rank(1, candidates)
+    assert sorted(ranking["order"].tolist()) == list(range(10000))
+    assert candidates[ranking["order"][0]] == 10
@@ -0,0 +1,93 @@
+import contextlib
+import datetime
+import struct
+
+import numpy as np
+
+from fo_services.db import copy_arrays
+from fo_services.services.interaction_matrix import to_microseconds
+from fo_services.services.sample_data import SampleData, SampleScale
+
+NOW = datetime.datetime(2024, 6, 15, 12, 0)
+SCALE = SampleScale(users=500, items=2000, clusters=10, recos_per_user=15, seed=3)
+
+
+def _concat(blocks):
+    return [np.concatenate(parts) for parts in zip(*blocks)]
+
+
+def test_same_seed_same_data():
+    a, b = SampleData(SCALE, now=NOW), SampleData(SCALE, now=NOW)
+    for x, y in zip(_concat(a.interactions()), _concat(b.interactions())):
+        np.testing.assert_array_equal(x, y)
+    for x, y in zip(_concat(a.recommendations()), _concat(b.recommendations())):
+        np.testing.assert_array_equal(x, y)
+
+
+def test_interactions_follow_popularity():
+    data = SampleData(SCALE, now=NOW)
+    users, items, at = _concat(data.interactions())
+    _, first_seen = data.users()
+    assert np.all(at >= first_seen[users])
+    assert np.all(at <= to_microseconds(NOW))
+    counts = np.bincount(items, minlength=SCALE.items)
+    # the most popular tenth of the items gets most interactions
+    top = counts[data.by_popularity[: SCALE.items // 10]].sum()
+    assert top > len(items) / 2
+    assert data.months()[0] <= datetime.date(2023, 12, 1)
+    assert data.months()[-1] == datetime.date(2024, 6, 1)
+
+
+def test_recommendations_are_distinct_and_ranked():
+    users, items, ranks = _concat(SampleData(SCALE, now=NOW).recommendations())
+    assert len(np.unique(users * SCALE.items + items)) == len(users)
+    for user in range(0, SCALE.users, 50):
+        mine = ranks[users == user]
+        np.testing.assert_array_equal(mine, np.arange(len(mine)))
+        assert 0 < len(mine) <= SCALE.recos_per_user
+
+
+def test_cluster_ranks_are_contiguous():
+    items, clusters, ranks = SampleData(SCALE, now=NOW).clusters()
+    np.testing.assert_array_equal(np.sort(items), np.arange(SCALE.items))
+    assert set(np.unique(clusters)) <= set(range(-1, SCALE.clusters))
+    for cluster in np.unique(clusters):
+        np.testing.assert_array_equal(
+            np.sort(ranks[clusters == cluster]), np.arange((clusters == cluster).sum())
+        )
+
+
+class CopyCursor(object):
+    def __init__(self, types):
+        self.types = types
+        self.written = b""
+
+    def execute(self, query, params=None):
+        pass
+
+    def fetchall(self):
+        return list(self.types.items())
+
+    @contextlib.contextmanager
+    def copy(self, statement):
+        cursor = self
+
+        class Copy(object):
+            def write(self, data):
+                cursor.written += data
+
+        yield Copy()
+
+
+def test_copy_arrays_binary_rows():
+    cursor = CopyCursor({"wisski_id": "int8", "first_seen": "timestamp"})
+    n = copy_arrays(
+        cursor,
+        "rec_user",
+        {"wisski_id": np.array([7, 8]), "first_seen": np.array([946_684_800_000_001, 0])},
+    )
+    assert n == 2
+    assert cursor.written.startswith(b"PGCOPY\n\xff\r\n\x00")
+    assert cursor.written.endswith(struct.pack(">h", -1))
+    row = struct.unpack(">hiqiq", cursor.written[19 : 19 + 26])
+    assert row == (2, 8, 7, 8, 1)
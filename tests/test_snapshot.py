@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from fo_services.kgstuff.snapshot import RecommendationSnapshot, SnapshotStore
+
+reco_rows = np.array(
+    [
+        # user, item, rank
+        (7, 30, 2),
+        (3, 10, 0),
+        (7, 31, 0),
+        (3, 11, 1),
+        (7, 32, 1),
+    ]
+)
+snapshot = RecommendationSnapshot.from_rows(1, reco_rows, np.array([99, 98]))
+
+
+@pytest.mark.parametrize(
+    ("user", "expected"),
+    (
+        (3, [10, 11]),
+        (7, [31, 32, 30]),
+        (5, None),
+        (0, None),
+        (100, None),
+    ),
+)
+def test_items_for(user: int, expected):
+    items = snapshot.items_for(user)
+    if expected is None:
+        assert items is None
+        assert not snapshot.has_user(user)
+    else:
+        assert items.tolist() == expected
+        assert snapshot.has_user(user)
+
+
+def test_snapshot_is_read_only():
+    assert len(snapshot) == 2
+    assert snapshot.fallback.tolist() == [99, 98]
+    with pytest.raises(ValueError):
+        snapshot.items[0] = 1
+
+
+def test_empty_snapshot():
+    empty = RecommendationSnapshot.from_rows(None, np.empty((0, 3)), np.array([]))
+    assert len(empty) == 0
+    assert empty.items_for(1) is None
+
+
+def load(marker):
+    return RecommendationSnapshot.from_rows(
+        marker[0], reco_rows, np.array([]), revision=marker[1]
+    )
+
+
+def test_store_reloads_on_new_version():
+    markers = [(1, 0)]
+    loads = []
+
+    def loader(marker):
+        loads.append(marker)
+        return load(marker)
+
+    store = SnapshotStore(loader, lambda: markers[-1], check_interval=3600)
+    assert store.get().version == 1
+    assert store.get().version == 1
+    assert loads == [(1, 0)]
+
+    # not yet due for a check
+    markers.append((2, 0))
+    assert store.get().version == 1
+
+    store.invalidate()
+    assert store.get().version == 2
+
+    # a delta update applied to the active version
+    markers.append((2, 1))
+    store.invalidate()
+    assert store.get().marker == (2, 1)
+    assert loads == [(1, 0), (2, 0), (2, 1)]
+
+
+def test_store_keeps_snapshot_on_error():
+    def probe():
+        if calls:
+            raise RuntimeError("database gone")
+        calls.append(1)
+        return (1, 0)
+
+    calls = []
+    store = SnapshotStore(load, probe, check_interval=0)
+    first = store.get()
+    assert store.get() is first
+
+
+def test_neighbours_of():
+    neighbours = RecommendationSnapshot.from_rows(
+        1,
+        reco_rows,
+        np.array([]),
+        # item, neighbour, rank
+        neighbour_rows=np.array([(10, 12, 1), (10, 11, 0), (30, 10, 0)]),
+    )
+    assert neighbours.neighbours_of(10).tolist() == [11, 12]
+    assert neighbours.neighbours_of(30).tolist() == [10]
+    assert neighbours.neighbours_of(20).tolist() == []
+    assert snapshot.neighbours_of(10).tolist() == []
+
+
+def test_store_with_opaque_markers():
+    markers = [("catalogue", 1)]
+    store = SnapshotStore(lambda marker: [marker], lambda: markers[-1], check_interval=0)
+    assert store.get() == [("catalogue", 1)]
+    markers.append(("catalogue", 2))
+    assert store.get() == [("catalogue", 2)]
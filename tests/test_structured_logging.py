@@ -0,0 +1,98 @@
+import json
+import logging
+import threading
+
+import pytest
+
+from fo_services import structured_logging
+from fo_services.structured_logging import QueueLogHandler, StructuredMessage
+
+
+@pytest.fixture
+def log_settings():
+    settings = structured_logging.settings
+    previous = settings.max_items, settings.modules
+    yield settings
+    settings.max_items, settings.modules = previous
+
+
+class Collect(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.messages = []
+        self.threads = set()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def emit(self, record):
+        self.gate.wait(5)
+        self.threads.add(threading.current_thread().name)
+        self.messages.append(self.format(record))
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    logger.addHandler(handler)
+    return logger
+
+
+def test_long_lists_are_truncated(log_settings):
+    log_settings.max_items = 3
+    log_settings.modules = {"ranking": {"max_items": 1}}
+
+    message = json.loads(str(StructuredMessage(module="other", ids=[1, 2, 3, 4], n=[1])))
+    assert message["ids"] == [1, 2, 3] and message["ids_count"] == 4
+    assert message["n"] == [1] and "n_count" not in message
+
+    message = json.loads(str(StructuredMessage(module="ranking", ids=[1, 2])))
+    assert message["ids"] == [1] and message["ids_count"] == 2
+
+
+def test_records_are_written_by_a_background_thread(log_settings):
+    collect = Collect()
+    handler = QueueLogHandler([collect])
+    logger = make_logger("test_structured_logging.background", handler)
+
+    logger.info(StructuredMessage(module="ranking", user=1))
+    logger.info("plain %s", "text")
+    handler.stop()
+    logger.removeHandler(handler)
+
+    assert json.loads(collect.messages[0])["user"] == 1
+    assert collect.messages[1] == "plain text"
+    assert threading.current_thread().name not in collect.threads
+
+
+def test_messages_are_sampled_per_module(log_settings):
+    log_settings.modules = {"recommendation": {"sample": 0.0}}
+    collect = Collect()
+    handler = QueueLogHandler([collect])
+    logger = make_logger("test_structured_logging.sampling", handler)
+
+    for _ in range(10):
+        logger.info(StructuredMessage(module="recommendation"))
+        logger.info(StructuredMessage(module="ranking"))
+    handler.stop()
+    logger.removeHandler(handler)
+
+    assert [json.loads(m)["module"] for m in collect.messages] == ["ranking"] * 10
+
+
+def test_records_are_dropped_when_the_queue_is_full(log_settings):
+    collect = Collect()
+    collect.gate.clear()
+    handler = QueueLogHandler([collect], max_queue=2)
+    logger = make_logger("test_structured_logging.full", handler)
+
+    for i in range(10):
+        logger.info("record %d", i)
+    dropped = handler.stats()["dropped"]
+    collect.gate.set()
+    handler.stop()
+    logger.removeHandler(handler)
+
+    # the writer holds one record, the queue two more
+    assert dropped >= 7
+    assert len(collect.messages) == 10 - dropped